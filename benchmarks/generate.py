@@ -0,0 +1,133 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+NUCLEOTIDES = np.array(list("ACGT"), dtype="S1")
+SUMMARY_COLUMNS = ["file", "k", "bin", "bias_mean", "bias_median", "bias_modus", "percentile_5", "percentile_95"]
+BIN_K = 5
+
+
+def kmer_pairs(k):
+    """
+    Function to enumerate every k-mer paired with its reverse complement once, the way analysis outputs
+    list them, i.e. (4^K + number of palindromes) / 2 pairs.
+    :return: tuple of arrays of k-mer and rev. complement strings
+    """
+    codes = np.arange(4 ** k, dtype=np.int64)
+    rest, complements = codes.copy(), np.zeros_like(codes)
+    for _ in range(k):
+        complements = (complements << 2) | (3 - (rest & 3))
+        rest >>= 2
+    keep = codes <= complements
+    return _decode(codes[keep], k), _decode(complements[keep], k)
+
+
+def _decode(codes, k):
+    letters = np.empty((len(codes), k), dtype="S1")
+    for i in range(k - 1, -1, -1):
+        letters[:, i] = NUCLEOTIDES[codes & 3]
+        codes = codes >> 2
+    return np.ascontiguousarray(letters).view("S{}".format(k)).ravel().astype(str)
+
+
+def kmer_table(k, rng, depth=10 ** 6):
+    """
+    Function to generate counts of all k-mers of given K with the columns of df_output files, sorted by strand bias
+    in descending order like the analysis writes them.
+    :param k: length of k-mers
+    :param rng: numpy random generator
+    :param depth: typical count of a k-mer
+    :return: DataFrame with seq, seq_count, rev_complement, rev_complement_count, ratio, strand_bias_% and GC_%
+    """
+    seq, rev_complement = kmer_pairs(k)
+    counts = np.round(rng.lognormal(np.log(depth / 4 ** (k - 5)), 1.0, size=len(seq))) + 1
+    # strand bias of most k-mers is small, few have a strong one
+    ratio = np.clip(1 - rng.beta(0.5, 12, size=len(seq)), 0, 1)
+    forward = rng.random(len(seq)) < 0.5
+    seq_count = np.where(forward, counts, np.round(counts * ratio))
+    rev_complement_count = np.where(forward, np.round(counts * ratio), counts)
+    ratio = np.minimum(seq_count, rev_complement_count) / np.maximum(seq_count, rev_complement_count)
+    gc = np.char.count(seq.astype("U"), "G") + np.char.count(seq.astype("U"), "C")
+    df = pd.DataFrame({
+        "seq": seq,
+        "seq_count": seq_count.astype(float),
+        "rev_complement": rev_complement,
+        "rev_complement_count": rev_complement_count.astype(float),
+        "ratio": ratio,
+        "strand_bias_%": (1 - ratio) * 100,
+        "GC_%": gc / k * 100,
+    })
+    return df.sort_values(by="strand_bias_%", ascending=False, kind="mergesort", ignore_index=True)
+
+
+def summary(run, df_all):
+    """
+    Function to summarize strand bias of every K with the columns of sb_analysis files.
+    """
+    rows = []
+    for k, df in df_all.groupby("k", sort=True):
+        bias = df["strand_bias_%"]
+        rows.append([run, k, None, bias.mean(), bias.median(), bias.round(2).mode().iloc[0],
+                     bias.quantile(0.05), bias.quantile(0.95)])
+    return pd.DataFrame(rows, columns=SUMMARY_COLUMNS).round(2)
+
+
+def write_run(directory, run, kmers, rng, bins=None):
+    """
+    Write analysis outputs of one run, named the way datastore.scan recognizes them.
+    :param directory: output directory
+    :param run: name of the run
+    :param kmers: list of K
+    :param rng: numpy random generator
+    :param bins: number of time bins of nanopore run, None for other platforms
+    :return: list of written paths
+    """
+    prefix = "df_output_" if bins is None else "df_output_nanopore_"
+    df_all = pd.concat([kmer_table(k, rng).assign(k=k) for k in kmers], ignore_index=True)
+    paths = [os.path.join(directory, "{}{}.csv".format(prefix, run)),
+             os.path.join(directory, "sb_analysis_{}.csv".format(run))]
+    df_all.to_csv(paths[0])
+    summary(run, df_all).to_csv(paths[1], index=False)
+
+    if bins is not None:
+        df_bins = pd.concat([kmer_table(BIN_K, rng, depth=10 ** 5).assign(bin=bin) for bin in range(bins)],
+                            ignore_index=True)
+        reads = np.round(rng.normal(200000, 30000, size=bins).clip(1000))
+        bin_stats = pd.DataFrame({
+            "reads": reads.astype(float),
+            "bases": np.round(reads * rng.normal(6000, 1000, size=bins).clip(500)).astype(float),
+            "bin": np.arange(bins),
+        })
+        paths.append(os.path.join(directory, "{}{}_bins.csv".format(prefix, run)))
+        paths.append(os.path.join(directory, "nanopore_{}_bin_stats.csv".format(run)))
+        df_bins.to_csv(paths[2])
+        bin_stats.to_csv(paths[3])
+    return paths
+
+
+def generate(directory, kmers=(5, 6, 7, 8, 9), bins=(10, 100, 1000), seed=0):
+    """
+    Generate synthetic data directory with one Illumina run with k-mers of all given K and one nanopore run
+    for every number of bins. Output is the same for the same arguments.
+    :return: dict of run name -> list of written paths
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    runs = {"synthetic_S1_L001_R1_001": write_run(directory, "synthetic_S1_L001_R1_001", kmers, rng)}
+    for count in bins:
+        run = "synthetic_{}bins".format(count)
+        runs[run] = write_run(directory, run, kmers, rng, bins=count)
+    return runs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate synthetic analysis outputs for benchmarks.")
+    parser.add_argument("directory", nargs="?", default="benchmarks/data")
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 6, 7, 8, 9], help="lengths of k-mers")
+    parser.add_argument("--bins", type=int, nargs="*", default=[10, 100, 1000], help="bins of nanopore runs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for run, paths in generate(args.directory, args.k, args.bins, args.seed).items():
+        print(run, *paths, sep="\n  ")
@@ -0,0 +1,426 @@
+"""
+Load test of the Bokeh application with concurrent sessions on localhost. Server is started on synthetic data
+(see generate.py) and for every number of sessions N, N sessions are opened at once and replay interactions of
+an analyst (dataset changes, K switches, bin refreshes and lasso selections) for the given duration. Lasso sends
+the selected shown points followed by its geometry, like BokehJS, so the server resolves it against all k-mers.
+
+Reported are latency of session creation, round trip of every interaction until server acknowledged it
+(its callback ran) and until its result arrived (loading indicator is hidden again), and server RSS and CPU.
+
+    python benchmarks/loadtest.py --sessions 1 5 10 25 --duration 30
+    python benchmarks/loadtest.py --url http://localhost:5006/server --pid 1234   # already running server
+
+Sessions talk Bokeh protocol directly over websocket, the way bokeh.client.pull_session connects, but all of them
+in one event loop and receiving updates pushed by server while waiting for replies. Metrics of server process
+are read from /proc, so they are only reported on Linux.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from bokeh.client.util import websocket_url_for_server_url
+from bokeh.client.websocket import WebSocketClientConnectionWrapper
+from bokeh.document import Document
+from bokeh.document.events import MessageSentEvent
+from bokeh.models import Button, Div, Dropdown, GlyphRenderer, Plot, RadioButtonGroup, Slider
+from bokeh.protocol import Protocol
+from bokeh.protocol.receiver import Receiver
+from bokeh.util.token import generate_jwt_token, generate_session_id
+from tornado.httpclient import HTTPRequest
+from tornado.websocket import websocket_connect
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generate  # noqa: E402
+
+KMER_RENDERER = "Strand bias of k-mers in relation to frequency"
+# interactions replayed by every session with their relative frequency
+SCRIPT = {"lasso": 4, "switch_k": 3, "refresh_bin": 2, "dropdown": 1}
+PERCENTILES = (50, 90, 99)
+
+
+class LoadSession:
+    """
+    One client session of the dashboard holding a copy of its document, which is kept in sync with updates
+    pushed by the server.
+    """
+
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+        self.protocol = Protocol()
+        self.document = Document()
+        self.socket = None
+        self.replies = {}
+        self.updated = asyncio.Event()
+        self.reader = None
+        self.loading = None
+        self.errors = []
+
+    async def open(self):
+        """
+        Connect, pull document of new session and find the widgets.
+        :return: seconds until document was received
+        """
+        start = time.perf_counter()
+        session_id = generate_session_id()
+        request = HTTPRequest(websocket_url_for_server_url(self.url))
+        socket = await websocket_connect(request, subprotocols=["bokeh", generate_jwt_token(session_id)],
+                                         max_message_size=2 ** 30)
+        self.socket = WebSocketClientConnectionWrapper(socket)
+        self.receiver = Receiver(self.protocol)
+        while (await self._read()).msgtype != "ACK":
+            pass
+        self.reader = asyncio.ensure_future(self._read_forever())
+        reply = await self.request(self.protocol.create("PULL-DOC-REQ"))
+        elapsed = time.perf_counter() - start
+        reply.push_to_document(self.document)
+        self.loading = self.find("loading")
+        return elapsed
+
+    def find(self, name):
+        """
+        Find widget or source of the dashboard by its role, widgets of nanopore runs are only in document
+        while one is shown.
+        :return: the model or None
+        """
+        found = {
+            "dropdown": lambda model: isinstance(model, Dropdown),
+            "k": lambda model: isinstance(model, RadioButtonGroup) and model.labels[:1] == ["K = 5"],
+            "bin": lambda model: isinstance(model, Slider) and model.title == "Bin",
+            "refresh": lambda model: isinstance(model, Button) and model.label == "Refresh",
+            "loading": lambda model: isinstance(model, Div) and model.text == "Loading...",
+            "kmers": lambda model: isinstance(model, GlyphRenderer) and model.name == KMER_RENDERER,
+            "kmer_plot": lambda model: isinstance(model, Plot)
+            and any(renderer.name == KMER_RENDERER for renderer in model.renderers),
+        }[name]
+        model = next((model for model in self.document.models if found(model)), None)
+        return model.data_source if name == "kmers" and model is not None else model
+
+    async def _read(self):
+        while True:
+            fragment = await self.socket.read_message()
+            if fragment is None:
+                raise ConnectionError("connection closed by server")
+            message = await self.receiver.consume(fragment)
+            if message is not None:
+                return message
+
+    async def _read_forever(self):
+        try:
+            while True:
+                message = await self._read()
+                reqid = message.header.get("reqid")
+                if reqid in self.replies:
+                    self.replies.pop(reqid).set_result(message)
+                elif message.msgtype == "PATCH-DOC":
+                    try:
+                        buffers = {json.loads(header)["id"]: payload for header, payload in message.buffers}
+                        self.document.apply_json_patch(_resolve_buffers(message.content, buffers), setter=self)
+                    except Exception as e:
+                        self.errors.append("failed to apply update: {}".format(e))
+                    self.updated.set()
+        except Exception as e:
+            for reply in self.replies.values():
+                if not reply.done():
+                    reply.set_exception(e)
+
+    async def request(self, message):
+        reply = asyncio.get_event_loop().create_future()
+        self.replies[message.header["msgid"]] = reply
+        await message.send(self.socket)
+        return await asyncio.wait_for(reply, self.timeout)
+
+    async def send(self, events):
+        """
+        Send document events to server like browser does.
+        :return: tuple of seconds until server acknowledged them and seconds until results of callbacks arrived
+        """
+        start = time.perf_counter()
+        message = self.protocol.create("PATCH-DOC", events, use_buffers=False)
+        reply = await self.request(message)
+        if reply.msgtype == "ERROR":
+            raise RuntimeError(reply.content.get("text"))
+        acknowledged = time.perf_counter() - start
+        deadline = start + self.timeout
+        while self.loading.visible:
+            self.updated.clear()
+            await asyncio.wait_for(self.updated.wait(), max(deadline - time.perf_counter(), 0))
+        return acknowledged, time.perf_counter() - start
+
+    async def change(self, model, attr, value):
+        events = []
+
+        def record(event):
+            if event.setter is not self:
+                events.append(event)
+
+        self.document.on_change(record)
+        try:
+            setattr(model, attr, value)
+        finally:
+            self.document.remove_on_change(record)
+        return await self.send(events)
+
+    async def trigger(self, model, event_name, **values):
+        data = dict(event_name=event_name, event_values=dict(values, model=dict(id=model.id)))
+        return await self.send([MessageSentEvent(self.document, "bokeh_event", data)])
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        if self.socket is not None:
+            self.socket._socket.close()
+
+
+def _resolve_buffers(value, buffers):
+    # arrays sent as binary buffers are only decoded by BokehJS, Python documents expect lists
+    if isinstance(value, dict):
+        if "__buffer__" in value:
+            array = np.frombuffer(buffers[value["__buffer__"]], dtype=value["dtype"]).reshape(value["shape"])
+            return array.tolist()
+        return {key: _resolve_buffers(item, buffers) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve_buffers(item, buffers) for item in value]
+    return value
+
+
+async def interact(session, kind, rng):
+    """
+    Replay one interaction of given kind.
+    :return: tuple of acknowledged and completed seconds, or None if interaction is not possible
+    """
+    if kind == "dropdown":
+        dropdown = session.find("dropdown")
+        name, key = rng.choice(dropdown.menu)
+        return await session.trigger(dropdown, "menu_item_click", item=key)
+    if kind == "switch_k":
+        radio = session.find("k")
+        return await session.change(radio, "active", rng.choice([i for i in range(5) if i != radio.active]))
+    if kind == "refresh_bin":
+        slider, refresh = session.find("bin"), session.find("refresh")
+        if slider is None or refresh is None:
+            return None
+        await session.change(slider, "value", rng.randint(slider.start, slider.end))
+        return await session.trigger(refresh, "button_click")
+    if kind == "lasso":
+        source = session.find("kmers")
+        shown = len(next(iter(source.data.values()), []))
+        if shown == 0:
+            return None
+        # lasso around a run of shown points, shown k-mers are ordered by rank
+        first = rng.randrange(shown)
+        last = min(shown, first + rng.randint(1, 500)) - 1
+        x, y = np.asarray(source.data["rank"]), np.asarray(source.data["strand_bias_%"])
+        x0, x1 = x[first] - 0.5, x[last] + 0.5
+        y0, y1 = y[first:last + 1].min() - 0.5, y[first:last + 1].max() + 0.5
+        indices = np.flatnonzero((x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)).tolist()
+        # BokehJS sends the shown points inside the lasso and then its geometry, which selects the rest
+        changed, _ = await session.change(source.selected, "indices", indices)
+        acknowledged, completed = await session.trigger(
+            session.find("kmer_plot"), "selectiongeometry", final=True,
+            geometry=dict(type="poly", x=[x0, x1, x1, x0], y=[y0, y0, y1, y1]))
+        return changed + acknowledged, changed + completed
+    raise ValueError(kind)
+
+
+async def run_session(url, duration, think, timeout, seed, created, latencies, errors):
+    rng = random.Random(seed)
+    session = LoadSession(url, timeout)
+    try:
+        created.append(await session.open())
+        kinds, weights = zip(*SCRIPT.items())
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            await asyncio.sleep(rng.expovariate(1 / think) if think > 0 else 0)
+            kind = rng.choices(kinds, weights)[0]
+            try:
+                result = await interact(session, kind, rng)
+            except asyncio.TimeoutError:
+                errors.append("{} timed out".format(kind))
+                continue
+            if result is not None:
+                latencies.setdefault(kind, []).append(result)
+    except Exception as e:
+        errors.append("{}: {}".format(type(e).__name__, e))
+    finally:
+        errors.extend(session.errors)
+        await session.close()
+
+
+class ProcessMonitor:
+    """
+    Sampler of RSS and CPU time of server process from /proc.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def available(self):
+        return self.pid is not None and os.path.exists("/proc/{}/stat".format(self.pid))
+
+    def cpu_seconds(self):
+        with open("/proc/{}/stat".format(self.pid)) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime and stime are 14th and 15th field, counted from pid
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def rss_mb(self):
+        with open("/proc/{}/status".format(self.pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return None
+
+
+async def run_level(url, sessions, args, monitor):
+    """
+    Run given number of concurrent sessions and summarize their latencies and server load.
+    """
+    created, latencies, errors = [], {}, []
+    peak_rss = [0.0]
+
+    async def sample():
+        while True:
+            peak_rss[0] = max(peak_rss[0], monitor.rss_mb() or 0)
+            await asyncio.sleep(0.5)
+
+    sampler = asyncio.ensure_future(sample()) if monitor.available() else None
+    cpu_start, wall_start = monitor.cpu_seconds() if monitor.available() else 0, time.perf_counter()
+    await asyncio.gather(*[
+        run_session(url, args.duration, args.think, args.timeout, args.seed * 100000 + sessions * 1000 + i,
+                    created, latencies, errors)
+        for i in range(sessions)
+    ])
+    wall = time.perf_counter() - wall_start
+    result = dict(sessions=sessions, errors=errors, create=summarize(created), interactions={})
+    for kind, values in sorted(latencies.items()):
+        result["interactions"][kind] = dict(
+            acknowledged=summarize([ack for ack, _ in values]),
+            completed=summarize([done for _, done in values]),
+        )
+    if sampler is not None:
+        sampler.cancel()
+        result["cpu_percent"] = (monitor.cpu_seconds() - cpu_start) / wall * 100
+        result["rss_mb"] = monitor.rss_mb()
+        result["peak_rss_mb"] = max(peak_rss[0], result["rss_mb"] or 0)
+    return result
+
+
+def summarize(seconds):
+    if not seconds:
+        return dict(count=0)
+    values = np.array(seconds) * 1e3
+    summary = {"count": len(values), "max_ms": float(values.max())}
+    for percentile in PERCENTILES:
+        summary["p{}_ms".format(percentile)] = float(np.percentile(values, percentile))
+    return summary
+
+
+def report(result):
+    header = "N={sessions}".format(**result)
+    if "cpu_percent" in result:
+        header += " | server CPU {cpu_percent:.0f} % | RSS {rss_mb:.0f} MB (peak {peak_rss_mb:.0f} MB)".format(**result)
+    if result["errors"]:
+        header += " | {} errors".format(len(result["errors"]))
+    print(header)
+    rows = [("session creation", result["create"])]
+    for kind, values in result["interactions"].items():
+        rows.append((kind + " acknowledged", values["acknowledged"]))
+        rows.append((kind + " completed", values["completed"]))
+    for name, summary in rows:
+        if summary["count"]:
+            print("  {:<26} n={:<5} {}  max {:8.1f} ms".format(name, summary["count"], "  ".join(
+                "p{} {:8.1f} ms".format(p, summary["p{}_ms".format(p)]) for p in PERCENTILES), summary["max_ms"]))
+    for error in sorted(set(result["errors"]))[:5]:
+        print("  error:", error)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(data, port, app):
+    """
+    Start Bokeh server with the application on localhost in subprocess, after caches of data were built
+    like in deployment.
+    :return: tuple of process and URL of the application
+    """
+    env = dict(os.environ, SBAT_DATA_DIR=os.path.abspath(data))
+    subprocess.run([sys.executable, "datastore.py", env["SBAT_DATA_DIR"]], cwd=ROOT, env=env, check=True)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "bokeh", "serve", app, "--port", str(port), "--address", "127.0.0.1",
+         "--allow-websocket-origin", "127.0.0.1:{}".format(port)],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited with code {}".format(process.returncode))
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.2)
+    else:
+        process.terminate()
+        raise RuntimeError("server did not start")
+    return process, "http://127.0.0.1:{}/{}".format(port, os.path.splitext(os.path.basename(app))[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the Bokeh application with concurrent sessions.")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10, 25], help="numbers of sessions")
+    parser.add_argument("--duration", type=float, default=30, help="seconds every level of load runs")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds between interactions of a session")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for any reply")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data", help="data directory of the server, synthetic data are generated if not set")
+    parser.add_argument("--app", default="server.py", help="application script served by bokeh serve")
+    parser.add_argument("--url", help="URL of running application, no server is started if set")
+    parser.add_argument("--pid", type=int, help="process of running server, for its RSS and CPU")
+    parser.add_argument("--output", help="file to store results as JSON")
+    args = parser.parse_args()
+
+    process, directory = None, None
+    url, pid = args.url, args.pid
+    try:
+        if url is None:
+            directory = args.data
+            if directory is None:
+                directory = tempfile.mkdtemp(prefix="sbat-load-")
+                generate.generate(directory, kmers=(5, 6, 7, 8, 9), bins=(100,))
+            process, url = start_server(directory, free_port(), args.app)
+            pid = process.pid
+        monitor = ProcessMonitor(pid)
+        results = []
+        for sessions in args.sessions:
+            result = asyncio.run(run_level(url, sessions, args, monitor))
+            report(result)
+            results.append(result)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(dict(url=url, duration=args.duration, think=args.think, levels=results), f, indent=1)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if args.data is None and directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""
+Benchmarks of data preparation and plot building. Synthetic runs are generated into a temporary directory
+(see generate.py) and every operation is measured for wall time (median of repeats), peak of memory allocated
+by Python and numpy while it runs, and size of serialized Bokeh document with the models it updates.
+
+    python benchmarks/run.py                 # compare with benchmarks/baseline.json
+    python benchmarks/run.py --save          # store results as the new baseline
+    python benchmarks/run.py --quick --check # K=5..7 and 10 bins only, exit with 1 upon regression
+
+Times depend on the machine, baseline should be stored on the machine which compares against it.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from bokeh.document import Document
+from bokeh.events import SelectionGeometry
+from bokeh.layouts import column
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate  # noqa: E402
+from doctemplate import DocumentTemplate  # noqa: E402
+import results  # noqa: E402
+import storage  # noqa: E402
+import utils  # noqa: E402
+from plots import AnalysisData, Plotter  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# relative growth over baseline reported as regression, times are noisier than sizes
+TOLERANCE = dict(seconds=0.5, peak_mb=0.2, doc_bytes=0.05)
+
+
+def document_size(*models):
+    """
+    Function to get size of JSON of document holding given models, which is what a session sends to browser.
+    """
+    models = [model for model in models if model is not None]
+    if not models:
+        return None
+    doc = Document()
+    for model in models:
+        doc.add_root(model)
+    size = len(doc.to_json_string())
+    for model in models:
+        doc.remove_root(model)
+    return size
+
+
+def measure(setup, repeat):
+    """
+    Function to measure operation. setup is called before every repeat and returns the operation and
+    a function returning models to serialize afterwards, so that every repeat starts from the same state.
+    :return: dict with seconds, peak_mb and doc_bytes
+    """
+    times = []
+    for i in range(repeat + 1):
+        operation, models = setup()
+        if i == 0:
+            # first run is traced for memory only, tracing slows allocations down
+            tracemalloc.start()
+            operation()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            doc_bytes = document_size(*models())
+            continue
+        start = time.perf_counter()
+        operation()
+        times.append(time.perf_counter() - start)
+    return dict(seconds=statistics.median(times), peak_mb=peak / 2 ** 20, doc_bytes=doc_bytes)
+
+
+def benchmarks(directory, kmers, bins):
+    """
+    Build benchmarks of operations on data in directory.
+    :return: list of (name, setup) tuples, see measure
+    """
+    illumina = os.path.join(directory, "df_output_synthetic_S1_L001_R1_001.csv")
+    summary = os.path.join(directory, "sb_analysis_synthetic_S1_L001_R1_001.csv")
+    data = AnalysisData(illumina)
+    summary_data = AnalysisData(summary)
+    plotter = Plotter(summary_data, data)
+
+    def fresh():
+        # results are shared by sessions in a process, benchmarks measure their computation
+        results.cache.clear()
+        data._gc_sweep = None
+
+    def load_cold():
+        shutil.rmtree(storage.cache_dir(illumina), ignore_errors=True)
+        return lambda: AnalysisData(illumina), lambda: ()
+
+    def load_warm():
+        AnalysisData(illumina)
+        return lambda: AnalysisData(illumina), lambda: ()
+
+    def gc_data():
+        fresh()
+        return lambda: utils.calculate_gc_plot_data(data.df, 5), lambda: ()
+
+    def gc_plot():
+        fresh()
+        return lambda: plotter.create_gc_plot(data, 5, new=False), lambda: (plotter.gc_plot,)
+
+    def kmer_plot(k):
+        def setup():
+            fresh()
+            return lambda: plotter.create_kmer_plot(data, k, new=False), lambda: (plotter.kmer_plot, plotter.table)
+        return setup
+
+    def selected(count):
+        # benchmarks of selections are only meaningful if the table got the rows
+        assert len(plotter.selected_rows) == count and len(plotter.data_table.source.data["seq"]), \
+            "{} k-mers selected instead of {}".format(len(plotter.selected_rows), count)
+        return plotter.table,
+
+    def selection(k, count):
+        def setup():
+            plotter.create_kmer_plot(data, k, new=False)
+            indices = list(range(min(count, len(plotter.kmer_rows))))
+            return lambda: plotter.update_selected("indices", [], indices), lambda: selected(len(indices))
+        return setup
+
+    def box_selection(k, count):
+        # box over the most frequent k-mers, resolved against the whole slice, see Plotter.on_kmer_selection
+        def setup():
+            plotter.create_kmer_plot(data, k, new=False)
+            event = SelectionGeometry(plotter.kmer_plot, geometry=dict(
+                type="rect", x0=-0.5, x1=count - 0.5, y0=-1, y1=101), final=True)
+            return lambda: plotter.on_kmer_selection(event), lambda: selected(min(count, len(plotter.kmer_df.index)))
+        return setup
+
+    def search(k, motif):
+        def setup():
+            plotter.create_kmer_plot(data, k, new=False)
+            Plotter.prepare_search(*plotter.kmer_slice)
+            return lambda: plotter.search(motif), lambda: (plotter.kmer_plot, plotter.table)
+        return setup
+
+    def session_view():
+        session_plotter = Plotter(summary_data, data)
+        return [column(session_plotter.lineplot, session_plotter.gc_plot, session_plotter.kmer_plot,
+                       session_plotter.table)], session_plotter, {}
+
+    def new_session(hydrated):
+        # default view of a new session, built from scratch or hydrated from document template
+        template = DocumentTemplate()
+        sessions = []
+
+        def open_session():
+            roots, _, _ = template.hydrate(0, session_view) if hydrated else session_view()
+            doc = Document()
+            for root in roots:
+                doc.add_root(root)
+            sessions.append(doc)
+
+        def close_session():
+            doc = sessions.pop()
+            roots = list(doc.roots)
+            doc.clear()
+            return roots
+
+        def setup():
+            template.hydrate(0, session_view)
+            return open_session, close_session
+        return setup
+
+    def ci_plot(path):
+        bins_data = AnalysisData(path, nanopore=True)
+
+        def setup():
+            fresh()
+            return lambda: plotter.create_ci_plot(bins_data, new=True), lambda: (plotter.ci_plot,)
+        return setup
+
+    found = [
+        ("load_cold", load_cold),
+        ("load_warm", load_warm),
+        ("calculate_gc_plot_data", gc_data),
+        ("create_gc_plot", gc_plot),
+    ]
+    found.append(("new_session[built]", new_session(False)))
+    found.append(("new_session[template]", new_session(True)))
+    for k in kmers:
+        found.append(("create_kmer_plot[K={}]".format(k), kmer_plot(k)))
+    k = max(kmers)
+    found.append(("update_selected[K={},1000]".format(k), selection(k, 1000)))
+    found.append(("box_selection[K={},100000]".format(k), box_selection(k, 100000)))
+    found.append(("search[K={},exact]".format(k), search(k, "ACGTA" + "CGTAC"[:k - 5])))
+    found.append(("search[K={},RCGYN]".format(k), search(k, "RCGYN")))
+    for count in bins:
+        path = os.path.join(directory, "df_output_nanopore_synthetic_{}bins_bins.csv".format(count))
+        found.append(("create_ci_plot[bins={}]".format(count), ci_plot(path)))
+    return found
+
+
+def compare(name, result, baseline):
+    """
+    :return: list of descriptions of metrics of result which regressed against baseline
+    """
+    regressions = []
+    for metric, tolerance in TOLERANCE.items():
+        old, new = (baseline or {}).get(metric), result.get(metric)
+        if old and new is not None and new > old * (1 + tolerance):
+            regressions.append("{} {}: {:.4g} -> {:.4g} (+{:.0%})".format(name, metric, old, new, new / old - 1))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark data preparation and plot building.")
+    parser.add_argument("--quick", action="store_true", help="only K=5..7 and nanopore run with 10 bins")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", default="", help="run only benchmarks with this in their name")
+    parser.add_argument("--data", help="directory with data generated by generate.py, temporary one if not set")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="store results as baseline")
+    parser.add_argument("--check", action="store_true", help="exit with 1 if any benchmark regressed")
+    args = parser.parse_args()
+
+    kmers, bins = ([5, 6, 7], [10]) if args.quick else ([5, 6, 7, 8, 9], [10, 100, 1000])
+    directory = args.data or tempfile.mkdtemp(prefix="sbat-bench-")
+    try:
+        if args.data is None or not os.listdir(directory):
+            generate.generate(directory, kmers, bins)
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)["results"]
+        except (OSError, ValueError, KeyError):
+            baseline = {}
+
+        measured, regressions = {}, []
+        print("{:<32} {:>12} {:>10} {:>12}".format("benchmark", "time [ms]", "peak [MB]", "doc [B]"))
+        for name, setup in benchmarks(directory, kmers, bins):
+            if args.filter not in name:
+                continue
+            result = measure(setup, args.repeat)
+            measured[name] = result
+            regressed = compare(name, result, baseline.get(name))
+            regressions += regressed
+            print("{:<32} {:>12.2f} {:>10.2f} {:>12} {}".format(
+                name, result["seconds"] * 1e3, result["peak_mb"],
+                "-" if result["doc_bytes"] is None else result["doc_bytes"], "REGRESSED" if regressed else ""))
+    finally:
+        if args.data is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    for regression in regressions:
+        print(regression)
+    if args.save:
+        baseline.update(measured)
+        with open(args.baseline, "w") as f:
+            json.dump(dict(machine=platform.platform(), python=platform.python_version(),
+                           numpy=np.__version__, results=baseline), f, indent=1, sort_keys=True)
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe mapping which keeps the summed size of its values under a budget by evicting
+    the least recently used entries. The most recently inserted entry is always kept, even when it
+    alone exceeds the budget.
+    """
+
+    def __init__(self, max_size, sizeof=None):
+        """
+        :param max_size: budget for the summed size of all cached values
+        :param sizeof: function returning size of one value, e.g. in bytes. Every value has size 1 if not set,
+        so the budget is number of entries.
+        """
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def peek(self, key, default=None):
+        """
+        Get value of key without counting a hit or miss and without marking it as recently used.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+        return value
+
+    def resize(self, key):
+        """
+        Measure value of key again after it grew or shrank in place, evicting other entries if it no longer
+        fits the budget.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.sizeof(entry[0]) != entry[1]:
+                self.put(key, entry[0])
+
+    def get_or_compute(self, key, compute):
+        """
+        Get value of key, computing and caching it if missing. Value may be computed more than once
+        when requested concurrently.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = self.put(key, compute())
+        return value
+
+    def stats(self):
+        with self._lock:
+            return dict(entries=len(self._entries), size=self.size, max_size=self.max_size,
+                        hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, size = self._entries.pop(key)
+            self.size -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
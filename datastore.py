@@ -0,0 +1,383 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import metrics
+import storage
+from cache import LRUCache
+from plots import AnalysisData, PIPELINE_VERSION, prepare_frame
+
+logger = logging.getLogger(__name__)
+DATASET_CACHE_MB = int(os.environ.get("SBAT_DATASET_CACHE_MB", 512))
+# seconds between scans of data directory for new and grown files, 0 disables watching
+WATCH_INTERVAL = float(os.environ.get("SBAT_WATCH_INTERVAL", 5))
+CATALOG_VERSION = 1
+PLATFORMS = {"pacbio": "PacBio", "illumina": "Illumina", "nanopore": "Nanopore"}
+PACBIO_RUN = re.compile(r"m\d+_\d{6}_\d{6}$")
+# file name patterns of analysis outputs with suffix of dataset key and registry arguments, first match wins
+FILE_PATTERNS = [
+    (re.compile(r"df_output_nanopore_(.+)_bins\.csv$"), "/bins", dict(nanopore=True, appendable=True)),
+    (re.compile(r"nanopore_(.+)_bin_stats\.csv$"), "/bin_stats", dict(nanopore=True, appendable=True)),
+    (re.compile(r"df_output_nanopore_(.+)\.csv$"), "", dict(nanopore=True)),
+    (re.compile(r"df_output_(.+)\.csv$"), "", {}),
+    (re.compile(r"sb_analysis_(.+)\.csv$"), "/summary", {}),
+]
+
+
+class DatasetRegistry:
+    """
+    Process-wide registry of analysis datasets. Datasets are only registered by key and path,
+    their files are parsed the first time the key is requested. Loaded AnalysisData objects are shared
+    by all sessions of the process and must be treated as read-only, least recently used ones are
+    dropped once their summed private memory exceeds the budget. Memory mapped columns are shared with
+    other worker processes and do not count towards the budget, structures derived from datasets on demand,
+    e.g. their GC sweep, do (see AnalysisData.nbytes). Results computed from datasets, k-mer indices included,
+    are kept in results.cache under its own budget.
+    """
+
+    def __init__(self, max_bytes):
+        self._specs = {}
+        self._loaded = LRUCache(max_bytes, sizeof=lambda data: data.nbytes)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._listeners = []
+        self._descriptions = {}
+
+    def register(self, key, path, appendable=False, **kwargs):
+        """
+        Register dataset under given key. Registering the same key again with different arguments
+        replaces the specification and drops previously loaded data.
+        :param key: key under which dataset is requested, e.g. "nanopore_GM24385_3/bins"
+        :param path: path to CSV file with the data
+        :param appendable: whether rows are appended to the file while it is being viewed, which are then read
+        incrementally by refresh
+        :param kwargs: keyword arguments passed to AnalysisData
+        """
+        spec = (path, kwargs, appendable)
+        with self._lock:
+            if self._specs.get(key) == spec:
+                return
+            added = key not in self._specs
+            self._specs[key] = spec
+            self._loaded.pop(key)
+        if added:
+            self._notify(key, None, None)
+
+    def refresh(self, key):
+        """
+        Bring loaded dataset up to date with its file. Rows appended to file of appendable dataset are read
+        incrementally and listeners are notified, other changed datasets are dropped and loaded again
+        once requested.
+        """
+        with self._lock:
+            path, kwargs, appendable = self._specs[key]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            data = self._loaded.peek(key)
+            if data is None:
+                return
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return
+            if (stat.st_mtime_ns, stat.st_size) == data.cache_key[1:]:
+                return
+            if not appendable or stat.st_size < data.source_size:
+                # rewritten file is loaded again once requested
+                self._loaded.pop(key)
+                return
+            with metrics.span("dataset.extend"):
+                update = data.extend()
+            if update is None:
+                return
+            self._loaded.put(key, update[0])
+        self._notify(key, *update)
+
+    def subscribe(self, listener):
+        """
+        Call listener upon changes of datasets, from the thread which made the change. Listener is called
+        as listener(key, None, None) when new key is registered and as listener(key, data, start) when rows
+        were appended to dataset, start being position of the first changed row of new data.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _notify(self, key, data, start):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(key, data, start)
+
+    def runs(self):
+        """
+        Get menu entries of all runs with both k-mers and summary registered, in order of registration.
+        :return: list of (name, key) tuples
+        """
+        with self._lock:
+            return [(run_name(key), key) for key in self._specs
+                    if "/" not in key and key + "/summary" in self._specs]
+
+    def get(self, key):
+        data = self._loaded.get(key)
+        if data is not None:
+            # structures derived from dataset since it was loaded count towards the budget
+            self._loaded.resize(key)
+            return data
+
+        with self._lock:
+            path, kwargs, appendable = self._specs[key]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # sessions requesting the same dataset at once wait for a single load
+        with load_lock:
+            data = self._loaded.peek(key)
+            if data is None:
+                with metrics.span("dataset.load"):
+                    data = self._loaded.put(key, AnalysisData(path, appendable=appendable, **kwargs))
+        return data
+
+    def describe(self, key, path):
+        """
+        Describe dataset registered from path by its loaded data, brought up to date with the file first.
+        Data is read once per process, rows appended afterwards are read incrementally, and described again
+        only once rows were appended.
+        :return: dict with number of rows, K values and range of bins, see describe_frame, or None if key is not
+        registered with path
+        """
+        with self._lock:
+            spec = self._specs.get(key)
+        if spec is None or spec[0] != path:
+            return None
+        self.refresh(key)
+        data = self.get(key)
+        with self._lock:
+            cache_key, entry = self._descriptions.get(key, (None, None))
+        if cache_key != data.cache_key:
+            entry = describe_frame(data.df)
+            with self._lock:
+                self._descriptions[key] = (data.cache_key, entry)
+        return entry
+
+    def appendable(self, key):
+        with self._lock:
+            return self._specs[key][2]
+
+    def stats(self):
+        """
+        Get statistics of loaded datasets, see LRUCache.stats.
+        """
+        return self._loaded.stats()
+
+    def is_loaded(self, key):
+        return key in self._loaded
+
+    @property
+    def nbytes(self):
+        return self._loaded.size
+
+    def keys(self):
+        with self._lock:
+            return list(self._specs.keys())
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._specs
+
+
+registry = DatasetRegistry(max_bytes=DATASET_CACHE_MB * 2 ** 20)
+metrics.register_cache("datasets", registry.stats)
+_watched = set()
+_watch_lock = threading.Lock()
+
+
+def run_name(key):
+    """
+    Function to get name of run shown in menu, e.g. "PacBio m54238_180628_014238" for "pacbio_m54238_180628_014238".
+    """
+    platform, run = key.split("_", 1)
+    return "{} {}".format(PLATFORMS.get(platform, platform), run)
+
+
+def scan(directory):
+    """
+    Function to find analysis outputs in directory by names of their files. Runs with any nanopore output
+    are nanopore runs, runs named like m54238_180628_014238 PacBio and the rest Illumina.
+    :return: dict of dataset key -> (path, registry keyword arguments)
+    """
+    matches = []
+    for name in sorted(os.listdir(directory)):
+        for pattern, suffix, kwargs in FILE_PATTERNS:
+            match = pattern.match(name)
+            if match:
+                matches.append((match.group(1), suffix, os.path.join(directory, name), kwargs))
+                break
+
+    nanopore_runs = {run for run, _, _, kwargs in matches if kwargs.get("nanopore")}
+    found = {}
+    for run, suffix, path, kwargs in matches:
+        if run in nanopore_runs:
+            found["nanopore_" + run + suffix] = (path, dict(kwargs, nanopore=True))
+        else:
+            platform = "pacbio_" if PACBIO_RUN.match(run) else "illumina_"
+            found[platform + run + suffix] = (path, kwargs)
+    return found
+
+
+def catalog_path(directory):
+    """
+    Function to get path of catalog of datasets in directory, which is stored with the columnar caches.
+    """
+    return os.path.join(storage.CACHE_DIR or os.path.join(directory, ".cache"), "catalog.json")
+
+
+def describe(path, kwargs):
+    """
+    Function to read dataset once and describe it for catalog.
+    :return: dict with path, registry keyword arguments, size, modification time and hash of the file,
+    number of rows, K values and range of bins of the dataset
+    """
+    stat = os.stat(path)
+    df, parsed_size = storage.read_frame(path, prepare=prepare_frame, pipeline=PIPELINE_VERSION, return_size=True,
+                                         tail=kwargs.get("appendable", False))
+    return dict(path=path, kwargs=kwargs, size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                sha1=storage.file_hash(path), **describe_frame(df))
+
+
+def describe_frame(df):
+    """
+    :return: dict with number of rows, K values and range of bins of dataset
+    """
+    entry = dict(rows=len(df.index), k=None, bins=None)
+    if "k" in df.columns and df["k"].notna().any():
+        entry["k"] = sorted(int(k) for k in df["k"].dropna().unique())
+    if "bin" in df.columns and df["bin"].notna().any():
+        entry["bins"] = [int(df["bin"].min()), int(df["bin"].max())]
+    return entry
+
+
+def load_catalog(directory):
+    """
+    Function to get catalog of runs and datasets in directory. Only datasets which are new or whose files changed
+    since the stored catalog was built are read, otherwise loading the catalog costs one stat per file.
+    Catalog is stored again if anything changed. Grown files of appendable datasets registered already are described
+    by the registry, which reads only their appended rows.
+    :return: dict with runs (list of dicts with key, name, platform and keys of datasets, ordered by platform
+    and key) and datasets (dict of dataset key -> description, see describe)
+    """
+    path = catalog_path(directory)
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = {}
+    if stored.get("version") != CATALOG_VERSION or stored.get("pipeline") != PIPELINE_VERSION:
+        stored = {}
+    known = stored.get("datasets", {})
+
+    datasets, runs, kept = {}, {}, {}
+    for key, (file, kwargs) in scan(directory).items():
+        stat = os.stat(file)
+        entry = known.get(key)
+        if entry is None or entry["path"] != file or entry["kwargs"] != kwargs:
+            entry = describe(file, kwargs)
+        elif (entry["size"], entry["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+            tracked = registry.describe(key, file) \
+                if kwargs.get("appendable") and stat.st_size > entry["size"] else None
+            if tracked is None:
+                entry = describe(file, kwargs)
+            else:
+                # stored entry keeps describing the file as it was hashed, until it is described in full again
+                kept[key] = entry
+                entry = dict(entry, **tracked)
+        datasets[key] = entry
+        run = key.split("/")[0]
+        runs.setdefault(run, dict(key=run, name=run_name(run), platform=run.split("_")[0], datasets=[]))
+        runs[run]["datasets"].append(key)
+
+    platforms = list(PLATFORMS)
+    catalog = dict(
+        version=CATALOG_VERSION,
+        pipeline=PIPELINE_VERSION,
+        runs=sorted(runs.values(), key=lambda run: (platforms.index(run["platform"]), run["key"])),
+        datasets=datasets,
+    )
+    store = dict(catalog, datasets=dict(datasets, **kept))
+    if store != stored:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp, "w") as f:
+                json.dump(store, f, indent=1)
+            os.replace(tmp, path)
+        except OSError:
+            # read-only deployments build the catalog on every start
+            pass
+    return catalog
+
+
+def register_catalog(catalog):
+    """
+    Register all datasets of catalog, none of them is read until requested.
+    :return: menu entries of runs with both k-mers and summary, list of (name, key) tuples
+    """
+    for key, entry in catalog["datasets"].items():
+        registry.register(key, entry["path"], **entry["kwargs"])
+    return [(run["name"], run["key"]) for run in catalog["runs"]
+            if run["key"] in catalog["datasets"] and run["key"] + "/summary" in catalog["datasets"]]
+
+
+def poll(directory):
+    """
+    Register datasets found in directory and read rows appended to loaded ones.
+    """
+    for key, (path, kwargs) in scan(directory).items():
+        registry.register(key, path, **kwargs)
+    for key in registry.keys():
+        registry.refresh(key)
+
+
+def watch(directory, interval=WATCH_INTERVAL):
+    """
+    Poll directory every interval seconds in background thread. Directory is watched only once per process.
+    """
+    with _watch_lock:
+        if interval <= 0 or directory in _watched:
+            return
+        _watched.add(directory)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                poll(directory)
+            except Exception:
+                logger.exception("failed to poll %s", directory)
+
+    threading.Thread(target=run, name="watch-" + directory, daemon=True).start()
+
+
+def prebuild(directory):
+    """
+    Build columnar caches of all CSV files in directory and catalog of its datasets. Run before worker
+    processes are forked, so that they only map the caches and share one copy of the data.
+    """
+    for file, kwargs in scan(directory).values():
+        storage.read_frame(file, prepare=prepare_frame, pipeline=PIPELINE_VERSION, tail=kwargs.get("appendable", False))
+    load_catalog(directory)
+
+
+if __name__ == '__main__':
+    prebuild(sys.argv[1] if len(sys.argv) > 1 else "data")
@@ -0,0 +1,102 @@
+import json
+import logging
+import os
+import re
+import threading
+from functools import lru_cache
+
+from bokeh.core.json_encoder import serialize_json
+from bokeh.core.property.validation import validate
+from bokeh.document.util import initialize_references_json, instantiate_references_json, references_json
+from bokeh.themes import Theme
+from bokeh.util.serialization import make_id
+
+import metrics
+
+logger = logging.getLogger(__name__)
+# references of models in compact JSON, strings holding the same text have their quotes escaped
+MODEL_ID = re.compile(r'"id":"([^"]+)"')
+
+
+@lru_cache()
+def theme(path="./theme.yml"):
+    """
+    Function to get theme of documents, the file is read once per process.
+    :return: Theme, or None when there is no theme file and the default theme of Bokeh is used
+    """
+    if not os.path.exists(path):
+        logger.warning("theme %s not found, using default theme", path)
+        return None
+    return Theme(filename=path)
+
+
+class DocumentTemplate:
+    """
+    Default document of new sessions, built once per process and kept serialized. Documents of sessions are
+    hydrated from the JSON, which creates their models without building the plots and looking up their data again,
+    so that sessions start in the same time whatever the size of the shown dataset. Template lives in this module,
+    which is imported once, while bokeh serve executes the application script for every session.
+    """
+
+    def __init__(self):
+        self.key = None
+        self._references = None
+        self._root_ids = []
+        self._plotter = None
+        self._widget_ids = {}
+        self._lock = threading.Lock()
+
+    def build(self, key, factory):
+        """
+        Build the template and serialize its models.
+        :param key: key of the template, see hydrate
+        :param factory: function returning tuple of list of roots, Plotter and dict of name -> widget
+        """
+        roots, plotter, widgets = factory()
+        models = set()
+        for model in list(roots) + list(widgets.values()) + [
+                item for value in plotter.models().values() for item in (value if isinstance(value, list) else [value])]:
+            # sources of plots not shown yet are referenced by the plotter only
+            models.update(model.references())
+        self._references = serialize_json(references_json(models))
+        self._root_ids = [root.id for root in roots]
+        self._plotter = plotter
+        self._widget_ids = {name: widget.id for name, widget in widgets.items()}
+        self.key = key
+        logger.info("document template built: %d models, %d bytes", len(models), len(self._references))
+
+    def hydrate(self, key, factory):
+        """
+        Create copies of models of the template for new session. Callbacks are not part of the template,
+        the plotter connects its own ones, the rest are to be connected by the caller before the roots are added
+        to document of the session, Bokeh subscribes models to events of their callbacks when they are attached.
+        :param key: hashable description of what the template shows, e.g. versions of its datasets, template is
+        built again when it changes
+        :param factory: function building the template, see build
+        :return: tuple of list of roots, Plotter bound to the copies and dict of name -> widget, copies have IDs
+        of their own
+        """
+        with self._lock:
+            if self.key != key:
+                with metrics.span("template.build"):
+                    self.build(key, factory)
+            serialized, root_ids, plotter, widget_ids = \
+                self._references, self._root_ids, self._plotter, self._widget_ids
+
+        with metrics.span("template.hydrate"):
+            # models of every session get own IDs, IDs of the template are mapped to them
+            ids = {}
+            serialized = MODEL_ID.sub(
+                lambda match: '"id":"{}"'.format(ids.setdefault(match.group(1), make_id())), serialized)
+            # JSON is parsed for every session, models would share values set from the same parsed JSON otherwise
+            models = json.loads(serialized)
+            # values were validated when the template was built
+            with validate(False):
+                references = instantiate_references_json(models, {})
+                initialize_references_json(models, references)
+            references = {id: references[new_id] for id, new_id in ids.items()}
+        return ([references[root_id] for root_id in root_ids], plotter.clone(references),
+                {name: references[id] for name, id in widget_ids.items()})
+
+
+session_template = DocumentTemplate()
@@ -0,0 +1,146 @@
+import io
+import os
+import uuid
+import zlib
+from urllib.parse import urlencode
+
+import numpy as np
+
+import payload
+from cache import LRUCache
+from plots import KMER_COLUMNS, KMER_TABLE_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+EXPORT_CHUNK_ROWS = int(os.environ.get("SBAT_EXPORT_CHUNK_ROWS", 10000))
+EXPORT_SELECTIONS_MB = int(os.environ.get("SBAT_EXPORT_SELECTIONS_MB", 64))
+# URL of export endpoint as seen by browsers, relative to the page embedding the dashboard
+EXPORT_URL = os.environ.get("SBAT_EXPORT_URL", "/api/runs/{run}/kmers/export")
+EXPORT_COLUMNS = ("rank",) + KMER_TABLE_COLUMNS
+MIMETYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+FORMATS = ("csv", "parquet") if pq is not None else ("csv",)
+
+# selected rows of dashboard sessions by token, sessions and the export endpoint share the process
+selections = LRUCache(EXPORT_SELECTIONS_MB * 2 ** 20, sizeof=lambda selection: selection[4].nbytes)
+
+
+def register_selection(key, data, k, bin, rows):
+    """
+    Store rows selected in a session, so that the export endpoint can stream them.
+    :param key: registry key of the dataset, e.g. "run" or "run/bins"
+    :param data: AnalysisData the rows were selected from
+    :param k: K of the ranked slice, None for bins
+    :param bin: bin of the ranked slice, None for K
+    :param rows: positions of selected rows in the slice
+    :return: token of the selection
+    """
+    token = uuid.uuid4().hex
+    selections.put(token, (key, data.cache_key, k, bin, np.sort(np.asarray(rows, dtype=np.int64))))
+    return token
+
+
+def url(run, fmt="csv", compress=False, k=None, bin=None, selection=None):
+    """
+    Function to get URL downloading k-mers of run, see index.api_kmers_export.
+    """
+    args = dict(format=fmt)
+    if compress:
+        args["compress"] = "gzip"
+    if selection is not None:
+        args["selection"] = selection
+    elif bin is not None:
+        args["bin"] = bin
+    else:
+        args["k"] = k
+    return EXPORT_URL.format(run=run) + "?" + urlencode(args)
+
+
+def chunks(df, rows=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Iterate over frames of at most chunk_rows rows of k-mers with decoded k-mer strings. Only one chunk
+    is copied out of the shared frame at a time, empty export has one empty chunk.
+    :param df: ranked slice of dataset, see AnalysisData.rows
+    :param rows: positions of rows to export, all rows if not set
+    """
+    total = len(df) if rows is None else len(rows)
+    for start in range(0, max(total, 1), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows] if rows is None else df.iloc[rows[start:start + chunk_rows]]
+        chunk = chunk[list(EXPORT_COLUMNS)]
+        yield chunk.assign(**{name: payload.decode_kmers(chunk[name].values) for name in KMER_COLUMNS
+                              if chunk[name].dtype.kind in "iu"})
+
+
+def csv_stream(frames, compress=False):
+    """
+    Serialize frames as one CSV file, optionally gzip-compressed, yielding bytes as they are produced.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    header = True
+    for frame in frames:
+        data = frame.to_csv(index=False, header=header).encode("utf-8")
+        header = False
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+class _Sink(io.RawIOBase):
+    """
+    Write-only file collecting bytes until they are drained. Position keeps counting across drains,
+    Parquet writer stores offsets of row groups in the footer.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.position = 0
+        self.parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def parquet_stream(frames, compress=False):
+    """
+    Serialize frames as one Parquet file with a row group per frame, yielding every row group once written.
+    :param compress: use gzip codec for columns instead of snappy
+    """
+    if pq is None:
+        raise RuntimeError("Parquet export requires pyarrow")
+    sink = _Sink()
+    writer = None
+    for frame in frames:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema, compression="gzip" if compress else "snappy")
+        writer.write_table(table)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def stream(df, fmt="csv", compress=False, rows=None):
+    """
+    Stream ranked k-mers of df, or only given rows of it, in given format.
+    :return: generator of bytes
+    """
+    frames = chunks(df, rows)
+    return parquet_stream(frames, compress) if fmt == "parquet" else csv_stream(frames, compress)
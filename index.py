@@ -1,17 +1,46 @@
+import gzip
+import hashlib
+import json
+import logging
 import os
-from threading import Thread
+import threading
 
+import pandas as pd
 from bokeh.embed import server_document
-from flask import Flask, render_template
+from flask import Flask, Response, abort, jsonify, render_template, request, send_from_directory, url_for
 from tornado import process
 
-from server import bk_worker
+import export
+import metrics
+import payload
+import results
+import snapshot
+from cache import LRUCache
+from datastore import load_catalog, registry
+from plots import KMER_COLUMNS, KMER_TABLE_COLUMNS
+from server import BOKEH_URL, DATA_DIR, start_server, stop_server
 
 TEMPLATE_DIR = os.path.abspath('./templates')
 STATIC_DIR = os.path.abspath('./static')
 
 app = Flask(__name__, template_folder=TEMPLATE_DIR, static_folder=STATIC_DIR)
 port = os.environ.get('PORT', 8000)
+API_CACHE_MB = int(os.environ.get("SBAT_API_CACHE_MB", 64))
+# responses of datasets which are not appended to only change together with their ETag
+API_MAX_AGE = int(os.environ.get("SBAT_API_MAX_AGE", 86400))
+API_MAX_ROWS = int(os.environ.get("SBAT_API_MAX_ROWS", 100000))
+API_KMER_COLUMNS = ("rank",) + KMER_TABLE_COLUMNS
+API_KMER_STRINGS = KMER_COLUMNS + ("canonical",)
+
+# serialized, possibly compressed bodies of API responses by ETag
+responses = LRUCache(API_CACHE_MB * 2 ** 20, sizeof=len)
+metrics.register_cache("api_responses", responses.stats)
+# started once per process when the app is loaded, WSGI servers do not execute __main__; with several worker
+# processes the first one serves the dashboard and pages of all of them embed it from BOKEH_URL
+if start_server() is not None:
+    # snapshots are served only by these pages, the process serving the dashboard builds them in background
+    # and /snapshot answers 404 until they are built; runs which did not change since the last build are skipped
+    threading.Thread(target=snapshot.build, args=(DATA_DIR,), name="snapshots", daemon=True).start()
 
 
 @app.route("/", methods=['GET', 'POST'])
@@ -21,11 +50,41 @@ def app_page():
 
 @app.route("/analysis", methods=['GET'])
 def analysis_page():
-    Thread(target=bk_worker).start()
-    script = server_document('http://localhost:5006/bkapp')
+    script = server_document(BOKEH_URL)
     return render_template("Analysis.html",script=script, template="Flask", relative_urls=False)
 
 
+@app.route("/snapshot", methods=['GET'])
+@app.route("/snapshot/<run>", methods=['GET'])
+def snapshot_page(run=None):
+    """
+    Pre-rendered default plots of run, embedded without Bokeh server session.
+    """
+    manifest = snapshot.load_manifest()
+    if not manifest:
+        abort(404)
+    run = run or next(iter(manifest))
+    if run not in manifest:
+        abort(404)
+    entry = manifest[run]
+    k = int_arg("k", entry["k"][0] if entry["k"] else None)
+    if k not in entry["k"]:
+        abort(404)
+    div = render_template(
+        "Snapshot.html", runs=[(e["name"], key) for key, e in manifest.items()], run=run, name=entry["name"],
+        k_values=entry["k"],
+        plots_url=url_for('snapshot_file', run=run, name="plots.json", v=entry["version"]),
+        kmers_url=url_for('snapshot_file', run=run, name="kmers_{}.json".format(k), v=entry["version"]),
+    )
+    return render_template("Analysis.html", div=div, script="", template="Flask", relative_urls=False)
+
+
+@app.route("/snapshots/<run>/<name>", methods=['GET'])
+def snapshot_file(run, name):
+    # URLs carry version of the snapshot, so they can be cached for long
+    return send_from_directory(os.path.abspath(snapshot.SNAPSHOT_DIR), os.path.join(run, name), max_age=API_MAX_AGE)
+
+
 @app.route("/datasets", methods=['GET', 'POST'])
 def datasets_page():
     return render_template("Datasets.html", template="Flask", relative_urls=False)
@@ -46,9 +105,225 @@ def home_page():
     return render_template("index.html", template="Flask", relative_urls=False)
 
 
+def int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, "{} must be an integer".format(name))
+
+
+def float_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        abort(400, "{} must be a number".format(name))
+
+
+def table_json(df, columns=None, kmers=()):
+    """
+    Serialize requested columns and rows of dataframe as {"columns": [...], "data": [[...], ...]}.
+    Columns are selected by comma separated "columns" argument, rows by "offset" and "limit" arguments.
+    Unnamed index columns written with the CSV files are not served.
+    :param columns: columns returned when none are requested, all columns if not set
+    :param kmers: columns with encoded k-mers, which are decoded to strings
+    """
+    df = df[[name for name in df.columns if not str(name).startswith("Unnamed:")]]
+    names = request.args.get("columns")
+    names = names.split(",") if names else list(columns or df.columns)
+    unknown = [name for name in names if name not in df.columns]
+    if unknown:
+        abort(400, "unknown columns: {}".format(", ".join(unknown)))
+    offset = max(int_arg("offset", 0), 0)
+    limit = min(max(int_arg("limit", API_MAX_ROWS), 0), API_MAX_ROWS)
+    df = df[names].iloc[offset:offset + limit]
+    decoded = {name: payload.decode_kmers(df[name].values) for name in kmers
+               if name in df.columns and df[name].dtype.kind in "iu"}
+    return df.assign(**decoded).to_json(orient="split", index=False)
+
+
+def api_response(keys, compute, version=(), max_age=API_MAX_AGE):
+    """
+    Respond with JSON computed from datasets. Response is identified by ETag derived from the request and
+    versions of the datasets, so unchanged data is answered by 304 and computed and compressed only once.
+    :param keys: keys of datasets the response is computed from
+    :param compute: function returning JSON string, called with the datasets
+    :param version: additional values the response depends on
+    :param max_age: seconds the response may be cached for without revalidation, 0 to always revalidate it
+    """
+    for key in keys:
+        if key not in registry:
+            abort(404)
+    data = [registry[key] for key in keys]
+    etag = hashlib.sha1(repr((
+        request.path, sorted(request.args.items(multi=True)), [d.cache_key for d in data], version,
+    )).encode()).hexdigest()
+    headers = {
+        "Cache-Control": "no-cache" if not max_age or any(registry.appendable(key) for key in keys)
+        else "public, max-age={}".format(max_age),
+        "Vary": "Accept-Encoding",
+    }
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    compress = "gzip" in request.accept_encodings
+    body = responses.get((etag, compress))
+    if body is None:
+        body = compute(*data).encode("utf-8")
+        if compress:
+            body = gzip.compress(body, compresslevel=6)
+        responses.put((etag, compress), body)
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    response = Response(body, mimetype="application/json", headers=headers)
+    response.set_etag(etag)
+    return response
+
+
+@app.route("/api/runs", methods=['GET'])
+def api_runs():
+    """
+    Runs with descriptions of their datasets. Runs are added and datasets grow while the app runs, so the
+    response is built from the current catalog and always revalidated.
+    """
+    catalog = load_catalog(DATA_DIR)
+    body = json.dumps([
+        dict(key=run["key"], name=run["name"], datasets={
+            key: {field: value for field, value in catalog["datasets"][key].items()
+                  if field not in ("path", "kwargs")}
+            for key in run["datasets"]
+        })
+        for run in catalog["runs"]
+        if run["key"] in catalog["datasets"] and run["key"] + "/summary" in catalog["datasets"]
+    ])
+    return api_response([], lambda: body, version=body, max_age=0)
+
+
+@app.route("/api/runs/<run>/summary", methods=['GET'])
+def api_summary(run):
+    return api_response([run + "/summary"], lambda data: table_json(data.df))
+
+
+@app.route("/api/runs/<run>/kmers", methods=['GET'])
+def api_kmers(run):
+    """
+    K-mers of given K ("k" argument, 5 by default) or of given time bin ("bin" argument) ranked by frequency.
+    """
+    bin = int_arg("bin")
+    if bin is not None:
+        return api_response([run + "/bins"],
+                            lambda data: table_json(data.rows(bin=bin), API_KMER_COLUMNS, API_KMER_STRINGS))
+    k = int_arg("k", 5)
+    return api_response([run], lambda data: table_json(data.rows(k=k), API_KMER_COLUMNS, API_KMER_STRINGS))
+
+
+@app.route("/api/runs/<run>/kmers/export", methods=['GET'])
+def api_kmers_export(run):
+    """
+    Stream k-mers of given K ("k" argument, 5 by default) or of given time bin ("bin" argument) ranked by
+    frequency, or only rows selected in a dashboard session ("selection" argument with token of the selection),
+    as CSV or Parquet ("format" argument) file, gzip-compressed with "compress=gzip". Rows are read from the shared
+    dataset chunk by chunk, the download starts before the whole file is serialized.
+    """
+    fmt = request.args.get("format", "csv")
+    if fmt in export.MIMETYPES and fmt not in export.FORMATS:
+        abort(406, "{} export is not available, pyarrow is not installed".format(fmt))
+    if fmt not in export.FORMATS:
+        abort(400, "format must be one of: {}".format(", ".join(export.FORMATS)))
+    compress = request.args.get("compress") == "gzip"
+    token = request.args.get("selection")
+    if token is not None:
+        selection = export.selections.get(token)
+        if selection is None or selection[0].split("/")[0] != run:
+            abort(404)
+        key, version, k, bin, rows = selection
+        if key not in registry:
+            abort(404)
+        data = registry[key]
+        if data.cache_key != version:
+            abort(410, "dataset changed since the k-mers were selected")
+    else:
+        k, bin, rows = int_arg("k", 5), int_arg("bin"), None
+        key = run if bin is None else run + "/bins"
+        if key not in registry:
+            abort(404)
+        data = registry[key]
+
+    df = data.rows(k=k, bin=bin)
+    filename = "{}_{}{}.{}".format(run, "k{}".format(k) if bin is None else "bin{}".format(bin),
+                                   "_selected" if rows is not None else "", fmt)
+    if compress and fmt == "csv":
+        filename += ".gz"
+    headers = {"Content-Disposition": 'attachment; filename="{}"'.format(filename), "Cache-Control": "no-store"}
+    return Response(export.stream(df, fmt, compress, rows),
+                    mimetype="application/gzip" if compress and fmt == "csv" else export.MIMETYPES[fmt],
+                    headers=headers)
+
+
+@app.route("/api/runs/<run>/gc", methods=['GET'])
+def api_gc(run):
+    """
+    GC content and strand bias of top and bottom "margin" % (5 by default) of k-mers of every K.
+    """
+    margin = int_arg("margin", 5)
+    if not 0 < margin <= 100:
+        abort(400, "margin must be between 1 and 100")
+
+    def compute(data):
+        gc_series = results.gc_series(data, margin)
+        names = {"desc": "k", "x": "GC_%", "y": "strand_bias_%"}
+        return '{{"upper":{},"lower":{}}}'.format(
+            pd.DataFrame(gc_series["upper"]).rename(columns=names).to_json(orient="split", index=False),
+            pd.DataFrame(gc_series["lower"]).rename(columns=names).to_json(orient="split", index=False),
+        )
+
+    return api_response([run], compute)
+
+
+@app.route("/api/runs/<run>/ci", methods=['GET'])
+def api_ci(run):
+    """
+    Mean strand bias of every time bin and its confidence interval for "z" score (1.96 by default).
+    """
+    z = float_arg("z", 1.96)
+    return api_response([run + "/bins"], lambda data: table_json(pd.DataFrame(data.ci_data(z))))
+
+
+@app.route("/api/runs/<run>/bin_stats", methods=['GET'])
+def api_bin_stats(run):
+    return api_response([run + "/bin_stats"], lambda data: table_json(data.df))
+
+
+@app.route("/metrics", methods=['GET'])
+def metrics_page():
+    """
+    Metrics of sessions, callbacks, caches and data sent to browsers in Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/metrics/profiles", methods=['GET'])
+def profiles_page():
+    """
+    Sampled stacks of recent slow spans, recorded when SBAT_PROFILE_SLOW_MS is set.
+    """
+    return jsonify(threshold_ms=metrics.profiler.threshold_ms, profiles=list(metrics.profiler.profiles))
+
+
 if __name__ == '__main__':
     #app.run(port=8000)  # host="0.0.0.0" in deployment
     from waitress import serve
-    serve(app, host="0.0.0.0", port=port)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        serve(app, host="0.0.0.0", port=port)
+    finally:
+        stop_server()
 
 
@@ -0,0 +1,290 @@
+import collections
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# spans taking longer than this many milliseconds are profiled by sampling stacks of their thread, 0 disables
+PROFILE_SLOW_MS = float(os.environ.get("SBAT_PROFILE_SLOW_MS", 0))
+PROFILE_INTERVAL_MS = float(os.environ.get("SBAT_PROFILE_INTERVAL_MS", 5))
+PROFILE_KEEP = 50
+SPAN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+
+class Metric:
+    """
+    Metric with values per set of labels, exposed in Prometheus text format. Metrics are shared by all threads
+    and sessions of the process.
+    """
+    kind = "untyped"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def samples(self):
+        """
+        :return: list of (suffix of name, labels, value) tuples
+        """
+        with self._lock:
+            return [("", dict(key), value) for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=SPAN_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = [(dict(key), list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for labels, counts, total in values:
+            for bound, count in zip(self.buckets, counts):
+                samples.append(("_bucket", dict(labels, le="+Inf" if bound == float("inf") else repr(bound)), count))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, counts[-1]))
+        return samples
+
+
+_metrics = collections.OrderedDict()
+_metrics_lock = threading.Lock()
+_caches = collections.OrderedDict()
+
+
+def _register(cls, name, documentation, **kwargs):
+    # modules executed once per session by bokeh serve get the metric registered by the first one
+    with _metrics_lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, documentation, **kwargs)
+        return metric
+
+
+def counter(name, documentation):
+    return _register(Counter, name, documentation)
+
+
+def gauge(name, documentation):
+    return _register(Gauge, name, documentation)
+
+
+def histogram(name, documentation, buckets=SPAN_BUCKETS):
+    return _register(Histogram, name, documentation, buckets=buckets)
+
+
+def register_cache(name, stats):
+    """
+    Expose hits, misses, evictions, entries and size of cache.LRUCache.
+    :param name: value of cache label
+    :param stats: function returning statistics of the cache, e.g. its stats method
+    """
+    with _metrics_lock:
+        _caches[name] = stats
+
+
+SPANS = histogram("sbat_span_seconds", "Duration of instrumented operations and callbacks.")
+SPAN_ERRORS = counter("sbat_span_errors_total", "Instrumented operations which raised an exception.")
+
+
+def observe(name, seconds):
+    SPANS.observe(seconds, span=name)
+
+
+@contextmanager
+def span(name):
+    """
+    Measure duration of the block as span of given name. Slow spans are profiled if profiling is turned on.
+    """
+    profile = profiler.start() if profiler.threshold_ms > 0 else None
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        SPAN_ERRORS.inc(span=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe(name, elapsed)
+        if profile is not None:
+            profiler.finish(profile, name, elapsed)
+
+
+def timed(name):
+    """
+    Decorator measuring every call of function as span of given name. Signature of the function is kept,
+    so that Bokeh accepts the wrapper as callback.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class SamplingProfiler:
+    """
+    Profiler of slow spans. While any span runs, one background thread samples stack of the thread running it
+    every interval. Stacks of spans which took longer than threshold are kept and logged, samples of faster
+    ones are dropped.
+    """
+
+    def __init__(self, threshold_ms=0, interval_ms=5, keep=PROFILE_KEEP):
+        self.threshold_ms = threshold_ms
+        self.interval_ms = interval_ms
+        self.profiles = collections.deque(maxlen=keep)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enable(self, threshold_ms, interval_ms=None):
+        """
+        Turn profiling of spans slower than threshold_ms on, or off with threshold 0.
+        """
+        self.threshold_ms = threshold_ms
+        if interval_ms is not None:
+            self.interval_ms = interval_ms
+
+    def start(self):
+        profile = dict(thread=threading.get_ident(), stacks=collections.Counter())
+        with self._lock:
+            self._active[id(profile)] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+        return profile
+
+    def finish(self, profile, name, seconds):
+        with self._lock:
+            self._active.pop(id(profile), None)
+            stacks = profile["stacks"].most_common(20)
+        if seconds * 1e3 < self.threshold_ms:
+            return
+        self.profiles.append(dict(span=name, seconds=seconds, time=time.time(),
+                                  samples=sum(count for _, count in stacks), stacks=stacks))
+        logger.warning("slow span %s took %.0f ms, hottest stack: %s", name, seconds * 1e3,
+                       stacks[0][0] if stacks else "no samples")
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_ms / 1e3)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for profile in self._active.values():
+                    frame = frames.get(profile["thread"])
+                    if frame is not None:
+                        profile["stacks"][_collapse(frame)] += 1
+
+
+def _collapse(frame, depth=40):
+    # stack from outermost to innermost call in the collapsed format of flame graph tools
+    calls = []
+    while frame is not None and len(calls) < depth:
+        code = frame.f_code
+        calls.append("{}:{}:{}".format(os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+        frame = frame.f_back
+    return ";".join(reversed(calls))
+
+
+profiler = SamplingProfiler(PROFILE_SLOW_MS, PROFILE_INTERVAL_MS)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(name, labels, value):
+    if labels:
+        name += "{" + ",".join('{}="{}"'.format(key, _escape(item)) for key, item in sorted(labels.items())) + "}"
+    return "{} {}".format(name, repr(float(value)) if isinstance(value, float) else value)
+
+
+def _cache_metrics():
+    with _metrics_lock:
+        caches = list(_caches.items())
+    rows = collections.OrderedDict((name, []) for name in (
+        "hits_total", "misses_total", "evictions_total", "entries", "size", "max_size", "hit_ratio"))
+    for cache, stats in caches:
+        values = stats()
+        requests = values["hits"] + values["misses"]
+        for metric, key in (("hits_total", "hits"), ("misses_total", "misses"), ("evictions_total", "evictions"),
+                            ("entries", "entries"), ("size", "size"), ("max_size", "max_size")):
+            rows[metric].append((cache, values[key]))
+        rows["hit_ratio"].append((cache, values["hits"] / requests if requests else 0.0))
+    return rows
+
+
+def render():
+    """
+    Render all metrics in Prometheus text exposition format.
+    """
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for metric in metrics:
+        lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+        lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+        for suffix, labels, value in metric.samples():
+            lines.append(_format(metric.name + suffix, labels, value))
+    for metric, values in _cache_metrics().items():
+        name = "sbat_cache_" + metric
+        kind = "counter" if metric.endswith("_total") else "gauge"
+        lines.append("# HELP {} {} of process-wide caches.".format(name, metric.replace("_total", "").replace("_", " ")))
+        lines.append("# TYPE {} {}".format(name, kind))
+        lines.extend(_format(name, dict(cache=cache), value) for cache, value in values)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,210 @@
+import logging
+
+import numpy as np
+from bokeh.models import CustomJSHover, HTMLTemplateFormatter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+PUSHED_BYTES = metrics.counter("sbat_source_pushed_bytes_total",
+                               "Estimated bytes of ColumnDataSource data sent to browsers, by source.")
+SOURCE_UPDATES = metrics.counter("sbat_source_updates_total",
+                                 "Replacements, patches and streams of ColumnDataSource data, by source.")
+
+NUCLEOTIDES = "ACGT"
+NUCLEOTIDE_BYTES = np.array(list(NUCLEOTIDES), dtype="S1")
+KMER_CODES = np.full(256, 255, dtype=np.uint8)
+for i, nucleotide in enumerate(NUCLEOTIDES):
+    KMER_CODES[ord(nucleotide)] = i
+
+# k-mer is encoded as 2 bits per nucleotide below one sentinel bit marking its length
+DECODE_KMER_JS = """
+    if (typeof value === "string") {
+        return value;
+    }
+    let code = value, kmer = "";
+    while (code > 1) {
+        kmer = "ACGT"[code & 3] + kmer;
+        code >>= 2;
+    }
+    return kmer;
+"""
+
+KMER_TABLE_TEMPLATE = """<%
+    var kmer = value;
+    if (typeof value !== "string") {
+        kmer = "";
+        for (var code = value; code > 1; code >>= 2) {
+            kmer = "ACGT"[code & 3] + kmer;
+        }
+    }
+%><%= kmer %>"""
+
+
+def kmer_hover_formatter():
+    """
+    Formatter for tooltips of columns with encoded k-mers, used as "@seq{kmer}".
+    """
+    return CustomJSHover(code=DECODE_KMER_JS)
+
+
+def kmer_table_formatter():
+    """
+    Formatter for data table columns with encoded k-mers.
+    """
+    return HTMLTemplateFormatter(template=KMER_TABLE_TEMPLATE)
+
+
+def encode_kmers(kmers):
+    """
+    Function to encode k-mers as integers, 2 bits per nucleotide below one sentinel bit marking the length,
+    so codes of k-mers of one length sort like the k-mers. Codes are passed through.
+    :param kmers: array of k-mer strings, k-mers of different lengths may be mixed
+    :return: uint32 array of codes, or the input if k-mers cannot be encoded
+    """
+    if kmers.dtype.kind in "iu":
+        return kmers
+    if len(kmers) == 0:
+        return np.array([], dtype=np.uint32)
+    raw = np.array(kmers.tolist(), dtype=bytes)
+    width = raw.dtype.itemsize
+    if width > 15:
+        return kmers
+    nucleotides = KMER_CODES[raw.view(np.uint8).reshape(len(raw), width)]
+    lengths = np.char.str_len(raw)
+    # positions past the end of shorter k-mers are zero bytes, anything else unknown makes k-mers unencodable
+    if (nucleotides[np.arange(width) < lengths[:, None]] == 255).any():
+        return kmers
+    codes = np.ones(len(raw), dtype=np.uint32)
+    for i in range(width):
+        inside = i < lengths
+        codes[inside] = (codes[inside] << 2) | nucleotides[inside, i]
+    return codes
+
+
+def decode_kmers(codes):
+    """
+    Function to decode k-mers encoded by encode_kmers to strings.
+    :return: object array of k-mer strings
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    kmers = np.full(len(codes), "", dtype=object)
+    lengths = np.zeros(len(codes), dtype=np.int64)
+    rest = codes.copy()
+    while (rest > 1).any():
+        lengths[rest > 1] += 1
+        rest >>= 2
+    for k in np.unique(lengths[lengths > 0]):
+        inside = lengths == k
+        rest = codes[inside]
+        letters = np.empty((len(rest), k), dtype="S1")
+        for i in range(k - 1, -1, -1):
+            letters[:, i] = NUCLEOTIDE_BYTES[rest & 3]
+            rest = rest >> 2
+        kmers[inside] = np.ascontiguousarray(letters).view("S{}".format(k)).ravel().astype(str)
+    return kmers
+
+
+def narrow(values):
+    """
+    Function to convert array to the narrowest dtype which Bokeh sends as binary buffer without losing values
+    of counts and indices, floats are sent in single precision.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        if len(values) and not np.isnan(values).any() and np.all(np.mod(values, 1) == 0):
+            # counts past int32 keep double precision
+            return values.astype(np.int32) if np.abs(values).max() < 2 ** 31 else values.astype(np.float64)
+        return values.astype(np.float32)
+    if values.dtype.kind in "iu":
+        if len(values) == 0 or (values.min() >= -2 ** 31 and values.max() < 2 ** 31):
+            return values.astype(np.int32)
+        return values.astype(np.float64)
+    return values
+
+
+def columns(df, names, kmers=()):
+    """
+    Function to build data of ColumnDataSource with only given columns of dataframe in the narrowest dtypes.
+    :param df: dataframe with the data
+    :param names: names of columns to send
+    :param kmers: names of columns with k-mers, which are sent encoded
+    :return: dict of column name -> array
+    """
+    return {
+        name: narrow(encode_kmers(df[name].values)) if name in kmers else narrow(df[name].values)
+        for name in names
+    }
+
+
+def nbytes(data):
+    """
+    Function to estimate size of ColumnDataSource data on the wire.
+    """
+    size = 0
+    for values in data.values():
+        if isinstance(values, np.ndarray) and values.dtype.kind != "O":
+            size += values.nbytes
+        else:
+            size += sum(len(str(value)) + 3 for value in values)
+    return size
+
+
+def update(source, data, name):
+    """
+    Replace data of ColumnDataSource and log size of the update.
+    """
+    source.data = data
+    rows = len(next(iter(data.values()))) if data else 0
+    size = nbytes(data)
+    PUSHED_BYTES.inc(size, source=name)
+    SOURCE_UPDATES.inc(source=name, operation="update")
+    logger.info("%s update: %d rows, %d columns, %d bytes", name, rows, len(data), size)
+
+
+def _fits(target, values):
+    """
+    Function to check whether values can be stored in target column of ColumnDataSource without overflowing.
+    """
+    if not isinstance(target, np.ndarray) or not isinstance(values, np.ndarray):
+        return True
+    return np.can_cast(values.dtype, target.dtype, "same_kind") and values.dtype.itemsize <= target.dtype.itemsize
+
+
+def append(source, data, start, name):
+    """
+    Update rows of ColumnDataSource from given position on. Rows past the end of the source are streamed and
+    rows before it patched, rows before start are neither changed nor sent again.
+    :param source: ColumnDataSource with the same columns as data
+    :param data: dict of column name -> all values, including the unchanged rows
+    :param start: position of first changed row
+    :param name: name of the source used in log
+    """
+    if not all(_fits(source.data.get(column), values) for column, values in data.items()):
+        # values outgrew dtype the source was sent in, e.g. counts growing past int32, all rows are sent again
+        update(source, data, name)
+        return
+    length = len(next(iter(source.data.values()))) if source.data else 0
+    rows = len(next(iter(data.values()))) if data else 0
+    start = min(start, length)
+    patched = max(0, min(length, rows) - start)
+    if patched:
+        for column, values in source.data.items():
+            if isinstance(values, np.ndarray) and not values.flags.writeable:
+                # patch is applied in place, shared arrays from result cache are replaced by private copies,
+                # which hold the same values as the browser already has
+                dict.__setitem__(source.data, column, values.copy())
+        source.patch({
+            column: [(slice(start, start + patched), values[start:start + patched].tolist())]
+            for column, values in data.items()
+        })
+    if rows > start + patched:
+        source.stream({
+            column: values[start + patched:].astype(source.data[column].dtype, copy=False)
+            if isinstance(source.data.get(column), np.ndarray) else values[start + patched:]
+            for column, values in data.items()
+        })
+    if rows > start:
+        PUSHED_BYTES.inc(nbytes({column: values[start:] for column, values in data.items()}), source=name)
+        SOURCE_UPDATES.inc(source=name, operation="append")
+    logger.info("%s append: %d rows patched, %d rows streamed", name, patched, max(0, rows - start - patched))
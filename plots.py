@@ -1,58 +1,267 @@
+import copy
+import logging
 import os
-import statistics
 from enum import Enum
-from math import sqrt
 from typing import List
 
+from bokeh.core.properties import value
+from bokeh.events import RangesUpdate, Reset, SelectionGeometry
 from bokeh.io import curdoc, show
-from bokeh.models import ColumnDataSource, HoverTool, Whisker, TableColumn, StringFormatter, NumberFormatter, DataTable
+from bokeh.layouts import column, row
+from bokeh.model import Model
+from bokeh.models import ColumnDataSource, HoverTool, Whisker, TableColumn, NumberFormatter, DataTable, Select, \
+    RadioButtonGroup, Button, Div, TextInput
 from bokeh.plotting import figure
 
+import metrics
+import payload
+import results
+import storage
 import utils
+import numpy as np
 import pandas as pd
 
+logger = logging.getLogger(__name__)
+
+
 class BarPlotType(Enum):
     BASES = "Bases"
     READS = "Reads"
 
 
+PIPELINE_VERSION = 3
+PARTITION_COLUMNS = ("k", "bin")
+# k-mer plot shows decimated overview if it would have more points, and full detail of zoomed-in windows
+KMER_PLOT_MAX_POINTS = 5000
+KMER_PLOT_BUCKETS = 1000
+KMER_PLOT_EXTREMES = 500
+KMER_RANGE_DEBOUNCE_MS = 150
+# columns referenced by k-mer plot glyph and tooltips and by data table, only these are sent to the browser
+KMER_COLUMNS = ("seq", "rev_complement")
+KMER_PLOT_COLUMNS = ("rank", "strand_bias_%", "GC_%", "seq", "seq_count", "rev_complement", "rev_complement_count")
+KMER_TABLE_COLUMNS = ("seq", "seq_count", "rev_complement", "rev_complement_count", "strand_bias_%", "GC_%")
+# selected k-mers are sorted and paged on server, data table receives only one page
+TABLE_PAGE_SIZE = 100
+TABLE_SORT_OPTIONS = [
+    ("rank", "Frequency Rank"),
+    ("seq_count", "K-mer Frequency"),
+    ("rev_complement_count", "Complement Frequency"),
+    ("strand_bias_%", "Strand Bias (%)"),
+    ("GC_%", "GC Content (%)"),
+]
+
+
+def partition_column(df):
+    """
+    Function to get column by which rows of the dataset are partitioned, which is K for most of the
+    datasets and bin for nanopore bins.
+    """
+    for column in PARTITION_COLUMNS:
+        if column in df.columns and df[column].notna().all():
+            return column
+    return None
+
+
+def rank_kmers(df, column):
+    """
+    Add count of more frequent out of k-mer and its rev. complement and order k-mers of every partition
+    by it in descending order. Rank column holds position of k-mer within its partition.
+    """
+    df = df.assign(more_freq_count=np.maximum(df["seq_count"].values, df["rev_complement_count"].values))
+    if column is None:
+        df = df.sort_values(by="more_freq_count", ascending=False, kind="mergesort", ignore_index=True)
+        df["rank"] = np.arange(len(df.index))
+    else:
+        df = df.sort_values(by=[column, "more_freq_count"], ascending=[True, False], kind="mergesort",
+                            ignore_index=True)
+        df["rank"] = df.groupby(column).cumcount().values
+    return df
+
+
+def encode_kmer_table(df):
+    """
+    Store k-mers and their rev. complements as 2-bit codes (see payload.encode_kmers) with canonical column
+    holding the smaller code of the pair, and counts as integers. K-mers which cannot be encoded stay strings.
+    """
+    seq = payload.encode_kmers(df["seq"].values)
+    rev_complement = payload.encode_kmers(df["rev_complement"].values)
+    columns = {}
+    if seq.dtype.kind == "u" and rev_complement.dtype.kind == "u":
+        columns.update(seq=seq, rev_complement=rev_complement, canonical=np.minimum(seq, rev_complement))
+    for column in ("seq_count", "rev_complement_count"):
+        counts = df[column].values
+        if counts.dtype.kind == "f" and not np.isnan(counts).any() and np.all(np.mod(counts, 1) == 0):
+            columns[column] = counts.astype(np.int64)
+    return df.assign(**columns)
+
+
+def prepare_frame(df):
+    """
+    Ingest pipeline run once before dataset is cached. Rows are stably sorted by partition column,
+    so rows of every K (or bin) form one contiguous range, k-mer tables are ranked by frequency
+    within the range and their k-mers encoded.
+    """
+    column = partition_column(df)
+    if "seq_count" in df.columns and "rev_complement_count" in df.columns:
+        return rank_kmers(encode_kmer_table(df), column)
+    if column is not None and not df[column].is_monotonic_increasing:
+        df = df.sort_values(by=column, kind="mergesort", ignore_index=True)
+    return df
+
+
 class AnalysisData:
-    def __init__(self, dataset, k=None, nanopore=None, bin=None,bin_total=None, link=None):
+    def __init__(self, dataset, k=None, nanopore=None, bin=None,bin_total=None, link=None, appendable=False):
         self.dataset = dataset
-        self.df = pd.read_csv(dataset)
+        stat = os.stat(dataset)
+        self.df, size = storage.read_frame(dataset, prepare=prepare_frame, pipeline=PIPELINE_VERSION,
+                                           return_size=True, tail=appendable)
         self.k = k
         self.nanopore = nanopore
         self.bin = bin
+        self.bin_total = self.dataset
+        self.link = link
+        self._index(stat, size)
 
-        if "bins" in dataset and nanopore:
-            print("been there")
+    def _index(self, stat, source_size):
+        self.partition_column = partition_column(self.df)
+        self.partitions = self._index_partitions()
+        if self.partition_column == "bin" and self.nanopore:
             self.bin_lower = self.df.bin.min()
             self.bin_upper = self.df.bin.max()
         else:
             self.bin_lower, self.bin_upper = 0, 1
-        self.bin_total = self.dataset
-        self.link = link
+        # memory mapped columns are shared by all processes, only the rest is private to this one
+        self.shared_nbytes = storage.mapped_nbytes(self.df)
+        self._frame_nbytes = int(self.df.memory_usage(deep=True).sum()) - self.shared_nbytes
+        # number of bytes of CSV file the frame holds, rows appended after it are read by extend
+        self.source_size = source_size
+        self.cache_key = (os.path.abspath(self.dataset), stat.st_mtime_ns, source_size)
+        self._gc_sweep = None
+
+    @property
+    def nbytes(self):
+        """
+        Private memory of dataset, its columns which are not memory mapped and structures derived from them.
+        """
+        return self._frame_nbytes + (self._gc_sweep.nbytes if self._gc_sweep is not None else 0)
+
+    def extend(self):
+        """
+        Get copy of dataset with rows appended to its CSV file since it was read. Only the appended tail of the file
+        is parsed, partitions which got new rows are prepared again together with their earlier rows. Rows are
+        expected to be appended as whole lines. This dataset is not modified, sessions may still use it.
+        New frame is a private copy of the whole dataset in every worker process, an append costs time and memory
+        proportional to all rows rather than the appended ones, and the frame no longer shares the memory mapped
+        cache with other processes (and counts fully towards the registry budget) until the file is loaded again.
+        :return: tuple of new AnalysisData and position of its first row which differs from this dataset,
+        or None if no complete row was appended
+        """
+        stat = os.stat(self.dataset)
+        rows, offset = storage.read_tail(self.dataset, self.source_size)
+        if rows.empty:
+            return None
+
+        if "seq_count" in rows.columns and "rev_complement_count" in rows.columns:
+            # earlier rows are encoded already
+            rows = encode_kmer_table(rows)
+        start = len(self.df.index)
+        if self.partition_column in rows.columns:
+            first = rows[self.partition_column].min()
+            start = next((part.start for value, part in self.partitions.items() if value >= first), start)
+        tail = prepare_frame(pd.concat([self.df.iloc[start:], rows], ignore_index=True))
+
+        data = copy.copy(self)
+        data.df = pd.concat([self.df.iloc[:start], tail], ignore_index=True)
+        data._index(stat, offset)
+        return data, start
+
+    def _index_partitions(self):
+        """
+        Build index of row ranges of every value of partition column, rows are sorted by it on ingest.
+        :return: dict of partition value -> slice of its rows, ordered by value
+        """
+        if self.partition_column is None:
+            return {}
+        values = self.df[self.partition_column].values
+        starts = [0] + list(np.flatnonzero(values[1:] != values[:-1]) + 1)
+        stops = starts[1:] + [len(values)]
+        return {values[start].item(): slice(start, stop) for start, stop in zip(starts, stops)}
+
+    def rows(self, k=None, bin=None):
+        """
+        Get rows of given K or bin. Rows of partition column are returned as a view without copying,
+        frame is shared by all sessions and must not be modified.
+        """
+        column, value = ("k", k) if bin is None else ("bin", bin)
+        if column != self.partition_column:
+            return self.df[self.df[column] == value]
+        return self.df.iloc[self.partitions.get(value, slice(0, 0))]
+
+    def gc_data(self, margin):
+        """
+        Get GC content and strand bias of top and bottom margin % of k-mers of every K. Sweep over sorted
+        k-mers is built on first call, so later margins are computed without touching the k-mers.
+        :return: utils.CalculatedGCData or None if no K has enough k-mers
+        """
+        if self._gc_sweep is None:
+            self._gc_sweep = utils.GCSweep(self.df)
+        return utils.calculate_gc_plot_data(self.df, margin, sweep=self._gc_sweep)
+
+    def ci_data(self, z=1.96):
+        """
+        Get mean strand bias and its confidence interval for every bin.
+        :return: dict of columns, see utils.calculate_ci_data
+        """
+        return utils.calculate_ci_data(self.df, z)
+
+    def groups(self):
+        """
+        Iterate over partition values and views of their rows, in ascending order of the value.
+        """
+        for value, rows in self.partitions.items():
+            yield value, self.df.iloc[rows]
 
 
 class Plotter:
-    def __init__(self, data_summary, data):
-        self.lineplot_ids = []
+    """
+    Figures are built together with their glyphs, data sources and tools when their create method is called
+    for the first time or with new=True. Later calls only replace data of the sources and texts of the figure.
+    """
+
+    def __init__(self, data_summary, data, margin=5):
         self.lineplot = None
+        self.lineplot_ds = ColumnDataSource()
+        self.lineplot_hovers = []
+        # description and column of every hover of lineplot by figure, kept out of models sent to browsers
+        self._hover_columns = {}
         self.create_lineplot(data_summary)
         self.gc_plot = None
-        self.create_gc_plot(data, 5)
+        self.gc_upper_ds = ColumnDataSource()
+        self.gc_lower_ds = ColumnDataSource()
+        self.create_gc_plot(data, margin)
         self.kmer_plot = None
 
         self.ci_plot = None
+        self.ci_ds = ColumnDataSource()
         self.barplot = None
+        self.bar_ds = ColumnDataSource()
+        self.bar_hover = None
         self.data_table = self.create_data_table()
+        self.table_page = 0
+        self._table_order = None
+        self.table = self.create_table_controls()
         self.kmer_df = None
+        self._kmer_slice = None
         self.kmer_ds = ColumnDataSource()
+        self.kmer_rows = np.array([], dtype=np.int64)
+        self.selected_rows = np.array([], dtype=np.int64)
+        self._kmer_window = None
+        self._kmer_window_pending = False
+        self._restoring_selection = False
+        # CI and bar plots of nanopore runs are built from bins datasets by create_ci_plot and bar_plot
         self.create_kmer_plot(data, 5)
-        if data.nanopore:
-            self.bar_plot(data, plot_type=BarPlotType.READS)
-            self.ci_plot = self.create_ci_plot(data)
 
+    @metrics.timed("plotter.create_lineplot")
     def create_lineplot(self, data: AnalysisData, new=True):
         if data.bin is not None:
             x_axis = "Bin"
@@ -69,55 +278,46 @@ class Plotter:
                 tools="crosshair, pan,reset, save,wheel_zoom, box_select, "
                       "poly_select, tap, box_zoom",
             )
-
-        else:
-            self.lineplot.renderers = []
-
-        ds = ColumnDataSource(data.df)
-        mean = self.lineplot.line(data.df[x_axis.lower()], data.df["bias_mean"], line_color="green",
-                                  legend_label="Mean",
-                                  line_width=3, name="Mean")
-        self.lineplot_ids.append(mean.id)
-        median = self.lineplot.line(data.df[x_axis.lower()], data.df["bias_median"], line_color="blue",
-                                    legend_label="Median",
-                                    line_width=3,
-                                    name="Median")
-        modus = self.lineplot.line(data.df[x_axis.lower()], data.df["bias_modus"], line_color="pink",
-                                   legend_label="Mode",
-                                   line_width=3,
-                                   name="Mode")
-        perc_5 = self.lineplot.line(data.df[x_axis.lower()], data.df["percentile_5"], line_color="orange",
-                                    legend_label="5th Percentile", line_width=3, name="5th Percentile")
-        perc_95 = self.lineplot.line(data.df[x_axis.lower()], data.df["percentile_95"], line_color="red",
-                                     legend_label="95th Percentile", line_width=3, name="95th Percentile")
-
-        self.lineplot.add_tools(
-            HoverTool(tooltips="Median strand bias: @y {}: @x".format(x_axis), renderers=[median], mode="vline"))
-        self.lineplot.add_tools(
-            HoverTool(tooltips="Mean strand bias: @y {}: @x".format(x_axis), renderers=[mean], mode="vline"))
-        self.lineplot.add_tools(
-            HoverTool(tooltips="Mode strand bias: @y {}: @x".format(x_axis), renderers=[modus], mode="vline"))
-        self.lineplot.add_tools(
-            HoverTool(tooltips="5th percentile of strand bias: @y {}: @x".format(x_axis), renderers=[perc_5],
-                      mode="vline"))
-        self.lineplot.add_tools(
-            HoverTool(tooltips="95th percentile of strand bias: @y {}: @x".format(x_axis), renderers=[perc_95],
-                      mode="vline"))
-
-        self.lineplot.legend.click_policy = "hide"
+            self.lineplot_ds = ColumnDataSource()
+            self.lineplot_hovers = []
+            self._hover_columns = {self.lineplot: []}
+            lines = [
+                ("bias_mean", "Mean", "green", "Mean strand bias"),
+                ("bias_median", "Median", "blue", "Median strand bias"),
+                ("bias_modus", "Mode", "pink", "Mode strand bias"),
+                ("percentile_5", "5th Percentile", "orange", "5th percentile of strand bias"),
+                ("percentile_95", "95th Percentile", "red", "95th percentile of strand bias"),
+            ]
+            for column, label, color, description in lines:
+                line = self.lineplot.line("x", column, source=self.lineplot_ds, line_color=color, legend_label=label,
+                                          line_width=3, name=label)
+                hover = HoverTool(renderers=[line], mode="vline")
+                self._hover_columns[self.lineplot].append((description, column))
+                self.lineplot_hovers.append(hover)
+                self.lineplot.add_tools(hover)
+
+            self.lineplot.legend.click_policy = "hide"
+            self.lineplot.yaxis.axis_label = "Strand Bias [%]"
+            self.lineplot.xaxis.axis_label_text_font_size = "15pt"
+            self.lineplot.yaxis.axis_label_text_font_size = "15pt"
+            self.lineplot.title.text_font_size = "15pt"
+
+        columns = {"x": data.df[x_axis.lower()].values}
+        for hover, (description, column) in zip(self.lineplot_hovers, self._hover_columns[self.lineplot]):
+            columns[column] = data.df[column].values
+            hover.tooltips = "{}: @{{{}}} {}: @x".format(description, column, x_axis)
+        payload.update(self.lineplot_ds, {name: payload.narrow(values) for name, values in columns.items()},
+                       "line plot")
+        self.lineplot.title.text = title
         self.lineplot.xaxis.axis_label = x_axis
-        self.lineplot.yaxis.axis_label = "Strand Bias [%]"
-        self.lineplot.xaxis.axis_label_text_font_size = "15pt"
-        self.lineplot.yaxis.axis_label_text_font_size = "15pt"
-        self.lineplot.title.text_font_size = "15pt"
-
         return self.lineplot
 
+    @metrics.timed("plotter.create_gc_plot")
     def create_gc_plot(self, data: AnalysisData, margin=5, new=True):
         try:
-            gc_data = utils.calculate_gc_plot_data(data.df, margin)
+            gc_series = self.prepare_gc_plot(data, margin)
         except Exception:
-            print("failed on data ", data.df, data.df.info())
+            logger.exception("failed to compute GC plot of %s", data.dataset)
             return
 
         if self.gc_plot is None or new:
@@ -128,62 +328,91 @@ class Plotter:
                 tools="crosshair, pan,reset, save,wheel_zoom, box_select, "
                       "poly_select, tap, box_zoom",
             )
-        else:
-            self.gc_plot.renderers = []
-
-        tooltips = [
-            ("Average GC Content (%)", "@x"),
-            ("Average Strand Bias", "@y"),
-            ("K", "@desc")
-        ]
-
-        self.gc_plot.add_tools(
-            HoverTool(
-                tooltips=tooltips,
+            self.gc_upper_ds = ColumnDataSource()
+            self.gc_lower_ds = ColumnDataSource()
+
+            tooltips = [
+                ("Average GC Content (%)", "@x"),
+                ("Average Strand Bias", "@y"),
+                ("K", "@desc")
+            ]
+
+            self.gc_plot.add_tools(
+                HoverTool(
+                    tooltips=tooltips,
+                )
             )
-        )
-
-        source = ColumnDataSource(data=dict(
-            x=gc_data.upper_gc,
-            y=gc_data.upper_biases,
-            desc=data.df["k"].unique(),
-        ))
-
-        self.gc_plot.scatter('x',
-                             'y',
-                             color="red",
-                             fill_color="red",
-                             size=10,
-                             legend_label="GC Content vs Strand Bias in Top {}% of SB Score".format(margin),
-                             marker="inverted_triangle",
-                             source=source)
-
-        source = ColumnDataSource(data=dict(
-            x=gc_data.lower_gc,
-            y=gc_data.lower_biases,
-            desc=[5, 6, 7, 8, 9],
-        ))
-        self.gc_plot.scatter('x',
-                             'y',
-                             color="green",
-                             fill_color="green",
-                             size=10,
-                             legend_label="GC Content vs Strand Bias in Bottom {}% of SB Score".format(margin),
-                             marker="triangle",
-                             source=source)
-        self.gc_plot.xaxis.axis_label = "GC Content [%]"
-        self.gc_plot.yaxis.axis_label = "Strand Bias [%]"
-        self.gc_plot.legend.location = "top_left"
-        self.gc_plot.xaxis.axis_label_text_font_size = "15pt"
-        self.gc_plot.yaxis.axis_label_text_font_size = "15pt"
-        self.gc_plot.title.text_font_size = "15pt"
+
+            self.gc_plot.scatter('x',
+                                 'y',
+                                 color="red",
+                                 fill_color="red",
+                                 size=10,
+                                 legend_label="GC Content vs Strand Bias in Top % of SB Score",
+                                 marker="inverted_triangle",
+                                 source=self.gc_upper_ds)
+            self.gc_plot.scatter('x',
+                                 'y',
+                                 color="green",
+                                 fill_color="green",
+                                 size=10,
+                                 legend_label="GC Content vs Strand Bias in Bottom % of SB Score",
+                                 marker="triangle",
+                                 source=self.gc_lower_ds)
+            self.gc_plot.xaxis.axis_label = "GC Content [%]"
+            self.gc_plot.yaxis.axis_label = "Strand Bias [%]"
+            self.gc_plot.legend.location = "top_left"
+            self.gc_plot.xaxis.axis_label_text_font_size = "15pt"
+            self.gc_plot.yaxis.axis_label_text_font_size = "15pt"
+            self.gc_plot.title.text_font_size = "15pt"
+
+        payload.update(self.gc_upper_ds, gc_series["upper"], "GC plot")
+        payload.update(self.gc_lower_ds, gc_series["lower"], "GC plot")
+        upper, lower = self.gc_plot.legend.items
+        upper.label = value("GC Content vs Strand Bias in Top {}% of SB Score".format(margin))
+        lower.label = value("GC Content vs Strand Bias in Bottom {}% of SB Score".format(margin))
         return self.gc_plot
 
+    @staticmethod
+    @metrics.timed("plotter.prepare_gc_plot")
+    def prepare_gc_plot(data: AnalysisData, margin=5):
+        """
+        Compute data of GC plot into process-wide result cache. Touches no model, so it may run in worker thread.
+        """
+        return results.gc_series(data, margin)
+
+    @staticmethod
+    @metrics.timed("plotter.prepare_kmer_plot")
+    def prepare_kmer_plot(data: AnalysisData, K, bin=None):
+        """
+        Compute overview of k-mer plot into process-wide result cache. Touches no model, so it may run
+        in worker thread.
+        """
+        return results.kmer_overview(data, None if bin is not None else K, bin, KMER_PLOT_COLUMNS, KMER_COLUMNS,
+                                     KMER_PLOT_MAX_POINTS, KMER_PLOT_BUCKETS, KMER_PLOT_EXTREMES)
+
+    @staticmethod
+    @metrics.timed("plotter.prepare_search")
+    def prepare_search(data: AnalysisData, K, bin=None):
+        """
+        Build index of k-mers of given K or bin for motif search into process-wide result cache. Touches no model,
+        so it may run in worker thread.
+        """
+        return results.kmer_index(data, None if bin is not None else K, bin)
+
+    @staticmethod
+    @metrics.timed("plotter.prepare_ci_plot")
+    def prepare_ci_plot(data: AnalysisData, z=1.96):
+        """
+        Compute data of CI plot into process-wide result cache. Touches no model, so it may run in worker thread.
+        """
+        return results.ci_table(data, z)
+
+    @metrics.timed("plotter.create_kmer_plot")
     def create_kmer_plot(self, data: AnalysisData, K, new=True, bin=None):
         if data is None:
             return
 
-
         if self.kmer_plot is None or new:
             self.kmer_plot = figure(
                 plot_height=400,
@@ -192,121 +421,152 @@ class Plotter:
                 tools="crosshair, pan,reset, save,wheel_zoom, box_select, "
                       "poly_select, tap, box_zoom, lasso_select",
             )
-        else:
-            self.kmer_plot.renderers = []
-
-        tooltips = [
-            ("K-mer", "@seq"),
-            ("Frequency", "@seq_count"),
-            ("Complement", "@rev_complement"),
-            ("Frequency", "@rev_complement_count"),
-            ("Strand Bias (%)", "@{strand_bias_%}"),
-            ("GC Content (%)", "@{GC_%}"),
-        ]
+            self.connect_kmer_plot()
+
+            tooltips = [
+                ("K-mer", "@seq{kmer}"),
+                ("Frequency", "@seq_count"),
+                ("Complement", "@rev_complement{kmer}"),
+                ("Frequency", "@rev_complement_count"),
+                ("Strand Bias (%)", "@{strand_bias_%}"),
+                ("GC Content (%)", "@{GC_%}"),
+            ]
+
+            self.kmer_plot.add_tools(
+                HoverTool(
+                    tooltips=tooltips,
+                    formatters={
+                        "@seq": payload.kmer_hover_formatter(),
+                        "@rev_complement": payload.kmer_hover_formatter(),
+                    },
+                )
+            )
 
-        self.kmer_plot.add_tools(
-            HoverTool(
-                tooltips=tooltips,
+            self.kmer_plot.circle(
+                "rank",
+                "strand_bias_%",
+                source=self.kmer_ds,
+                name="Strand bias of k-mers in relation to frequency",
+                legend_label="Strand bias of k-mers in relation to frequency",
+                color="green",
             )
-        )
+
+            self.kmer_plot.yaxis.axis_label = "Strand Bias [%]"
+            self.kmer_plot.xaxis.axis_label_text_font_size = "15pt"
+            self.kmer_plot.yaxis.axis_label_text_font_size = "15pt"
+            self.kmer_plot.title.text_font_size = "15pt"
 
         if bin is not None:
             if self.ci_plot is None:
                 self.create_ci_plot(data, new=new)
-            self.kmer_df = data.df[data.df.bin == bin].copy()
+            self.kmer_df = data.rows(bin=bin)
+            self._kmer_slice = (data, None, bin)
+            # search covers only k-mers of the plot
+            self.search_input.title = "Search k-mer or IUPAC motif in bin {}".format(bin)
         else:
-            self.kmer_df = data.df[data.df.k == K].copy()
-
-        self.kmer_df["more_freq_count"] = self.kmer_df.apply(lambda row: utils.select_more_frequent(row),
-                                                             axis=1)
-        # get more frequent out of k-mer and its rev. complement
-        self.kmer_df = self.kmer_df.sort_values(by=['more_freq_count'], ascending=False, ignore_index=True)
-        self.kmer_ds.data = self.kmer_df
-        self.kmer_plot.circle(
-            "index",
-            "strand_bias_%",
-            source=self.kmer_ds,
-            name="Strand bias of k-mers in relation to frequency",
-            legend_label="Strand bias of k-mers in relation to frequency",
-            color="green",
-        )
-
-        self.kmer_plot.yaxis.axis_label = "Strand Bias [%]"
-        self.kmer_plot.xaxis.axis_label_text_font_size = "15pt"
-        self.kmer_plot.yaxis.axis_label_text_font_size = "15pt"
-        self.kmer_plot.title.text_font_size = "15pt"
+            self.kmer_df = data.rows(k=K)
+            self._kmer_slice = (data, K, None)
+            self.search_input.title = "Search k-mer or IUPAC motif among K = {}".format(K)
+
+        # k-mers are ranked by frequency of more frequent out of k-mer and its rev. complement on ingest
+        self.selected_rows = np.array([], dtype=np.int64)
+        self._table_order = None
+        self._kmer_window = None
+        self.search_input.value = ""
+        self.show_kmer_overview()
+        self.update_table()
         return self.kmer_plot
 
+    @metrics.timed("plotter.create_ci_plot")
     def create_ci_plot(self, data, z=1.96, new=True):
-        if new:
+        if self.ci_plot is None or new:
             self.ci_plot = figure(width=800, height=400, title="Confidence Intervals among Different Bins")
-        else:
-            self.ci_plot.renderers = []
-
-        self.ci_plot.y_range.start = 0
-        base, lower, upper, mean = [], [], [], []
-        for i, bin in enumerate(list(data.df.bin.unique())):
-            valid = data.df[data.df["bin"] == bin]["strand_bias_%"]
-            valid_mean = valid.mean()
-            stdev = statistics.stdev(valid)
-            confidence_interval = z * stdev / sqrt(len(valid))
-            lower.append(valid_mean - confidence_interval)
-            upper.append(valid_mean + confidence_interval)
-            base.append(bin)
-            mean.append(valid_mean)
-            self.ci_plot.circle(x=bin, y=valid_mean, color='#f44336')
-
-        source_error = ColumnDataSource(data=dict(base=base, lower=lower, upper=upper))
-        self.ci_plot.add_layout(
-            Whisker(source=source_error, base="base", upper="upper", lower="lower")
-        )
-
-        # add hover just to the two box renderers
-        self.ci_plot.add_tools(
-            HoverTool(renderers=self.ci_plot.renderers,
-                      tooltips=[
-                          ('Bin', '@base'),
-                          ('Mean', '@mean'),
-                          ('2.5th Percentile', '@lower'),
-                          ('97.5th Percentile', '@upper')
-                      ])
-        )
-
-        self.ci_plot.xaxis.axis_label = "Time bins"
-        self.ci_plot.yaxis.axis_label = "Strand Bias [%]"
-        self.ci_plot.legend.location = "top_left"
-        self.ci_plot.xaxis.axis_label_text_font_size = "15pt"
-        self.ci_plot.yaxis.axis_label_text_font_size = "15pt"
-        self.ci_plot.title.text_font_size = "15pt"
+            self.ci_ds = ColumnDataSource()
+            self.ci_plot.y_range.start = 0
+            means = self.ci_plot.circle("base", "mean", source=self.ci_ds, color='#f44336')
+            self.ci_plot.add_layout(
+                Whisker(source=self.ci_ds, base="base", upper="upper", lower="lower")
+            )
 
+            self.ci_plot.add_tools(
+                HoverTool(renderers=[means],
+                          tooltips=[
+                              ('Bin', '@base'),
+                              ('Mean', '@mean'),
+                              ('2.5th Percentile', '@lower'),
+                              ('97.5th Percentile', '@upper')
+                          ])
+            )
+
+            self.ci_plot.xaxis.axis_label = "Time bins"
+            self.ci_plot.yaxis.axis_label = "Strand Bias [%]"
+            self.ci_plot.xaxis.axis_label_text_font_size = "15pt"
+            self.ci_plot.yaxis.axis_label_text_font_size = "15pt"
+            self.ci_plot.title.text_font_size = "15pt"
+
+        payload.update(self.ci_ds, self.prepare_ci_plot(data, z), "CI plot")
+        return self.ci_plot
+
+    @metrics.timed("plotter.bar_plot")
     def bar_plot(self, data, plot_type: BarPlotType, new=True):
-        if new:
-            self.barplot = figure(width=800, height=400, title="Distribution of {} among time bins".format(plot_type.value.lower()))
-        else:
-            self.barplot.renderers = []
-
-        self.barplot.vbar(x=data.df.bin, top=data.df[plot_type.value.lower()], width=0.5, legend_label="Number of {} per time bin".format(plot_type.value.lower()))
-        self.barplot.add_tools(
-            HoverTool(renderers=self.barplot.renderers,
-                      tooltips=[
-                          ("Bin", '@x'),
-                          (plot_type.value, '@top')
-                      ])
-        )
-
-        self.barplot.xaxis.axis_label = "Time bin"
+        if self.barplot is None or new:
+            self.barplot = figure(width=800, height=400)
+            self.bar_ds = ColumnDataSource()
+            self.barplot.vbar(x="x", top="top", source=self.bar_ds, width=0.5, legend_label="Number per time bin")
+            self.bar_hover = HoverTool(renderers=self.barplot.renderers)
+            self.barplot.add_tools(self.bar_hover)
+
+            self.barplot.xaxis.axis_label = "Time bin"
+            self.barplot.legend.location = "top_left"
+            self.barplot.xaxis.axis_label_text_font_size = "15pt"
+            self.barplot.yaxis.axis_label_text_font_size = "15pt"
+            self.barplot.title.text_font_size = "15pt"
+
+        payload.update(self.bar_ds, dict(
+            x=payload.narrow(data.df.bin.values),
+            top=payload.narrow(data.df[plot_type.value.lower()].values),
+        ), "bar plot")
+        self.barplot.title.text = "Distribution of {} among time bins".format(plot_type.value.lower())
+        self.barplot.legend.items[0].label = value("Number of {} per time bin".format(plot_type.value.lower()))
         self.barplot.yaxis.axis_label = "Number of {} in bin".format(plot_type.value)
-        self.barplot.legend.location = "top_left"
-        self.barplot.xaxis.axis_label_text_font_size = "15pt"
-        self.barplot.yaxis.axis_label_text_font_size = "15pt"
-        self.barplot.title.text_font_size = "15pt"
+        self.bar_hover.tooltips = [
+            ("Bin", '@x'),
+            (plot_type.value, '@top')
+        ]
+        return self.barplot
 
+    @metrics.timed("plotter.stream_bar_plot")
+    def stream_bar_plot(self, data, plot_type: BarPlotType, start):
+        """
+        Send bins of bin stats dataset from given row on to bar plot, earlier bins are not sent again.
+        """
+        if self.barplot is None:
+            return
+        payload.append(self.bar_ds, dict(
+            x=payload.narrow(data.df.bin.values),
+            top=payload.narrow(data.df[plot_type.value.lower()].values),
+        ), start, "bar plot")
+
+    @metrics.timed("plotter.stream_ci_plot")
+    def stream_ci_plot(self, data, start, z=1.96):
+        """
+        Send CI of bins which got new k-mers from given row of bins dataset on to CI plot, CI of earlier bins
+        is not sent again.
+        """
+        if self.ci_plot is None:
+            return
+        ci = self.prepare_ci_plot(data, z)
+        bins = data.df.bin.values
+        first = np.searchsorted(ci["base"], bins[start]) if start < len(bins) else len(ci["base"])
+        payload.append(self.ci_ds, ci, first, "CI plot")
+
+    @metrics.timed("plotter.create_data_table")
     def create_data_table(self):
         columns = [
             TableColumn(
                 field="seq",
                 title="K-mer",
-                formatter=StringFormatter(),
+                formatter=payload.kmer_table_formatter(),
                 width=200
             ),
             TableColumn(
@@ -318,7 +578,7 @@ class Plotter:
             TableColumn(
                 field="rev_complement",
                 title="Reverse Complement",
-                formatter=StringFormatter(),
+                formatter=payload.kmer_table_formatter(),
             ),
             TableColumn(
                 field="rev_complement_count",
@@ -337,31 +597,272 @@ class Plotter:
             )
         ]
 
-        return DataTable(columns=columns, width=900)
+        return DataTable(columns=columns, width=900, sortable=False)
+
+    @metrics.timed("plotter.create_table_controls")
+    def create_table_controls(self):
+        """
+        Create widgets for sorting and paging of selected k-mers and their summary.
+        :return: layout with the widgets and data table
+        """
+        self.table_summary = Div(text="No k-mers selected", width=900)
+        self.table_sort = Select(title="Sort by", value="rank", options=TABLE_SORT_OPTIONS, width=200)
+        self.table_sort_order = RadioButtonGroup(labels=["Ascending", "Descending"], active=0, width=200)
+        self.table_previous = Button(label="Previous", width=100, disabled=True)
+        self.table_next = Button(label="Next", width=100, disabled=True)
+        self.table_page_info = Div(text="Page 1 of 1", width=150)
+        self.search_input = TextInput(title="Search k-mer or IUPAC motif", placeholder="e.g. ACGTA or RCGY", width=200)
+
+        self.connect_table_controls()
+
+        controls = row(self.search_input, self.table_sort, column(Div(text="Order"), self.table_sort_order),
+                       column(Div(text="Page"), row(self.table_previous, self.table_next, self.table_page_info)))
+        return column(self.table_summary, controls, self.data_table)
+
+    def connect_kmer_plot(self):
+        self.kmer_plot.on_event(RangesUpdate, self.on_kmer_range_change)
+        self.kmer_plot.on_event(Reset, self.on_kmer_reset)
+        self.kmer_plot.on_event(SelectionGeometry, self.on_kmer_selection)
+
+    def connect_table_controls(self):
+        self.table_sort.on_change("value", self.on_table_sort_change)
+        self.table_sort_order.on_change("active", self.on_table_sort_change)
+        self.table_previous.on_click(lambda: self.update_table(self.table_page - 1))
+        self.table_next.on_click(lambda: self.update_table(self.table_page + 1))
+
+    def models(self):
+        """
+        :return: dict of attribute name -> model or list of models held by the plotter
+        """
+        return {
+            name: value for name, value in vars(self).items()
+            if isinstance(value, Model) or isinstance(value, list) and value and isinstance(value[0], Model)
+        }
+
+    def clone(self, references):
+        """
+        Copy of the plotter bound to copies of its models, e.g. hydrated from JSON of a document template.
+        Other state, like the shown k-mers, is shared with this plotter, it is only ever replaced, not changed
+        in place.
+        :param references: dict of model id -> copy of the model
+        """
+        plotter = copy.copy(self)
+        for name, value in self.models().items():
+            setattr(plotter, name, [references[item.id] for item in value] if isinstance(value, list)
+                    else references[value.id])
+        plotter._hover_columns = {references[figure.id]: columns for figure, columns in self._hover_columns.items()}
+        plotter.connect_table_controls()
+        if plotter.kmer_plot is not None:
+            plotter.connect_kmer_plot()
+        return plotter
+
+    def on_table_sort_change(self, attr, old, new):
+        self._table_order = None
+        self.update_table()
+
+    def sort_selection(self):
+        """
+        Get order of selected k-mers by chosen column and direction.
+        """
+        values = self.kmer_df[self.table_sort.value].values[self.selected_rows]
+        order = np.argsort(values, kind="stable")
+        if self.table_sort_order.active == 1:
+            order = order[::-1]
+        return order
+
+    @metrics.timed("plotter.update_table")
+    def update_table(self, page=0):
+        """
+        Send given page of sorted selected k-mers to data table and update summary of the selection. Paging, order
+        and summary cover all selected k-mers, including those left out of the decimated k-mer plot.
+        """
+        count = len(self.selected_rows)
+        pages = max(1, -(-count // TABLE_PAGE_SIZE))
+        self.table_page = min(max(page, 0), pages - 1)
+        if self.kmer_df is None:
+            return
+        if self._table_order is None:
+            self._table_order = self.sort_selection()
+
+        start = self.table_page * TABLE_PAGE_SIZE
+        page_rows = self.selected_rows[self._table_order[start:start + TABLE_PAGE_SIZE]]
+        payload.update(self.data_table.source,
+                       payload.columns(self.kmer_df.iloc[page_rows], KMER_TABLE_COLUMNS, KMER_COLUMNS),
+                       "k-mer table")
+
+        self.table_page_info.text = "Page {} of {}".format(self.table_page + 1, pages)
+        self.table_previous.disabled = self.table_page == 0
+        self.table_next.disabled = self.table_page == pages - 1
+        if count == 0:
+            self.table_summary.text = "No k-mers selected"
+        else:
+            shown = np.count_nonzero(np.isin(self.kmer_rows, self.selected_rows))
+            self.table_summary.text = "Selected k-mers: {:,}{} | Mean strand bias: {:.2f} % | Mean GC content: {:.2f} %".format(
+                count,
+                " ({:,} shown in plot)".format(shown) if shown < count else "",
+                self.kmer_df["strand_bias_%"].values[self.selected_rows].mean(),
+                self.kmer_df["GC_%"].values[self.selected_rows].mean(),
+            )
+
+    def show_kmer_overview(self):
+        """
+        Send k-mers shown when whole k-mer plot is visible, decimated if there are too many of them, to k-mer plot.
+        Overview is computed once per process and shared by all sessions.
+        """
+        overview = self.prepare_kmer_plot(*self._kmer_slice)
+        self.show_kmer_rows(overview["rows"], overview["columns"])
+
+    def kmer_window(self, x0, x1, y0, y1):
+        """
+        Get positions of k-mers inside of visible window of k-mer plot, decimated if there are too many of them.
+        """
+        x = self.kmer_df["rank"].values
+        y = self.kmer_df["strand_bias_%"].values
+        start, stop = np.searchsorted(x, x0, side="left"), np.searchsorted(x, x1, side="right")
+        rows = start + np.flatnonzero((y[start:stop] >= y0) & (y[start:stop] <= y1))
+        if len(rows) > KMER_PLOT_MAX_POINTS:
+            rows = rows[utils.decimate(x[rows], y[rows], KMER_PLOT_BUCKETS, KMER_PLOT_EXTREMES)]
+        return rows
+
+    def show_kmer_rows(self, rows, columns=None):
+        """
+        Send given rows of k-mer dataframe to k-mer plot, keeping selected k-mers which are among them selected.
+        :param rows: positions of k-mers in k-mer dataframe
+        :param columns: data of k-mer plot source with the rows, if already computed
+        """
+        self.kmer_rows = rows
+        if columns is None:
+            columns = payload.columns(self.kmer_df.iloc[rows], KMER_PLOT_COLUMNS, KMER_COLUMNS)
+        payload.update(self.kmer_ds, columns, "k-mer plot")
+        self.show_selection()
+
+    def show_selection(self):
+        """
+        Select selected k-mers which are shown in k-mer plot.
+        """
+        self._restoring_selection = True
+        try:
+            self.kmer_ds.selected.indices = list(np.flatnonzero(np.isin(self.kmer_rows, self.selected_rows)))
+        finally:
+            self._restoring_selection = False
+
+    def on_kmer_range_change(self, event):
+        """
+        Called upon zooming or panning k-mer plot. Detail of visible window is sent once ranges stop changing.
+        """
+        if None in (event.x0, event.x1, event.y0, event.y1):
+            return
+        self._kmer_window = (event.x0, event.x1, event.y0, event.y1)
+        document = self.kmer_plot.document
+        if document is None:
+            self.update_kmer_detail()
+        elif not self._kmer_window_pending:
+            self._kmer_window_pending = True
+            document.add_timeout_callback(self.update_kmer_detail, KMER_RANGE_DEBOUNCE_MS)
+
+    def on_kmer_reset(self, event):
+        self._kmer_window = None
+        self.show_kmer_overview()
+
+    def update_kmer_detail(self):
+        self._kmer_window_pending = False
+        if self._kmer_window is None or self.kmer_df is None:
+            return
+        rows = self.kmer_window(*self._kmer_window)
+        if not np.array_equal(rows, self.kmer_rows):
+            self.show_kmer_rows(rows)
+
+    @property
+    def kmer_slice(self):
+        """
+        Dataset, K and bin of k-mers shown in k-mer plot.
+        """
+        return self._kmer_slice
+
+    def search(self, motif):
+        """
+        Select k-mers of k-mer plot which contain motif on either strand, only the shown K or bin is searched.
+        Matching k-mers left out of the decimated overview or window are added to it, unless there are too many
+        of them.
+        :param motif: k-mer or motif of IUPAC nucleotide codes, empty motif clears the selection
+        """
+        if self.kmer_df is None:
+            return
+        try:
+            rows = self.prepare_search(*self._kmer_slice).search(motif) if motif.strip() \
+                else np.array([], dtype=np.int64)
+        except ValueError as e:
+            self.table_summary.text = "Invalid motif: {}".format(e)
+            return
+        self.selected_rows = rows
+        self._table_order = None
+        if self._kmer_window is None:
+            shown = self.prepare_kmer_plot(*self._kmer_slice)["rows"]
+        else:
+            shown = self.kmer_window(*self._kmer_window)
+        if len(rows) <= KMER_PLOT_MAX_POINTS:
+            shown = np.union1d(shown, rows)
+        if np.array_equal(shown, self.kmer_rows):
+            self.show_selection()
+        else:
+            self.show_kmer_rows(shown)
+        self.update_table()
 
     def update_selected(self, attrname, old, new):
         """
-        Called upon selecting datapoints from marked anomaly on graph. Function updates
-        selected column in dataframe.
+        Called upon selecting datapoints from marked anomaly on graph. Selected points are mapped
+        to rows of k-mer dataframe, which are shown in data table. Selections of box and lasso tools of decimated
+        k-mer plot hold only the shown points, they are completed by on_kmer_selection, which BokehJS triggers
+        after sending the selected points.
         """
-        self.kmer_df["selected"] = False
-        selected_df = self.kmer_df.iloc[new]
-        self.data_table.source.data = selected_df
+        if self._restoring_selection:
+            return
+        self.select_rows(self.kmer_rows[new])
 
-    def download_selected(self):
+    def on_kmer_selection(self, event):
         """
-        Is triggered by pushing download button. Saves dataframe to ./labeled folder
-        under loaded file filename + "-labeled.csv" extension. Filters dataframe
-        according to "days to download" field.
+        Called once selection tool of k-mer plot finishes selecting. Box and lasso selections are resolved
+        against all k-mers of the slice, not only against the decimated ones shown in the plot, and replace
+        the previous selection. Tapped points are kept as selected by update_selected.
         """
+        if not event.final or self.kmer_df is None:
+            return
+        geometry = event.geometry
+        if geometry["type"] == "rect":
+            rows = self.rows_in_rect(geometry["x0"], geometry["x1"], geometry["y0"], geometry["y1"])
+        elif geometry["type"] == "poly":
+            rows = self.rows_in_polygon(geometry["x"], geometry["y"])
+        else:
+            return
+        if not np.array_equal(rows, self.selected_rows):
+            self.select_rows(rows)
+        self.show_selection()
 
-        download_df = self.kmer_vs_sb_df[self.kmer_vs_sb_df["selected"]]
-        if not os.path.isdir("selected"):
-            os.makedirs("selected")
+    def rows_in_rect(self, x0, x1, y0, y1):
+        """
+        Get positions of all k-mers of the slice inside of rectangle of k-mer plot.
+        """
+        x = self.kmer_df["rank"].values
+        y = self.kmer_df["strand_bias_%"].values
+        x0, x1, y0, y1 = min(x0, x1), max(x0, x1), min(y0, y1), max(y0, y1)
+        start, stop = np.searchsorted(x, x0, side="left"), np.searchsorted(x, x1, side="right")
+        return start + np.flatnonzero((y[start:stop] >= y0) & (y[start:stop] <= y1))
 
-        filename = self.filename + "-labeled.csv"
-        download_df.to_csv(
-            os.path.join("selected/", filename),
-            index=False,
-        )
-        print("Downloading dataset.")
\ No newline at end of file
+    def rows_in_polygon(self, px, py):
+        """
+        Get positions of all k-mers of the slice inside of polygon of k-mer plot.
+        """
+        if len(px) < 3:
+            return np.array([], dtype=np.int64)
+        rows = self.rows_in_rect(min(px), max(px), min(py), max(py))
+        x = self.kmer_df["rank"].values[rows]
+        y = self.kmer_df["strand_bias_%"].values[rows]
+        return rows[utils.points_in_polygon(x, y, px, py)]
+
+    def select_rows(self, rows):
+        """
+        Show given rows of k-mer dataframe in data table as the selection.
+        """
+        self.selected_rows = rows
+        self._table_order = None
+        self.update_table()
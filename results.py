@@ -0,0 +1,102 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+import payload
+import utils
+from cache import LRUCache
+
+RESULT_CACHE_MB = int(os.environ.get("SBAT_RESULT_CACHE_MB", 128))
+RESULT_WORKERS = int(os.environ.get("SBAT_RESULT_WORKERS", 4))
+
+
+def sizeof(value):
+    """
+    Function to estimate size of cached result in bytes.
+    """
+    if isinstance(value, dict):
+        return sum(sizeof(item) for item in value.values())
+    if isinstance(value, np.ndarray) and value.dtype.kind != "O":
+        return value.nbytes
+    if isinstance(value, utils.KmerIndex):
+        return value.nbytes
+    return payload.nbytes({"value": value if isinstance(value, (list, tuple, np.ndarray)) else [value]})
+
+
+def _frozen(columns):
+    # results are shared by all sessions, nothing may modify them in place
+    for values in columns.values():
+        if isinstance(values, np.ndarray):
+            values.flags.writeable = False
+    return columns
+
+
+# process-wide cache of ready-to-send column data computed from datasets, shared by all sessions
+cache = LRUCache(RESULT_CACHE_MB * 2 ** 20, sizeof=sizeof)
+metrics.register_cache("results", cache.stats)
+# threads computing results outside of IO loop, so that one session's computation does not stall the others.
+# Threads and not processes, results have to land in the cache of this process.
+executor = ThreadPoolExecutor(max_workers=RESULT_WORKERS, thread_name_prefix="results")
+
+
+def memoize(kind, data, compute, k=None, bin=None, margin=None):
+    """
+    Get result of given kind computed from dataset, entries are keyed by (kind, dataset, K, bin, margin).
+    """
+    return cache.get_or_compute((kind, data.cache_key, k, bin, margin), compute)
+
+
+def kmer_overview(data, k, bin, columns, kmers, max_points, buckets, extremes):
+    """
+    Get k-mers of given K or bin shown when whole k-mer plot is visible, decimated if there are more than
+    max_points of them.
+    :return: dict with rows (positions of k-mers in the ranked slice) and columns (data of the k-mer plot source)
+    """
+    def compute():
+        df = data.rows(k=k, bin=bin)
+        if len(df.index) <= max_points:
+            rows = np.arange(len(df.index))
+        else:
+            rows = utils.decimate(df["rank"].values, df["strand_bias_%"].values, buckets, extremes)
+        rows.flags.writeable = False
+        return dict(rows=rows, columns=_frozen(payload.columns(df.iloc[rows], columns, kmers)))
+
+    return memoize("kmer_overview", data, compute, k=k, bin=bin)
+
+
+def gc_series(data, margin):
+    """
+    Get data of GC plot sources for top and bottom margin % of k-mers.
+    :return: dict with upper and lower column data
+    """
+    def compute():
+        gc_data = data.gc_data(margin) or utils.CalculatedGCData()
+        return dict(
+            upper=dict(x=gc_data.upper_gc, y=gc_data.upper_biases, desc=gc_data.kmers),
+            lower=dict(x=gc_data.lower_gc, y=gc_data.lower_biases, desc=gc_data.kmers),
+        )
+
+    return memoize("gc", data, compute, margin=margin)
+
+
+def ci_table(data, z=1.96):
+    """
+    Get data of CI plot source, mean strand bias and its confidence interval for every bin.
+    """
+    def compute():
+        return _frozen({name: payload.narrow(values) for name, values in data.ci_data(z).items()})
+
+    return memoize("ci", data, compute, margin=z)
+
+
+def kmer_index(data, k, bin):
+    """
+    Get index of k-mers of given K or bin for motif search, see utils.KmerIndex.
+    """
+    def compute():
+        df = data.rows(k=k, bin=bin)
+        return utils.KmerIndex(df["seq"].values, df["rev_complement"].values)
+
+    return memoize("kmer_index", data, compute, k=k, bin=bin)
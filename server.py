@@ -1,303 +1,392 @@
-# import os
-# import sys
-# from threading import Thread
-#
-# from bokeh.io import curdoc
-# from bokeh.layouts import column, row
-# from bokeh.models import Dropdown, RadioButtonGroup, Slider, Div, Button, Spacer
-# from bokeh.server.server import Server
-# from bokeh.themes import Theme
-# from tornado.ioloop import IOLoop
-# from plots import Plotter, AnalysisData, BarPlotType
-#
-# menu = [("PacBio m54238_180628_014238", "pacbio_m54238_180628_014238"), ("PacBio m54238_180903_015530", "pacbio_m54238_180903_015530"),
-#         ("PacBio m54238_180901_011437", "pacbio_m54238_180901_011437"), ("PacBio m54238_180902_013549", "pacbio_m54238_180902_013549"),
-#         ("PacBio m64011_181218_235052", "pacbio_m64011_181218_235052"), ("PacBio m64011_181227_224151", "pacbio_m64011_181227_224151"),
-#         ("Illumina D1_S1_L001_R1_001", "illumina_D1_S1_L001_R1_001"),("Illumina D1_S1_L001_R1_002", "illumina_D1_S1_L001_R1_002"),
-#         ("Illumina D1_S1_L001_R1_003", "illumina_D1_S1_L001_R1_003"), ("Illumina D1_S1_L001_R1_004", "illumina_D1_S1_L001_R1_004"),
-#         ("Illumina MPHG002_S1_L001_R1_001", "illumina_MPHG002_S1_L001_R1_001"), ("Illumina MPHG002_S1_L001_R2_001", "illumina_MPHG002_S1_L001_R2_001"),
-#         ("Nanopore GM24385_3", "nanopore_GM24385_3")]
-#
-# datasets = {
-#     "pacbio_m54238_180628_014238": AnalysisData("data/df_output_m54238_180628_014238.csv"),
-#     "pacbio_m54238_180628_014238/summary": AnalysisData("data/sb_analysis_m54238_180628_014238.csv"),
-#     "pacbio_m54238_180903_015530": AnalysisData("data/df_output_m54238_180903_015530.csv"),
-#     "pacbio_m54238_180903_015530/summary": AnalysisData("data/sb_analysis_m54238_180903_015530.csv"),
-#     "pacbio_m54238_180901_011437": AnalysisData("data/df_output_m54238_180901_011437.csv"),
-#     "pacbio_m54238_180901_011437/summary": AnalysisData("data/sb_analysis_m54238_180901_011437.csv"),
-#     "pacbio_m54238_180902_013549": AnalysisData("data/df_output_m54238_180902_013549.csv"),
-#     "pacbio_m54238_180902_013549/summary": AnalysisData("data/sb_analysis_m54238_180902_013549.csv"),
-#     "pacbio_m64011_181218_235052": AnalysisData("data/df_output_m64011_181218_235052.csv"),
-#     "pacbio_m64011_181218_235052/summary": AnalysisData("data/sb_analysis_m64011_181218_235052.csv"),
-#     "pacbio_m64011_181227_224151": AnalysisData("data/df_output_m64011_181227_224151.csv"),
-#     "pacbio_m64011_181227_224151/summary": AnalysisData("data/sb_analysis_m64011_181227_224151.csv"),
-#     "illumina_D1_S1_L001_R1_001": AnalysisData("data/df_output_D1_S1_L001_R1_001.csv"),
-#     "illumina_D1_S1_L001_R1_001/summary": AnalysisData("data/sb_analysis_D1_S1_L001_R1_001.csv"),
-#     "illumina_D1_S1_L001_R1_002": AnalysisData("data/df_output_D1_S1_L001_R1_002.csv"),
-#     "illumina_D1_S1_L001_R1_002/summary": AnalysisData("data/sb_analysis_D1_S1_L001_R1_002.csv"),
-#     "illumina_D1_S1_L001_R1_003": AnalysisData("data/df_output_D1_S1_L001_R1_003.csv"),
-#     "illumina_D1_S1_L001_R1_003/summary": AnalysisData("data/sb_analysis_D1_S1_L001_R1_003.csv"),
-#     "illumina_D1_S1_L001_R1_004": AnalysisData("data/df_output_D1_S1_L001_R1_004.csv"),
-#     "illumina_D1_S1_L001_R1_004/summary": AnalysisData("data/sb_analysis_D1_S1_L001_R1_004.csv"),
-#     "illumina_MPHG002_S1_L001_R1_001": AnalysisData("data/df_output_MPHG002_S1_L001_R1_001.csv"),
-#     "illumina_MPHG002_S1_L001_R1_001/summary": AnalysisData("data/sb_analysis_MPHG002_S1_L001_R1_001.csv"),
-#     "illumina_MPHG002_S1_L001_R2_001": AnalysisData("data/df_output_MPHG002_S1_L001_R2_001.csv"),
-#     "illumina_MPHG002_S1_L001_R2_001/summary": AnalysisData("data/sb_analysis_MPHG002_S1_L001_R2_001.csv"),
-#     "nanopore_GM24385_3": AnalysisData("data/df_output_nanopore_GM24385_3.csv", nanopore=True),
-#     "nanopore_GM24385_3/summary": AnalysisData("data/sb_analysis_GM24385_3.csv", nanopore=True),
-#     "nanopore_GM24385_3/bins": AnalysisData("data/df_output_nanopore_GM24385_3_bins.csv", nanopore=True),
-#     "nanopore_GM24385_3/bin_stats": AnalysisData("data/nanopore_GM24385_3_bin_stats.csv", nanopore=True)
-#
-# }
-#
-# NAME = menu[0][0]
-# DATASET = menu[0][1]
-# K = 5
-# MARGIN = 5
-# dropdown = Dropdown(label=NAME, button_type="warning", menu=menu, align='center')
-# refresh_button = Button(label="Refresh", button_type="warning")
-# radio_button_group = RadioButtonGroup(labels=["K = 5", "K = 6", "K = 7", "K = 8", "K = 9"], active=0, button_type="warning", width=800)
-# barplot_button_group = RadioButtonGroup(labels=["Reads", "Bases"], active=0, width=200)
-#
-#
-# def modify_doc(doc):
-#     doc.clear()
-#     doc.theme = Theme(filename="./theme.yml")
-#
-#     global DATASET, K, NAME, MARGIN
-#     lower = datasets[DATASET].bin_lower
-#     upper = datasets[DATASET].bin_upper
-#     print(upper, lower)
-#
-#     bin_slider = Slider(start=lower, end=upper, value=lower, step=1, title="Bin", bar_color="orange")
-#     plotter = Plotter(datasets[DATASET + "/summary"], datasets[DATASET])
-#
-#     def on_dropdown_change(event):
-#
-#         print("dropdown_change")
-#         global DATASET, NAME
-#         DATASET = event.item
-#         NAME = list(filter(lambda e: e[1] == DATASET, menu))[0][0]
-#         dropdown.label = NAME
-#         plotter.create_lineplot(datasets[DATASET + "/summary"], new=False)
-#         plotter.create_gc_plot(datasets[DATASET], new=False)
-#         plotter.create_kmer_plot(datasets[DATASET], K, new=False)
-#         print(sys.getsizeof(plotter))
-#         if datasets[DATASET].nanopore:
-#             data = datasets[DATASET + "/bins"]
-#             bin_slider.start = data.bin_lower
-#             bin_slider.end = data.bin_upper
-#             bin_slider.value = data.bin_lower
-#
-#             plotter.create_ci_plot(data)
-#             plotter.bar_plot(datasets[DATASET + "/bin_stats"], plot_type=BarPlotType.READS)
-#             doc.remove_root(curdoc().roots[1])
-#             doc.add_root(column(
-#                 children=[plotter.ci_plot,Spacer(height=50), plotter.barplot, row(Spacer(width=20), barplot_button_group),Spacer(height=50), column(plotter.kmer_plot,
-#                           radio_button_group, bin_slider, refresh_button), plotter.data_table]))
-#         else:
-#             doc.remove_root(curdoc().roots[1])
-#             doc.add_root(column(
-#                 children=[plotter.kmer_plot, radio_button_group, plotter.data_table]))
-#
-#     def radiogroup_click(attr, old, new):
-#         switch_k()
-#         plotter.create_kmer_plot(datasets[DATASET], K, new=False)
-#
-#     def switch_k():
-#         active_radio = radio_button_group.active  ##Getting radio button value
-#         global K
-#         K = active_radio + 5
-#         if K != 5:
-#             bin_slider.disabled = True
-#         else:
-#             bin_slider.disabled = False
-#
-#     def bin_slider_change():
-#         radio_button_group.active = 0
-#         switch_k()
-#         plotter.create_kmer_plot(datasets[DATASET + "/bins"], K, bin=bin_slider.value, new=False)
-#
-#     def barplot_button_change(attr, old, new):
-#         if new == 0:
-#             plotter.bar_plot(datasets[DATASET + "/bin_stats"], BarPlotType.READS, new=False)
-#         else:
-#             plotter.bar_plot(datasets[DATASET + "/bin_stats"], BarPlotType.BASES, new=False)
-#
-#     plotter.kmer_ds.selected.on_change(
-#         "indices", plotter.update_selected
-#     )
-#
-#     refresh_button.on_click(bin_slider_change)
-#     barplot_button_group.on_change("active", barplot_button_change)
-#     dropdown.on_click(on_dropdown_change)
-#     radio_button_group.on_change("active", radiogroup_click)
-#
-#     common_plots = column(children=[Spacer(height=10),row(Spacer(width=250), dropdown), Spacer(height=10), plotter.lineplot,Spacer(height=50), plotter.gc_plot,Spacer(height=50)])
-#     kmers = column(children=[plotter.kmer_plot, radio_button_group, plotter.data_table])
-#     doc.add_root(common_plots)
-#     doc.add_root(kmers)
-#     return doc
-#
-# def deploy(port, host):
-#     server = Server({'/': modify_doc}, io_loop=IOLoop(), allow_websocket_origin=[host + ":" + str(port)])
-#     server.start()
-#     server.io_loop.start()
-#
-#
-# def bk_worker(a, b):
-#     port = os.environ.get('PORT', 8000)
-#     host = os.environ.get('HOSTNAME', "localhost")
-#     print(port, host)
-#     Thread(deploy(port, host)).start()
-#
-#
-
-
-
-
-
-
-
+import asyncio
+import errno
+import functools
+import itertools
+import logging
 import os
-import sys
+import threading
+import time
+from functools import partial
 
 from bokeh.io import curdoc
 from bokeh.layouts import column, row
-from bokeh.models import Dropdown, RadioButtonGroup, Slider, Div, Button, Spacer
+from bokeh.models import Dropdown, RadioButtonGroup, Slider, Div, Button, Spacer, Select, CustomJS
 from bokeh.server.server import Server
-from bokeh.themes import Theme
 from tornado.ioloop import IOLoop
-from plots import Plotter, AnalysisData, BarPlotType
-
-menu = [("PacBio m54238_180628_014238", "pacbio_m54238_180628_014238"), ("PacBio m54238_180903_015530", "pacbio_m54238_180903_015530"),
-        ("PacBio m54238_180901_011437", "pacbio_m54238_180901_011437"), ("PacBio m54238_180902_013549", "pacbio_m54238_180902_013549"),
-        ("PacBio m64011_181218_235052", "pacbio_m64011_181218_235052"), ("PacBio m64011_181227_224151", "pacbio_m64011_181227_224151"),
-        ("Illumina D1_S1_L001_R1_001", "illumina_D1_S1_L001_R1_001"),("Illumina D1_S1_L001_R1_002", "illumina_D1_S1_L001_R1_002"),
-        ("Illumina D1_S1_L001_R1_003", "illumina_D1_S1_L001_R1_003"), ("Illumina D1_S1_L001_R1_004", "illumina_D1_S1_L001_R1_004"),
-        ("Illumina MPHG002_S1_L001_R1_001", "illumina_MPHG002_S1_L001_R1_001"), ("Illumina MPHG002_S1_L001_R2_001", "illumina_MPHG002_S1_L001_R2_001"),
-        ("Nanopore GM24385_3", "nanopore_GM24385_3")]
-
-datasets = {
-    "pacbio_m54238_180628_014238": AnalysisData("data/df_output_m54238_180628_014238.csv"),
-    "pacbio_m54238_180628_014238/summary": AnalysisData("data/sb_analysis_m54238_180628_014238.csv"),
-    "pacbio_m54238_180903_015530": AnalysisData("data/df_output_m54238_180903_015530.csv"),
-    "pacbio_m54238_180903_015530/summary": AnalysisData("data/sb_analysis_m54238_180903_015530.csv"),
-    "pacbio_m54238_180901_011437": AnalysisData("data/df_output_m54238_180901_011437.csv"),
-    "pacbio_m54238_180901_011437/summary": AnalysisData("data/sb_analysis_m54238_180901_011437.csv"),
-    "pacbio_m54238_180902_013549": AnalysisData("data/df_output_m54238_180902_013549.csv"),
-    "pacbio_m54238_180902_013549/summary": AnalysisData("data/sb_analysis_m54238_180902_013549.csv"),
-    "pacbio_m64011_181218_235052": AnalysisData("data/df_output_m64011_181218_235052.csv"),
-    "pacbio_m64011_181218_235052/summary": AnalysisData("data/sb_analysis_m64011_181218_235052.csv"),
-    "pacbio_m64011_181227_224151": AnalysisData("data/df_output_m64011_181227_224151.csv"),
-    "pacbio_m64011_181227_224151/summary": AnalysisData("data/sb_analysis_m64011_181227_224151.csv"),
-    "illumina_D1_S1_L001_R1_001": AnalysisData("data/df_output_D1_S1_L001_R1_001.csv"),
-    "illumina_D1_S1_L001_R1_001/summary": AnalysisData("data/sb_analysis_D1_S1_L001_R1_001.csv"),
-    "illumina_D1_S1_L001_R1_002": AnalysisData("data/df_output_D1_S1_L001_R1_002.csv"),
-    "illumina_D1_S1_L001_R1_002/summary": AnalysisData("data/sb_analysis_D1_S1_L001_R1_002.csv"),
-    "illumina_D1_S1_L001_R1_003": AnalysisData("data/df_output_D1_S1_L001_R1_003.csv"),
-    "illumina_D1_S1_L001_R1_003/summary": AnalysisData("data/sb_analysis_D1_S1_L001_R1_003.csv"),
-    "illumina_D1_S1_L001_R1_004": AnalysisData("data/df_output_D1_S1_L001_R1_004.csv"),
-    "illumina_D1_S1_L001_R1_004/summary": AnalysisData("data/sb_analysis_D1_S1_L001_R1_004.csv"),
-    "illumina_MPHG002_S1_L001_R1_001": AnalysisData("data/df_output_MPHG002_S1_L001_R1_001.csv"),
-    "illumina_MPHG002_S1_L001_R1_001/summary": AnalysisData("data/sb_analysis_MPHG002_S1_L001_R1_001.csv"),
-    "illumina_MPHG002_S1_L001_R2_001": AnalysisData("data/df_output_MPHG002_S1_L001_R2_001.csv"),
-    "illumina_MPHG002_S1_L001_R2_001/summary": AnalysisData("data/sb_analysis_MPHG002_S1_L001_R2_001.csv"),
-    "nanopore_GM24385_3": AnalysisData("data/df_output_nanopore_GM24385_3.csv", nanopore=True),
-    "nanopore_GM24385_3/summary": AnalysisData("data/sb_analysis_GM24385_3.csv", nanopore=True),
-    "nanopore_GM24385_3/bins": AnalysisData("data/df_output_nanopore_GM24385_3_bins.csv", nanopore=True),
-    "nanopore_GM24385_3/bin_stats": AnalysisData("data/nanopore_GM24385_3_bin_stats.csv", nanopore=True)
-
-}
-
-NAME = menu[0][0]
-DATASET = menu[0][1]
-K = 5
-MARGIN = 5
-dropdown = Dropdown(label=NAME, button_type="warning", menu=menu, align='center')
-refresh_button = Button(label="Refresh", button_type="warning")
-radio_button_group = RadioButtonGroup(labels=["K = 5", "K = 6", "K = 7", "K = 8", "K = 9"], active=0, button_type="warning", width=800)
-barplot_button_group = RadioButtonGroup(labels=["Reads", "Bases"], active=0, width=200)
-
-
-
-curdoc().clear()
-curdoc().theme = Theme(filename="./theme.yml")
-
-
-lower = datasets[DATASET].bin_lower
-upper = datasets[DATASET].bin_upper
-print(upper, lower)
-
-bin_slider = Slider(start=lower, end=upper, value=lower, step=1, title="Bin", bar_color="orange")
-plotter = Plotter(datasets[DATASET + "/summary"], datasets[DATASET])
-
-def on_dropdown_change(event):
-
-    print("dropdown_change")
-    global DATASET, NAME
-    DATASET = event.item
-    NAME = list(filter(lambda e: e[1] == DATASET, menu))[0][0]
-    dropdown.label = NAME
-    plotter.create_lineplot(datasets[DATASET + "/summary"], new=False)
-    plotter.create_gc_plot(datasets[DATASET], new=False)
-    plotter.create_kmer_plot(datasets[DATASET], K, new=False)
-    print(sys.getsizeof(plotter))
-    if datasets[DATASET].nanopore:
-        data = datasets[DATASET + "/bins"]
-        bin_slider.start = data.bin_lower
-        bin_slider.end = data.bin_upper
-        bin_slider.value = data.bin_lower
-
-        plotter.create_ci_plot(data)
-        plotter.bar_plot(datasets[DATASET + "/bin_stats"], plot_type=BarPlotType.READS)
-        curdoc().remove_root(curdoc().roots[1])
-        curdoc().add_root(column(
-            children=[plotter.ci_plot,Spacer(height=50), plotter.barplot, row(Spacer(width=20), barplot_button_group),Spacer(height=50), column(plotter.kmer_plot,
-                      radio_button_group, bin_slider, refresh_button), plotter.data_table]))
-    else:
-        curdoc().remove_root(curdoc().roots[1])
-        curdoc().add_root(column(
-            children=[plotter.kmer_plot, radio_button_group, plotter.data_table]))
-
-def radiogroup_click(attr, old, new):
-    switch_k()
-    plotter.create_kmer_plot(datasets[DATASET], K, new=False)
-
-def switch_k():
-    active_radio = radio_button_group.active  ##Getting radio button value
-    global K
-    K = active_radio + 5
-    if K != 5:
-        bin_slider.disabled = True
-    else:
-        bin_slider.disabled = False
-
-def bin_slider_change():
-    radio_button_group.active = 0
-    switch_k()
-    plotter.create_kmer_plot(datasets[DATASET + "/bins"], K, bin=bin_slider.value, new=False)
-
-def barplot_button_change(attr, old, new):
-    if new == 0:
-        plotter.bar_plot(datasets[DATASET + "/bin_stats"], BarPlotType.READS, new=False)
-    else:
-        plotter.bar_plot(datasets[DATASET + "/bin_stats"], BarPlotType.BASES, new=False)
-
-plotter.kmer_ds.selected.on_change(
-    "indices", plotter.update_selected
-)
-
-refresh_button.on_click(bin_slider_change)
-barplot_button_group.on_change("active", barplot_button_change)
-dropdown.on_click(on_dropdown_change)
-radio_button_group.on_change("active", radiogroup_click)
-
-common_plots = column(children=[Spacer(height=10),row(Spacer(width=250), dropdown), Spacer(height=10), plotter.lineplot,Spacer(height=50), plotter.gc_plot,Spacer(height=50)])
-kmers = column(children=[plotter.kmer_plot, radio_button_group, plotter.data_table])
-curdoc().add_root(common_plots)
-curdoc().add_root(kmers)
-
-
-
-
+import doctemplate
+import export
+import metrics
+import results
+from datastore import registry, load_catalog, register_catalog, watch
+from plots import Plotter, BarPlotType
+
+BOKEH_ADDRESS = os.environ.get("BOKEH_ADDRESS", "localhost")
+BOKEH_PORT = int(os.environ.get("BOKEH_PORT", 5006))
+BOKEH_ALLOW_WEBSOCKET_ORIGIN = os.environ.get("BOKEH_ALLOW_WEBSOCKET_ORIGIN", "localhost:8000").split(",")
+# URL under which browsers reach the embedded server, differs from address behind a proxy
+BOKEH_URL = os.environ.get("BOKEH_URL", "http://{}:{}/bkapp".format(BOKEH_ADDRESS, BOKEH_PORT))
+EXPORT_OPTIONS = [(fmt + suffix, name + label) for fmt, name in (("csv", "CSV"), ("parquet", "Parquet"))
+                  if fmt in export.FORMATS for suffix, label in (("", ""), (".gz", " (gzip)"))]
+# export URL is set to tags of download button by server, browser follows it
+DOWNLOAD_JS = "if (cb_obj.tags.length) { window.location.assign(cb_obj.tags[0]); }"
+
+DATA_DIR = os.environ.get("SBAT_DATA_DIR", "data")
+DEFAULT_K = 5
+DEFAULT_MARGIN = 5
+
+logger = logging.getLogger(__name__)
+SESSIONS = metrics.gauge("sbat_active_sessions", "Open dashboard sessions.")
+SESSION_MODELS = metrics.gauge("sbat_session_document_models", "Number of models in document of every open session.")
+
+datasets = registry
+catalog = load_catalog(DATA_DIR)
+menu = register_catalog(catalog)
+# runs added to data directory are registered and grown bin files read while the server runs
+watch(DATA_DIR)
+
+
+def build_default_view():
+    """
+    Build models of the view new sessions start with, the first dataset with K=5, without callbacks.
+    :return: tuple of list of roots, Plotter and dict of name -> widget, see doctemplate.DocumentTemplate
+    """
+    name, dataset = menu[0]
+    dropdown = Dropdown(label=name, button_type="warning", menu=menu, align='center')
+    refresh_button = Button(label="Refresh", button_type="warning")
+    radio_button_group = RadioButtonGroup(labels=["K = 5", "K = 6", "K = 7", "K = 8", "K = 9"], active=0, button_type="warning", width=800)
+    barplot_button_group = RadioButtonGroup(labels=["Reads", "Bases"], active=0, width=200)
+    margin_slider = Slider(start=1, end=25, value=DEFAULT_MARGIN, step=1, title="Margin (%)", bar_color="orange", width=800)
+
+    lower, upper = (catalog["datasets"].get(dataset + "/bins") or {}).get("bins") or (0, 1)
+
+    bin_slider = Slider(start=lower, end=upper, value=lower, step=1, title="Bin", bar_color="orange")
+    loading = Div(text="Loading...", visible=False, align='center')
+    export_format = Select(title="Download selected or all k-mers", value="csv", options=EXPORT_OPTIONS, width=200)
+    download_button = Button(label="Download", button_type="warning", align='end')
+    download_button.js_on_change("tags", CustomJS(code=DOWNLOAD_JS))
+    plotter = Plotter(datasets[dataset + "/summary"], datasets[dataset], DEFAULT_MARGIN)
+
+    common_plots = column(children=[Spacer(height=10),row(Spacer(width=250), dropdown, loading), Spacer(height=10), plotter.lineplot,Spacer(height=50), plotter.gc_plot, margin_slider, Spacer(height=50)])
+    # downloads are streamed by the Flask app, there is no export endpoint under bokeh serve
+    download = row(export_format, download_button, visible=export_available())
+    kmers = column(children=[plotter.kmer_plot, radio_button_group, plotter.table, download])
+    widgets = dict(dropdown=dropdown, refresh_button=refresh_button, radio_button_group=radio_button_group,
+                   barplot_button_group=barplot_button_group, margin_slider=margin_slider, bin_slider=bin_slider,
+                   loading=loading, export_format=export_format, download_button=download_button,
+                   download=download, kmers=kmers)
+    return [common_plots, kmers], plotter, widgets
+
+
+def modify_doc(doc):
+    """
+    Build dashboard of one browser session in given document. All state of the session lives here,
+    datasets are shared through the registry. Models of the default view are copied from the document template
+    of the process, they are only built when the template is.
+    """
+    doc.clear()
+    doc.theme = doctemplate.theme("./theme.yml")
+    session_id = doc.session_context.id if doc.session_context is not None else str(id(doc))
+    SESSIONS.inc()
+
+    NAME = menu[0][0]
+    DATASET = menu[0][1]
+    K = DEFAULT_K
+    MARGIN = DEFAULT_MARGIN
+    # template is built again once the default dataset changed on disk
+    key = (DATASET, datasets[DATASET].cache_key, datasets[DATASET + "/summary"].cache_key)
+    roots, plotter, widgets = doctemplate.session_template.hydrate(key, build_default_view)
+    dropdown, refresh_button, radio_button_group, barplot_button_group, margin_slider, bin_slider, loading, \
+        export_format, download_button, download, kmers = (
+            widgets[name] for name in ("dropdown", "refresh_button", "radio_button_group", "barplot_button_group",
+                                       "margin_slider", "bin_slider", "loading", "export_format", "download_button",
+                                       "download", "kmers"))
+    dropdown.menu = menu + [run for run in datasets.runs() if run not in menu]
+    kmer_children = list(kmers.children)
+    nanopore_children = None
+    pending = {}
+    downloads = itertools.count()
+
+    def callback(name):
+        """
+        Decorator of widget callbacks, which measures them as spans and updates model count of the session.
+        """
+        def decorator(function):
+            timed = metrics.timed("callback." + name)(function)
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                try:
+                    return timed(*args, **kwargs)
+                finally:
+                    SESSION_MODELS.set(len(doc.models), session=session_id)
+            return wrapper
+        return decorator
+
+    def offload(kind, prepare, apply, *args):
+        """
+        Run prepare(*args) in worker thread and call apply on next tick of the document, with loading indicator
+        shown meanwhile. prepare computes data into shared caches and must not touch any model, apply then only
+        sends the cached data. Newer request of the same kind supersedes pending one, which is cancelled
+        or its result dropped.
+        :param kind: kind of request, e.g. "kmers"
+        :param prepare: function computing the data
+        :param apply: function updating the plots
+        """
+        previous = pending.get(kind)
+        if previous is not None:
+            previous.cancel()
+        future = results.executor.submit(metrics.timed("prepare." + kind)(prepare), *args)
+        pending[kind] = future
+        loading.visible = True
+        submitted = time.perf_counter()
+
+        @callback("apply." + kind)
+        def finish():
+            if pending.get(kind) is not future:
+                return
+            del pending[kind]
+            # time from request until its data is ready to be sent, including waiting for free worker and tick
+            metrics.observe("offload." + kind, time.perf_counter() - submitted)
+            try:
+                future.result()
+            except Exception:
+                logger.exception("failed to prepare %s", kind)
+            else:
+                apply()
+            finally:
+                # hidden only after the plots were updated, clients see it disappear together with new data
+                loading.visible = bool(pending)
+
+        future.add_done_callback(lambda _: doc.add_next_tick_callback(finish))
+
+    def prepare_dataset(dataset, k, margin):
+        data = datasets[dataset]
+        datasets[dataset + "/summary"]
+        plotter.prepare_gc_plot(data, margin)
+        plotter.prepare_kmer_plot(data, k)
+        if data.nanopore and dataset + "/bins" in datasets:
+            datasets[dataset + "/bin_stats"]
+            plotter.prepare_ci_plot(datasets[dataset + "/bins"])
+
+    def prepare_kmers(dataset, k, bin=None):
+        plotter.prepare_kmer_plot(datasets[dataset], k, bin=bin)
+
+    def prepare_gc(dataset, margin):
+        plotter.prepare_gc_plot(datasets[dataset], margin)
+
+    @callback("on_dropdown_change")
+    def on_dropdown_change(event):
+        nonlocal DATASET, NAME
+        DATASET = event.item
+        # menu of the dropdown also holds runs added by the watcher after the catalog was loaded
+        NAME = next((name for name, key in dropdown.menu if key == DATASET), DATASET)
+        dropdown.label = NAME
+        # data of all plots is replaced, requests pending for previous dataset are superseded too
+        for kind in ("kmers", "gc", "search"):
+            future = pending.pop(kind, None)
+            if future is not None:
+                future.cancel()
+        offload("dataset", prepare_dataset, show_dataset, DATASET, K, MARGIN)
+
+    def show_dataset():
+        nonlocal nanopore_children
+        plotter.create_lineplot(datasets[DATASET + "/summary"], new=False)
+        plotter.create_gc_plot(datasets[DATASET], MARGIN, new=False)
+        plotter.create_kmer_plot(datasets[DATASET], K, new=False)
+        if datasets[DATASET].nanopore and DATASET + "/bins" in datasets:
+            data = datasets[DATASET + "/bins"]
+            bin_slider.start = data.bin_lower
+            bin_slider.end = data.bin_upper
+            bin_slider.value = data.bin_lower
+
+            plotter.create_ci_plot(data, new=False)
+            plot_type = BarPlotType.READS if barplot_button_group.active == 0 else BarPlotType.BASES
+            plotter.bar_plot(datasets[DATASET + "/bin_stats"], plot_type=plot_type, new=False)
+            if nanopore_children is None:
+                nanopore_children = [plotter.ci_plot,Spacer(height=50), plotter.barplot, row(Spacer(width=20), barplot_button_group),Spacer(height=50), column(plotter.kmer_plot,
+                                     radio_button_group, bin_slider, refresh_button), plotter.table, download]
+            kmers.children = nanopore_children
+        else:
+            kmers.children = kmer_children
+
+    @callback("radiogroup_click")
+    def radiogroup_click(attr, old, new):
+        switch_k()
+        offload("kmers", prepare_kmers, lambda: plotter.create_kmer_plot(datasets[DATASET], K, new=False),
+                DATASET, K)
+
+    def switch_k():
+        active_radio = radio_button_group.active  ##Getting radio button value
+        nonlocal K
+        K = active_radio + 5
+        if K != 5:
+            bin_slider.disabled = True
+        else:
+            bin_slider.disabled = False
+
+    @callback("bin_slider_change")
+    def bin_slider_change():
+        radio_button_group.active = 0
+        switch_k()
+        bin = bin_slider.value
+        offload("kmers", prepare_kmers,
+                lambda: plotter.create_kmer_plot(datasets[DATASET + "/bins"], K, bin=bin, new=False),
+                DATASET + "/bins", K, bin)
+
+    @callback("margin_slider_change")
+    def margin_slider_change(attr, old, new):
+        nonlocal MARGIN
+        MARGIN = new
+        offload("gc", prepare_gc, lambda: plotter.create_gc_plot(datasets[DATASET], MARGIN, new=False),
+                DATASET, MARGIN)
+
+    @callback("on_search")
+    def on_search(attr, old, new):
+        # index of shown k-mers is built in worker thread, search itself takes under a millisecond
+        if not new.strip():
+            future = pending.pop("search", None)
+            if future is not None:
+                future.cancel()
+            loading.visible = bool(pending)
+            plotter.search(new)
+            return
+        offload("search", plotter.prepare_search, partial(plotter.search, new), *plotter.kmer_slice)
+
+    @callback("on_download")
+    def on_download():
+        data, k, bin = plotter.kmer_slice
+        fmt, _, compress = export_format.value.partition(".")
+        selection = None
+        if len(plotter.selected_rows):
+            selection = export.register_selection(DATASET if bin is None else DATASET + "/bins", data, k, bin,
+                                                  plotter.selected_rows)
+        # counter changes tags even when the same URL is downloaded again
+        download_button.tags = [export.url(DATASET, fmt, bool(compress), k=k, bin=bin, selection=selection),
+                                next(downloads)]
+
+    @callback("barplot_button_change")
+    def barplot_button_change(attr, old, new):
+        if new == 0:
+            plotter.bar_plot(datasets[DATASET + "/bin_stats"], BarPlotType.READS, new=False)
+        else:
+            plotter.bar_plot(datasets[DATASET + "/bin_stats"], BarPlotType.BASES, new=False)
+
+    @callback("on_dataset_change")
+    def on_dataset_change(key, data, start):
+        if data is None:
+            run = next((run for run in datasets.runs() if key in (run[1], run[1] + "/summary")), None)
+            if run is not None and run not in dropdown.menu:
+                dropdown.menu = dropdown.menu + [run]
+        elif key == DATASET + "/bins":
+            bin_slider.start = data.bin_lower
+            bin_slider.end = data.bin_upper
+            plotter.stream_ci_plot(data, start)
+        elif key == DATASET + "/bin_stats":
+            plot_type = BarPlotType.READS if barplot_button_group.active == 0 else BarPlotType.BASES
+            plotter.stream_bar_plot(data, plot_type, start)
+
+    def dataset_listener(key, data, start):
+        # called from watcher thread, document is only changed on its next tick
+        doc.add_next_tick_callback(partial(on_dataset_change, key, data, start))
+
+    datasets.subscribe(dataset_listener)
+    # module of bokeh serve script is cleaned up before session destroyed callbacks run, bind its globals now
+    unsubscribe, sessions, session_models = datasets.unsubscribe, SESSIONS, SESSION_MODELS
+
+    def on_session_destroyed(session_context):
+        unsubscribe(dataset_listener)
+        sessions.dec()
+        session_models.remove(session=session_id)
+
+    doc.on_session_destroyed(on_session_destroyed)
+
+    plotter.kmer_ds.selected.on_change(
+        "indices", callback("update_selected")(plotter.update_selected)
+    )
+
+    plotter.search_input.on_change("value", on_search)
+    refresh_button.on_click(bin_slider_change)
+    download_button.on_click(on_download)
+    barplot_button_group.on_change("active", barplot_button_change)
+    dropdown.on_click(on_dropdown_change)
+    radio_button_group.on_change("active", radiogroup_click)
+    margin_slider.on_change("value_throttled", margin_slider_change)
+    with doc.models.freeze():
+        for root in roots:
+            doc.add_root(root)
+    SESSION_MODELS.set(len(doc.models), session=session_id)
+    return doc
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def export_available():
+    """
+    Function to check whether k-mers can be downloaded, which they can when the dashboard is served from the Flask
+    app (see index.api_kmers_export). Selections are registered in the process, so the endpoint has to run in it.
+    """
+    return _server is not None
+
+
+def start_server(address=BOKEH_ADDRESS, port=BOKEH_PORT, allow_websocket_origin=BOKEH_ALLOW_WEBSOCKET_ORIGIN):
+    """
+    Start Bokeh server serving the dashboard at /bkapp on its own IO loop in a background thread.
+    Server is started only once per process, later calls return the running one. The thread is a daemon, it ends
+    with the process; hosts which shut down gracefully call stop_server first.
+    :return: Server, or None when the port is taken by other process, e.g. other worker of WSGI server,
+    whose server pages embed from BOKEH_URL
+    """
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+
+        started = threading.Event()
+        failure = []
+
+        def run():
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            global _server
+            try:
+                _server = Server({'/bkapp': modify_doc}, io_loop=IOLoop.current(), address=address, port=port,
+                                 allow_websocket_origin=allow_websocket_origin)
+                _server.start()
+            except Exception as e:
+                failure.append(e)
+                return
+            finally:
+                started.set()
+            _server.io_loop.start()
+
+        threading.Thread(target=run, name="bokeh-server", daemon=True).start()
+        started.wait()
+        if failure:
+            if isinstance(failure[0], OSError) and failure[0].errno == errno.EADDRINUSE:
+                logger.info("port %s is in use, dashboard is embedded from %s", port, BOKEH_URL)
+                return None
+            raise failure[0]
+        return _server
+
+
+def stop_server():
+    """
+    Stop embedded Bokeh server and its IO loop.
+    """
+    global _server
+    with _server_lock:
+        server, _server = _server, None
+    if server is None:
+        return
+
+    def stop():
+        server.stop()
+        server.io_loop.stop()
+
+    server.io_loop.add_callback(stop)
+
+
+if __name__.startswith("bokeh_app"):
+    # run by "bokeh serve server.py", the script is executed for every session
+    modify_doc(curdoc())
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import uuid
+
+import bokeh
+from bokeh.embed import json_item
+from bokeh.layouts import column
+
+import doctemplate
+from datastore import load_catalog, register_catalog, registry
+from plots import BarPlotType, PIPELINE_VERSION, Plotter
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.environ.get("SBAT_SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_VERSION = 1
+_manifest = (None, {})
+
+
+def manifest_path(output=SNAPSHOT_DIR):
+    return os.path.join(output, "manifest.json")
+
+
+def load_manifest(output=SNAPSHOT_DIR):
+    """
+    Function to get manifest of built snapshots, it is read again only when it was rebuilt.
+    :return: dict of run key -> dict with name, version and K values of the run
+    """
+    global _manifest
+    try:
+        mtime = os.stat(manifest_path(output)).st_mtime_ns
+    except OSError:
+        return {}
+    if _manifest[0] != (output, mtime):
+        with open(manifest_path(output)) as f:
+            _manifest = ((output, mtime), json.load(f))
+    return _manifest[1]
+
+
+def _write(path, item):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+    with open(tmp, "w") as f:
+        json.dump(item, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def build(directory, output=SNAPSHOT_DIR):
+    """
+    Render default views of every run of data directory into json_item snapshots, which are embedded without
+    Bokeh server. Every run has plots.json with line, GC and for nanopore runs also CI and bar plots, and
+    kmers_<K>.json with k-mer plot of every K. Runs whose datasets did not change since the last build are skipped.
+    :param directory: data directory
+    :param output: directory the snapshots are written to
+    """
+    # k-mer plot has server side callbacks for zooming, snapshots show the overview without them
+    logging.getLogger("bokeh.embed.util").setLevel(logging.ERROR)
+    catalog = load_catalog(directory)
+    menu = register_catalog(catalog)
+    theme = doctemplate.theme("./theme.yml")
+    try:
+        manifest = dict(load_manifest(output))
+    except (OSError, ValueError):
+        manifest = {}
+
+    for name, run in menu:
+        keys = sorted(key for key in catalog["datasets"] if key.split("/")[0] == run)
+        version = hashlib.sha1(repr((
+            SNAPSHOT_VERSION, PIPELINE_VERSION, bokeh.__version__, [catalog["datasets"][key]["sha1"] for key in keys],
+        )).encode()).hexdigest()[:16]
+        if manifest.get(run, {}).get("version") == version:
+            continue
+
+        try:
+            data = registry[run]
+            plotter = Plotter(registry[run + "/summary"], data)
+            plots = [plotter.lineplot, plotter.gc_plot]
+            if data.nanopore and run + "/bins" in registry and run + "/bin_stats" in registry:
+                plots.append(plotter.create_ci_plot(registry[run + "/bins"], new=False))
+                plots.append(plotter.bar_plot(registry[run + "/bin_stats"], BarPlotType.READS, new=False))
+            _write(os.path.join(output, run, "plots.json"), json_item(column(plots), theme=theme))
+
+            k_values = catalog["datasets"][run]["k"] or []
+            for k in k_values:
+                plotter.create_kmer_plot(data, k, new=False)
+                _write(os.path.join(output, run, "kmers_{}.json".format(k)), json_item(plotter.kmer_plot, theme=theme))
+        except Exception:
+            # previous snapshot of the run, if any, stays in the manifest
+            logger.exception("failed to build snapshot of %s", run)
+            continue
+        manifest[run] = dict(name=name, version=version, k=k_values)
+        logger.info("snapshot of %s built", run)
+
+    manifest = {run: manifest[run] for _, run in menu if run in manifest}
+    _write(manifest_path(output), manifest)
+    return manifest
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    build(sys.argv[1] if len(sys.argv) > 1 else "data", sys.argv[2] if len(sys.argv) > 2 else SNAPSHOT_DIR)
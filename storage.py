@@ -0,0 +1,268 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+from pandas.core.internals import BlockManager
+from pandas.core.internals.api import make_block
+
+CACHE_VERSION = 2
+CACHE_DIR = os.environ.get("SBAT_CACHE_DIR")
+
+
+def file_hash(path, chunk_size=2 ** 20):
+    """
+    Function to compute SHA-1 hash of file content.
+    :param path: path to file
+    :param chunk_size: number of bytes read at once
+    :return: hex digest of file content
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_dir(path):
+    """
+    Function to get directory holding columnar cache of given CSV. Cache is stored next to the CSV in
+    .cache folder, unless SBAT_CACHE_DIR environment variable is set.
+    """
+    root = CACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(path)), ".cache")
+    return os.path.join(root, os.path.basename(path))
+
+
+def read_frame(path, prepare=None, pipeline=0, return_size=False, tail=False):
+    """
+    Function to read CSV file through its columnar cache. Cache is built on first read and reused
+    as long as modification time and size of the CSV match, or its content hash does. Numeric columns
+    of the returned frame are read-only memory maps of the cache files, so processes reading the same
+    file share its pages.
+    :param path: path to CSV file
+    :param prepare: function applied to freshly parsed frame before it is cached
+    :param pipeline: version of prepare function, cache built by other version is rebuilt
+    :param return_size: whether to return also number of bytes of the file the frame holds, rows appended
+    after them are read by read_tail
+    :param tail: whether rows are appended to the file while it is read, line which is still being written
+    at the end of such file is left out
+    :return: DataFrame with content of the CSV, or tuple of the DataFrame and the size
+    """
+    try:
+        return _read_frame(path, prepare, pipeline, return_size, tail)
+    except (OSError, ValueError):
+        # cache was replaced by another process while it was being loaded, its new version is read
+        return _read_frame(path, prepare, pipeline, return_size, tail)
+
+
+def _read_frame(path, prepare, pipeline, return_size, tail):
+    stat = os.stat(path)
+    meta = _read_meta(path)
+    if meta is not None and meta.get("pipeline") != pipeline:
+        meta = None
+    if meta is not None and not _is_fresh(meta, stat):
+        if meta["source_size"] == stat.st_size and meta["source_sha1"] == file_hash(path):
+            # file was only touched, keep the cache
+            meta["source_mtime_ns"] = stat.st_mtime_ns
+            _write_meta(path, meta)
+        else:
+            meta = None
+
+    if meta is None:
+        df, size = _read_csv(path, stat.st_size, tail)
+        if prepare is not None:
+            df = prepare(df)
+        try:
+            meta = _write_cache(path, df, stat, pipeline, size)
+        except (OSError, ValueError):
+            # read-only deployments and frames which cannot be stored columnar use the CSV directly
+            return (df, size) if return_size else df
+    df = _load_cache(path, meta)
+    return (df, meta.get("parsed_size", meta["source_size"])) if return_size else df
+
+
+def _read_csv(path, size, tail=False):
+    # only complete lines of tailed files are parsed, line which is still being written is read later by read_tail
+    with open(path, "rb") as f:
+        end = size
+        while tail and end > 0:
+            start = max(end - 2 ** 16, 0)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        if end == 0:
+            return pd.DataFrame(), 0
+        f.seek(0)
+        return pd.read_csv(io.BufferedReader(_Head(f, end))), end
+
+
+class _Head(io.RawIOBase):
+    """
+    Raw stream of first size bytes of binary file.
+    """
+
+    def __init__(self, f, size):
+        self.f = f
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.f.read(min(len(buffer), self.remaining))
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+def read_tail(path, offset):
+    """
+    Function to read rows appended to CSV file after given byte offset. Only complete lines are parsed,
+    partially written last line is left for the next read.
+    :param path: path to CSV file
+    :param offset: position in file up to which it was already read
+    :return: tuple of DataFrame with appended rows and position up to which file is read now
+    """
+    names = pd.read_csv(path, nrows=0).columns
+    with open(path, "rb") as f:
+        if offset > 0:
+            f.seek(offset - 1)
+            if f.read(1) != b"\n":
+                # offset is inside of a line, which was parsed already
+                f.readline()
+        start = f.tell()
+        chunk = f.read()
+    end = chunk.rfind(b"\n") + 1
+    if end == 0:
+        return pd.DataFrame(columns=names), start
+    return pd.read_csv(io.BytesIO(chunk[:end]), header=None, names=names), start + end
+
+
+def _is_fresh(meta, stat):
+    return meta["version"] == CACHE_VERSION and meta["source_size"] == stat.st_size \
+        and meta["source_mtime_ns"] == stat.st_mtime_ns
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(cache_dir(path), "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != CACHE_VERSION:
+        return None
+    return meta
+
+
+def _write_meta(path, meta):
+    target = os.path.join(cache_dir(path), "meta.json")
+    tmp = "{}.{}.tmp".format(target, uuid.uuid4().hex)
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, target)
+
+
+def _write_cache(path, df, stat, pipeline, parsed_size):
+    """
+    Store frame as one 2D .npy file per numeric dtype (columns in rows, the layout pandas uses
+    for its blocks) and one fixed-width bytes .npy file per string column. Version replaced by this one
+    is kept, other processes may be loading it.
+    """
+    previous = _read_meta(path)
+    sha1 = file_hash(path)
+    directory = cache_dir(path)
+    version_dir = os.path.join(directory, sha1)
+    os.makedirs(version_dir, exist_ok=True)
+
+    blocks, strings = [], []
+    for dtype in sorted({str(dtype) for dtype in df.dtypes}):
+        columns = [column for column in df.columns if str(df[column].dtype) == dtype]
+        if dtype == "object":
+            for column in columns:
+                values = df[column]
+                if values.isna().any():
+                    raise ValueError("column {} contains missing strings".format(column))
+                filename = "str_{}.npy".format(len(strings))
+                _save(os.path.join(version_dir, filename), values.str.encode("utf-8").values.astype(bytes))
+                strings.append({"file": filename, "column": column})
+        else:
+            filename = "block_{}.npy".format(dtype)
+            _save(os.path.join(version_dir, filename), np.ascontiguousarray(df[columns].values.T))
+            blocks.append({"file": filename, "dtype": dtype, "columns": columns})
+
+    meta = {
+        "version": CACHE_VERSION,
+        "pipeline": pipeline,
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "source_sha1": sha1,
+        "parsed_size": parsed_size,
+        "rows": len(df.index),
+        "columns": list(df.columns),
+        "blocks": blocks,
+        "strings": strings,
+    }
+    _write_meta(path, meta)
+
+    # older versions may still be mapped by other processes, unlinking them is safe
+    keep = {sha1, previous["source_sha1"] if previous is not None else None}
+    for name in os.listdir(directory):
+        if name not in keep and os.path.isdir(os.path.join(directory, name)):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return meta
+
+
+def _save(target, values):
+    # replace instead of overwriting, files may be memory mapped by other processes
+    tmp = "{}.{}.tmp".format(target, uuid.uuid4().hex)
+    with open(tmp, "wb") as f:
+        np.save(f, values)
+    os.replace(tmp, target)
+
+
+def _load_cache(path, meta):
+    # blocks are placed at positions of their columns, frame keeps column order of the CSV without copying them
+    version_dir = os.path.join(cache_dir(path), meta["source_sha1"])
+    positions = {column: i for i, column in enumerate(meta["columns"])}
+    blocks = []
+    for block in meta["blocks"]:
+        values = np.load(os.path.join(version_dir, block["file"]), mmap_mode="r")
+        blocks.append(make_block(values, placement=[positions[column] for column in block["columns"]], ndim=2))
+    if meta["strings"]:
+        values = np.empty((len(meta["strings"]), meta["rows"]), dtype=object)
+        for i, string in enumerate(meta["strings"]):
+            values[i] = _decode(np.load(os.path.join(version_dir, string["file"])))
+        blocks.append(make_block(values, placement=[positions[string["column"]] for string in meta["strings"]],
+                                 ndim=2))
+    return pd.DataFrame(BlockManager(blocks, [pd.Index(meta["columns"]), pd.RangeIndex(meta["rows"])]))
+
+
+def is_mapped(values):
+    """
+    Function to check whether array is (a view of) memory mapped cache file.
+    """
+    while values is not None:
+        if isinstance(values, np.memmap):
+            return True
+        values = values.base
+    return False
+
+
+def mapped_nbytes(df):
+    """
+    Function to get number of bytes of frame columns which are memory mapped and shared with other processes.
+    """
+    return int(sum(df[column].values.nbytes for column in df.columns if is_mapped(df[column].values)))
+
+
+def _decode(values):
+    decoded = np.empty(len(values), dtype=object)
+    decoded[:] = [value.decode("utf-8") for value in values.tolist()]
+    return decoded
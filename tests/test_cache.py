@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+import results
+from cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.keys() == ["a", "c"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_peek_does_not_mark_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.peek("a") == 1
+    cache.put("c", 3)
+    assert "a" not in cache
+    assert cache.stats()["hits"] == 0
+
+
+def test_budget_by_size():
+    cache = LRUCache(10, sizeof=len)
+    cache.put("a", "xxxx")
+    cache.put("b", "xxxx")
+    cache.put("c", "xxxx")
+    assert cache.keys() == ["b", "c"]
+    assert cache.size == 8
+
+
+def test_keeps_value_over_budget():
+    cache = LRUCache(10, sizeof=len)
+    cache.put("a", "x")
+    cache.put("b", "x" * 20)
+    assert cache.keys() == ["b"]
+    assert cache.size == 20
+
+
+def test_put_replaces_size():
+    cache = LRUCache(10, sizeof=len)
+    cache.put("a", "xxxx")
+    cache.put("a", "xx")
+    assert cache.size == 2
+    assert cache.pop("a") == "xx"
+    assert cache.size == 0
+    assert cache.pop("a", "missing") == "missing"
+
+
+def test_resize_measures_grown_value():
+    cache = LRUCache(10, sizeof=len)
+    cache.put("a", ["x"] * 4)
+    value = cache.put("b", ["x"] * 4)
+    value.extend(["x"] * 4)
+    cache.resize("b")
+    assert cache.keys() == ["b"]
+    assert cache.size == 8
+    assert cache.stats()["evictions"] == 1
+
+
+def test_get_or_compute_counts():
+    cache = LRUCache(10)
+    calls = []
+    compute = lambda: calls.append(1) or "value"
+    assert cache.get_or_compute("a", compute) == "value"
+    assert cache.get_or_compute("a", compute) == "value"
+    assert len(calls) == 1
+    assert cache.stats() == dict(entries=1, size=1, max_size=10, hits=1, misses=1, evictions=0)
+
+
+class Data:
+    def __init__(self, cache_key):
+        self.cache_key = cache_key
+
+
+@pytest.fixture
+def result_cache():
+    results.cache.clear()
+    yield results.cache
+    results.cache.clear()
+
+
+def test_memoize_by_dataset_version(result_cache):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return np.arange(len(calls))
+
+    data = Data(("run.csv", 1, 100))
+    first = results.memoize("kind", data, compute, k=5)
+    assert results.memoize("kind", data, compute, k=5) is first
+    assert len(calls) == 1
+    results.memoize("kind", data, compute, k=6)
+    results.memoize("kind", Data(("run.csv", 2, 200)), compute, k=5)
+    assert len(calls) == 3
+
+
+def test_result_sizes():
+    assert results.sizeof(np.zeros(10, dtype=np.float64)) == 80
+    assert results.sizeof(dict(a=np.zeros(4, dtype=np.int32), b=np.zeros(2, dtype=np.uint8))) == 18
+
+
+def test_results_are_read_only():
+    columns = results._frozen(dict(a=np.arange(3)))
+    with pytest.raises(ValueError):
+        columns["a"][0] = 1
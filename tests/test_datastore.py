@@ -0,0 +1,37 @@
+import datastore
+from datastore import DatasetRegistry
+
+
+def test_description_is_kept_until_rows_are_appended(tmp_path, monkeypatch):
+    path = tmp_path / "nanopore_run_bin_stats.csv"
+    path.write_text("bin,bias_mean\n0,1.5\n1,2.5\n")
+    calls = []
+    describe_frame = datastore.describe_frame
+    monkeypatch.setattr(datastore, "describe_frame", lambda df: calls.append(len(df.index)) or describe_frame(df))
+
+    registry = DatasetRegistry(max_bytes=2 ** 20)
+    registry.register("nanopore_run/bin_stats", str(path), appendable=True)
+    assert registry.describe("nanopore_run/bin_stats", str(path)) == dict(rows=2, k=None, bins=[0, 1])
+    assert registry.describe("nanopore_run/bin_stats", str(path))["rows"] == 2
+    assert calls == [2]
+
+    with open(path, "a") as f:
+        f.write("2,3.5\n")
+    assert registry.describe("nanopore_run/bin_stats", str(path)) == dict(rows=3, k=None, bins=[0, 2])
+    assert calls == [2, 3]
+    assert registry.describe("nanopore_run/other", str(path)) is None
+
+
+def test_derived_structures_count_towards_budget(tmp_path):
+    path = tmp_path / "df_output_run.csv"
+    path.write_text("seq,seq_count,rev_complement,rev_complement_count,k,strand_bias_%,GC_%\n"
+                    + "".join("AAAAA,{},TTTTT,1,5,{},40.0\n".format(i + 1, i) for i in range(100)))
+    registry = DatasetRegistry(max_bytes=2 ** 20)
+    registry.register("run", str(path))
+    data = registry.get("run")
+    assert registry.stats()["misses"] == 1
+    loaded = registry.nbytes
+    data.gc_data(5)
+    assert registry.get("run") is data
+    assert registry.nbytes == loaded + data._gc_sweep.nbytes > loaded
+    assert registry.stats()["hits"] == 1 and registry.stats()["misses"] == 1
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+import payload
+from plots import encode_kmer_table
+
+
+def random_kmers(k, count, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.array(["".join(kmer) for kmer in rng.choice(list("ACGT"), (count, k))], dtype=object)
+
+
+def test_round_trip():
+    for k in range(1, 16):
+        kmers = random_kmers(k, 100, seed=k)
+        codes = payload.encode_kmers(kmers)
+        assert codes.dtype == np.uint32
+        assert list(payload.decode_kmers(codes)) == list(kmers)
+
+
+def test_round_trip_of_mixed_lengths():
+    kmers = np.array(["A", "TTTTT", "ACG", "GATTACA", "AAAA"], dtype=object)
+    assert list(payload.decode_kmers(payload.encode_kmers(kmers))) == list(kmers)
+
+
+def test_codes_sort_like_kmers():
+    kmers = random_kmers(7, 1000)
+    codes = payload.encode_kmers(kmers)
+    assert list(kmers[np.argsort(codes, kind="stable")]) == sorted(kmers)
+
+
+def test_unencodable_kmers_are_kept():
+    for kmers in (["ACGT", "ACNT"], ["acgt", "ACGT"], ["A" * 16], ["ACGT", "AC T"]):
+        kmers = np.array(kmers, dtype=object)
+        assert payload.encode_kmers(kmers) is kmers
+
+
+def test_codes_are_passed_through():
+    codes = np.array([4, 5, 27], dtype=np.uint32)
+    assert payload.encode_kmers(codes) is codes
+    assert len(payload.encode_kmers(np.array([], dtype=object))) == 0
+
+
+def test_table_with_unencodable_kmers_keeps_strings():
+    df = pd.DataFrame(dict(seq=["ACGT", "ACNT"], seq_count=[1.0, 2.0], rev_complement=["ACGT", "ANGT"],
+                           rev_complement_count=[3.0, 4.0]))
+    encoded = encode_kmer_table(df)
+    assert list(encoded["seq"]) == ["ACGT", "ACNT"]
+    assert "canonical" not in encoded.columns
+    assert encoded["seq_count"].dtype == np.int64
+
+
+def test_table_canonical_is_smaller_code():
+    df = pd.DataFrame(dict(seq=["ACG", "TTT"], seq_count=[1.0, 2.0], rev_complement=["CGT", "AAA"],
+                           rev_complement_count=[3.0, 4.0]))
+    encoded = encode_kmer_table(df)
+    assert list(payload.decode_kmers(encoded["canonical"].values)) == ["ACG", "AAA"]
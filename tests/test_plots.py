@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+from bokeh.events import SelectionGeometry
+
+import payload
+from benchmarks import generate
+from plots import AnalysisData, Plotter
+
+
+def kmer_table(ks, partition="k", seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for value, k in ks:
+        for _ in range(20):
+            seq = "".join(rng.choice(list("ACGT"), k))
+            rev_complement = seq[::-1].translate(str.maketrans("ACGT", "TGCA"))
+            rows.append(dict(seq=seq, seq_count=float(rng.integers(1, 1000)), rev_complement=rev_complement,
+                             rev_complement_count=float(rng.integers(1, 1000)), **{partition: value}))
+    df = pd.DataFrame(rows).sample(frac=1, random_state=seed)
+    df["strand_bias_%"] = rng.uniform(0, 50, len(df.index))
+    df["GC_%"] = rng.uniform(0, 100, len(df.index))
+    return df
+
+
+@pytest.fixture
+def kmers(tmp_path):
+    path = tmp_path / "df_output_run.csv"
+    source = kmer_table([(k, k) for k in (7, 5, 6)])
+    source.to_csv(path, index=False)
+    return source, AnalysisData(str(path))
+
+
+def test_partitions_of_k(kmers):
+    source, data = kmers
+    assert data.partition_column == "k"
+    assert list(data.partitions) == [5, 6, 7]
+    for k in (5, 6, 7):
+        rows = data.rows(k=k)
+        assert (rows["k"] == k).all()
+        assert len(rows.index) == (source["k"] == k).sum()
+        assert sorted(payload.decode_kmers(rows["seq"].values)) == sorted(source.loc[source["k"] == k, "seq"])
+
+
+def test_missing_partition_is_empty(kmers):
+    assert kmers[1].rows(k=9).empty
+
+
+def test_rows_ranked_by_more_frequent_count(kmers):
+    rows = kmers[1].rows(k=6)
+    counts = np.maximum(rows["seq_count"].values, rows["rev_complement_count"].values)
+    assert (np.diff(counts) <= 0).all()
+    assert list(rows["rank"]) == list(range(len(rows.index)))
+
+
+def test_partitions_of_bins(tmp_path):
+    path = tmp_path / "df_output_nanopore_run_bins.csv"
+    kmer_table([(2, 5), (0, 5), (1, 5)], partition="bin").to_csv(path, index=False)
+    data = AnalysisData(str(path), nanopore=True)
+    assert data.partition_column == "bin"
+    assert (data.bin_lower, data.bin_upper) == (0, 2)
+    assert (data.rows(bin=1)["bin"] == 1).all()
+    assert len(data.rows(bin=1).index) == 20
+
+
+@pytest.fixture(scope="module")
+def plotter(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("data")
+    generate.generate(str(directory), kmers=(5, 7), bins=())
+    run = "synthetic_S1_L001_R1_001"
+    data = AnalysisData(str(directory / "df_output_{}.csv".format(run)))
+    plotter = Plotter(AnalysisData(str(directory / "sb_analysis_{}.csv".format(run))), data)
+    plotter.create_kmer_plot(data, 7, new=False)
+    # the whole slice does not fit to the plot
+    assert len(plotter.kmer_rows) < len(plotter.kmer_df.index)
+    return plotter
+
+
+def test_selected_points_are_selected(plotter):
+    plotter.update_selected("indices", [], [0, 5, 7])
+    assert np.array_equal(plotter.selected_rows, plotter.kmer_rows[[0, 5, 7]])
+    assert len(plotter.data_table.source.data["seq"]) == 3
+    plotter.update_selected("indices", [0, 5, 7], [])
+    assert plotter.table_summary.text == "No k-mers selected"
+
+
+def test_box_selection_covers_all_kmers(plotter):
+    df = plotter.kmer_df
+    x, y = df["rank"].values, df["strand_bias_%"].values
+    x0, x1, y0, y1 = 1000, 4000, 0, 10
+    inside = (x[plotter.kmer_rows] >= x0) & (x[plotter.kmer_rows] <= x1) \
+        & (y[plotter.kmer_rows] >= y0) & (y[plotter.kmer_rows] <= y1)
+    # BokehJS sends the selected points first and the geometry afterwards
+    plotter.update_selected("indices", [], list(np.flatnonzero(inside)))
+    assert np.array_equal(plotter.selected_rows, plotter.kmer_rows[inside])
+    plotter.kmer_plot._trigger_event(SelectionGeometry(
+        plotter.kmer_plot, geometry=dict(type="rect", x0=x0, x1=x1, y0=y0, y1=y1), final=True))
+    expected = np.flatnonzero((x >= x0) & (x <= x1) & (y >= y0) & (y <= y1))
+    assert len(expected) > inside.sum()
+    assert np.array_equal(plotter.selected_rows, expected)
+    assert plotter.table_summary.text.startswith("Selected k-mers: {:,} ".format(len(expected)))
+    assert list(plotter.kmer_ds.selected.indices) == list(np.flatnonzero(inside))
+
+
+def test_lasso_selection_covers_all_kmers(plotter):
+    df = plotter.kmer_df
+    x, y = df["rank"].values, df["strand_bias_%"].values
+    plotter.kmer_plot._trigger_event(SelectionGeometry(
+        plotter.kmer_plot, geometry=dict(type="poly", x=[0.5, 8000.5, 8000.5], y=[-1, -1, 40]), final=True))
+    expected = np.flatnonzero((x < 8000.5) & (y < -1 + (x - 0.5) * 41 / 8000))
+    assert np.array_equal(plotter.selected_rows, expected)
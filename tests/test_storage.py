@@ -0,0 +1,117 @@
+import os
+
+import pandas as pd
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def csv(tmp_path):
+    path = tmp_path / "df_output_run.csv"
+    path.write_text("seq,seq_count\nAAA,1\nCCC,2\n")
+    return str(path)
+
+
+def reader():
+    calls = []
+
+    def prepare(df):
+        calls.append(len(df.index))
+        return df
+    return prepare, calls
+
+
+def touch(path, content=None):
+    stat = os.stat(path)
+    if content is not None:
+        with open(path, "w") as f:
+            f.write(content)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_cache_is_built_once_and_mapped(csv):
+    prepare, calls = reader()
+    first = storage.read_frame(csv, prepare=prepare)
+    second = storage.read_frame(csv, prepare=prepare)
+    assert calls == [2]
+    pd.testing.assert_frame_equal(first, second)
+    assert storage.is_mapped(second["seq_count"].values)
+    assert list(second["seq"]) == ["AAA", "CCC"]
+
+
+def test_changed_file_is_read_again(csv):
+    prepare, calls = reader()
+    storage.read_frame(csv, prepare=prepare)
+    touch(csv, "seq,seq_count\nAAA,1\nCCC,2\nGGG,3\n")
+    df = storage.read_frame(csv, prepare=prepare)
+    assert calls == [2, 3]
+    assert list(df["seq_count"]) == [1, 2, 3]
+
+
+def test_same_size_other_content_is_read_again(csv):
+    prepare, calls = reader()
+    storage.read_frame(csv, prepare=prepare)
+    touch(csv, "seq,seq_count\nAAA,1\nCCC,5\n")
+    assert list(storage.read_frame(csv, prepare=prepare)["seq_count"]) == [1, 5]
+    assert calls == [2, 2]
+
+
+def test_touched_file_keeps_cache(csv):
+    prepare, calls = reader()
+    storage.read_frame(csv, prepare=prepare)
+    touch(csv)
+    storage.read_frame(csv, prepare=prepare)
+    assert calls == [2]
+    assert storage._read_meta(csv)["source_mtime_ns"] == os.stat(csv).st_mtime_ns
+
+
+def test_other_pipeline_rebuilds_cache(csv):
+    prepare, calls = reader()
+    storage.read_frame(csv, prepare=prepare, pipeline=1)
+    storage.read_frame(csv, prepare=prepare, pipeline=2)
+    storage.read_frame(csv, prepare=prepare, pipeline=2)
+    assert calls == [2, 2]
+
+
+def test_last_row_without_newline(csv):
+    with open(csv, "a") as f:
+        f.write("GGG,3")
+    df, size = storage.read_frame(csv, return_size=True)
+    assert list(df["seq"]) == ["AAA", "CCC", "GGG"]
+    assert size == os.path.getsize(csv)
+
+
+def test_tailed_file_leaves_out_partial_line(csv):
+    with open(csv, "a") as f:
+        f.write("GGG,3")
+    df, size = storage.read_frame(csv, return_size=True, tail=True)
+    assert list(df["seq"]) == ["AAA", "CCC"]
+    with open(csv, "a") as f:
+        f.write("\nTTT,4\n")
+    rows, offset = storage.read_tail(csv, size)
+    assert list(rows["seq"]) == ["GGG", "TTT"]
+    assert offset == os.path.getsize(csv)
+
+
+def test_cached_frame_keeps_column_order(tmp_path):
+    path = tmp_path / "df_output_run.csv"
+    path.write_text("Unnamed: 0,seq,bias,seq_count,ratio\n0,AAA,0.5,1,1.5\n1,CCC,0.25,2,2.5\n")
+    first = storage.read_frame(str(path))
+    second = storage.read_frame(str(path))
+    assert list(second.columns) == ["Unnamed: 0", "seq", "bias", "seq_count", "ratio"]
+    pd.testing.assert_frame_equal(first, second)
+    assert storage.is_mapped(second["ratio"].values)
+
+
+def test_replaced_version_is_kept_for_other_readers(csv):
+    storage.read_frame(csv)
+    first = storage._read_meta(csv)["source_sha1"]
+    touch(csv, "seq,seq_count\nAAA,1\nCCC,2\nGGG,3\n")
+    storage.read_frame(csv)
+    second = storage._read_meta(csv)["source_sha1"]
+    touch(csv, "seq,seq_count\nAAA,1\n")
+    storage.read_frame(csv)
+    versions = {name for name in os.listdir(storage.cache_dir(csv)) if name != "meta.json"}
+    assert versions == {second, storage._read_meta(csv)["source_sha1"]}
+    assert first not in versions
@@ -0,0 +1,75 @@
+import re
+
+import numpy as np
+import pytest
+
+import payload
+import utils
+
+
+def test_decimate_keeps_small_input():
+    x = np.arange(100)
+    assert np.array_equal(utils.decimate(x, np.sin(x), buckets=50, extremes=10), x)
+
+
+def test_decimate_keeps_outline_and_outliers():
+    rng = np.random.default_rng(0)
+    x = np.sort(rng.uniform(0, 1000, 100000))
+    y = rng.normal(0, 10, len(x))
+    buckets, extremes = 100, 50
+    kept = utils.decimate(x, y, buckets, extremes)
+    assert len(kept) <= 2 * buckets + extremes
+    assert np.array_equal(kept, np.unique(kept))
+
+    edges = np.linspace(x.min(), x.max(), buckets + 1)
+    bucket = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, buckets - 1)
+    for b in range(buckets):
+        inside = np.flatnonzero(bucket == b)
+        assert inside[np.argmin(y[inside])] in kept
+        assert inside[np.argmax(y[inside])] in kept
+    assert set(np.argsort(-np.abs(y))[:extremes]) <= set(kept)
+
+
+def test_points_in_polygon():
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(-1, 2, 10000), rng.uniform(-1, 2, 10000)
+    square = utils.points_in_polygon(x, y, [0, 1, 1, 0], [0, 0, 1, 1])
+    assert np.array_equal(square, (x > 0) & (x < 1) & (y > 0) & (y < 1))
+    triangle = utils.points_in_polygon(x, y, [0, 1, 1], [0, 0, 1])
+    assert np.array_equal(triangle, (x < 1) & (y > 0) & (y < x))
+
+
+def brute_force(seq, rev_complement, motif):
+    pattern = re.compile("".join("[{}]".format(utils.IUPAC_NUCLEOTIDES[c]) for c in motif.upper().replace("U", "T")))
+    return np.array([i for i, (a, b) in enumerate(zip(seq, rev_complement)) if pattern.search(a) or pattern.search(b)],
+                    dtype=np.int64)
+
+
+def kmer_index(k, count, seed=0):
+    rng = np.random.default_rng(seed)
+    seq = np.array(["".join(kmer) for kmer in rng.choice(list("ACGT"), (count, k))], dtype=object)
+    rev_complement = np.array([kmer[::-1].translate(str.maketrans("ACGT", "TGCA")) for kmer in seq], dtype=object)
+    return seq, rev_complement, utils.KmerIndex(payload.encode_kmers(seq), payload.encode_kmers(rev_complement))
+
+
+@pytest.mark.parametrize("k,motif", [
+    (5, "ACG"), (5, "ACGTA"), (5, "A"), (7, "RCGYN"), (7, "NNNNNNA"), (9, "NNNNNNNAC"), (9, "WSKM"), (6, "acgu"),
+])
+def test_kmer_index_matches_brute_force(k, motif):
+    seq, rev_complement, index = kmer_index(k, 2000, seed=k)
+    assert np.array_equal(index.search(motif), brute_force(seq, rev_complement, motif))
+
+
+def test_kmer_index_rejects_invalid_motifs():
+    _, _, index = kmer_index(5, 10)
+    assert len(index.search("  ")) == 0
+    with pytest.raises(ValueError):
+        index.search("ACGTAC")
+    with pytest.raises(ValueError):
+        index.search("ACX")
+
+
+def test_kmer_index_requires_codes_of_one_length():
+    with pytest.raises(ValueError):
+        utils.KmerIndex(payload.encode_kmers(np.array(["ACG", "ACGT"], dtype=object)),
+                        payload.encode_kmers(np.array(["CGT", "ACGT"], dtype=object)))
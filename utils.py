@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 
@@ -25,30 +26,212 @@ class CalculatedGCData:
         self.lower_biases = []
         self.kmers = []
 
-def calculate_gc_plot_data(df_all, margin):
+
+class GCSweep:
+    """
+    Cumulative sums of GC content and strand bias of k-mers of every K sorted by strand bias in descending
+    order. Mean of top or bottom N % of k-mers of any K is read from them in constant time, so data for
+    different margins are computed without touching the k-mers again.
+    """
+
+    def __init__(self, df_all):
+        ordered = df_all.sort_values(by=["k", "strand_bias_%"], ascending=[True, False], kind="mergesort")
+        sizes = ordered.groupby("k", sort=True).size()
+        self.kmers = list(sizes.index)
+        self.sizes = sizes.values
+        self.starts = np.concatenate(([0], np.cumsum(self.sizes)[:-1]))
+        self.gc_cumsum = np.concatenate(([0], np.cumsum(ordered["GC_%"].values, dtype=np.float64)))
+        self.bias_cumsum = np.concatenate(([0], np.cumsum(ordered["strand_bias_%"].values, dtype=np.float64)))
+        self.nbytes = self.sizes.nbytes + self.starts.nbytes + self.gc_cumsum.nbytes + self.bias_cumsum.nbytes
+
+    def means(self, start, stop):
+        """
+        :return: tuple of mean GC content and mean strand bias of sorted rows in range [start, stop)
+        """
+        n = stop - start
+        return ((self.gc_cumsum[stop] - self.gc_cumsum[start]) / n,
+                (self.bias_cumsum[stop] - self.bias_cumsum[start]) / n)
+
+
+def calculate_gc_plot_data(df_all, margin, sweep=None):
+    """
+    Function to calculate mean GC content and strand bias of top and bottom margin % of k-mers for each K.
+    :param df_all: dataframe with k-mers of all K
+    :param margin: number of percent of k-mers taken from top and bottom
+    :param sweep: GCSweep of df_all, built if not given
+    :return: CalculatedGCData or None if no K has enough k-mers
+    """
     if df_all is None:
         return None
+    if sweep is None:
+        sweep = GCSweep(df_all)
     data = CalculatedGCData()
-    for i in df_all["k"].unique():
-        df = df_all[df_all["k"] == i]
-        if df is None or len(get_n_percent(df, margin).index) == 0:
-            # skip DF if it's None or has too little values for retrieving N percent
+    for k, start, size in zip(sweep.kmers, sweep.starts, sweep.sizes):
+        n = int(size * (margin / 100))
+        if n == 0:
+            # skip K which has too little values for retrieving N percent
             continue
-        data.kmers.append(i)
-        df_head = get_n_percent(df, margin)  # get N percent with the highest bias
-        #print("head is ", df_head)
-        data.upper_gc.append(None if len(df_head.index) == 0 else round(df_head["GC_%"].mean(), 2))
-        data.upper_biases.append(None if len(df_head.index) == 0 else round(df_head["strand_bias_%"].mean(), 2))
+        data.kmers.append(k)
+        upper_gc, upper_bias = sweep.means(start, start + n)  # N percent with the highest bias
+        data.upper_gc.append(round(upper_gc, 2))
+        data.upper_biases.append(round(upper_bias, 2))
 
-        df_tail = get_n_percent(df, margin, True)  # get N percent with the lowest bias
-        data.lower_gc.append(None if len(df_head.index) == 0 else round(df_tail["GC_%"].mean(), 2))
-        data.lower_biases.append(None if len(df_head.index) == 0 else round(df_tail["strand_bias_%"].mean(), 2))
+        lower_gc, lower_bias = sweep.means(start + size - n, start + size)  # N percent with the lowest bias
+        data.lower_gc.append(round(lower_gc, 2))
+        data.lower_biases.append(round(lower_bias, 2))
 
     if not data.kmers:  # no dataframe is big enough to provide data
         return None
     return data
 
 
+def calculate_ci_data(df, z=1.96):
+    """
+    Function to calculate mean strand bias of every bin and its confidence interval.
+    :param df: dataframe with k-mers of all bins
+    :param z: z-score of confidence level
+    :return: dict of columns base (bin), mean, stdev, count, lower and upper (bounds of interval)
+    """
+    stats = df.groupby("bin", sort=True)["strand_bias_%"].agg(["mean", "std", "count"])
+    confidence_interval = z * stats["std"].values / np.sqrt(stats["count"].values)
+    return dict(
+        base=stats.index.values,
+        mean=stats["mean"].values,
+        stdev=stats["std"].values,
+        count=stats["count"].values,
+        lower=stats["mean"].values - confidence_interval,
+        upper=stats["mean"].values + confidence_interval,
+    )
+
+
+def decimate(x, y, buckets=1000, extremes=500):
+    """
+    Function to select representative subset of scatter plot points, which keeps its outline and outliers.
+    X axis is split to equally wide buckets and points with the lowest and the highest y of each bucket
+    are selected, together with points with the highest absolute value of y.
+    :param x: array of x coordinates
+    :param y: array of y coordinates
+    :param buckets: number of buckets of x axis
+    :param extremes: number of points with the highest |y| to keep
+    :return: sorted array of positions of selected points
+    """
+    n = len(x)
+    if n <= 2 * buckets + extremes:
+        return np.arange(n)
+    edges = np.linspace(x.min(), x.max(), buckets + 1)
+    bucket = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, buckets - 1)
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket[order], np.arange(buckets), side="left")
+    stops = np.searchsorted(bucket[order], np.arange(buckets), side="right")
+    nonempty = stops > starts
+    lowest = order[starts[nonempty]]
+    highest = order[stops[nonempty] - 1]
+    outliers = np.argpartition(-np.abs(y), extremes)[:extremes]
+    return np.unique(np.concatenate((lowest, highest, outliers)))
+
+
+def points_in_polygon(x, y, px, py):
+    """
+    Function to find which points lie inside of a polygon, by counting crossings of a ray cast from every point
+    with edges of the polygon.
+    :param x: array of x coordinates of points
+    :param y: array of y coordinates of points
+    :param px: x coordinates of vertices of the polygon
+    :param py: y coordinates of vertices of the polygon
+    :return: boolean array, True for points inside of the polygon
+    """
+    px, py = np.asarray(px, dtype=float), np.asarray(py, dtype=float)
+    inside = np.zeros(len(x), dtype=bool)
+    for x0, y0, x1, y1 in zip(px, py, np.roll(px, 1), np.roll(py, 1)):
+        if y0 == y1:
+            continue
+        crosses = (y0 > y) != (y1 > y)
+        inside ^= crosses & (x < x0 + (y - y0) * (x1 - x0) / (y1 - y0))
+    return inside
+
+
+IUPAC_NUCLEOTIDES = {
+    "A": "A", "C": "C", "G": "G", "T": "T", "U": "T", "R": "AG", "Y": "CT", "S": "CG", "W": "AT",
+    "K": "GT", "M": "AC", "B": "CGT", "D": "AGT", "H": "ACT", "V": "ACG", "N": "ACGT",
+}
+# degenerate motif is expanded to at most this many concrete prefixes, its remaining positions filter the matches
+MAX_MOTIF_EXPANSIONS = 4096
+
+
+class KmerIndex:
+    """
+    Index of k-mers of one length, encoded by payload.encode_kmers, for motif search. Codes of k-mers and of
+    their rev. complements are rotated left by every offset and sorted, so k-mers having motif at given offset
+    on either strand form ranges of one rotation, which are found by binary search instead of a scan.
+    """
+
+    def __init__(self, seq, rev_complement):
+        """
+        :param seq: array of k-mer codes
+        :param rev_complement: array of codes of their rev. complements
+        """
+        codes = np.concatenate((seq, rev_complement)).astype(np.int64)
+        self.size = len(seq)
+        self.k = (int(codes.max()).bit_length() - 1) // 2 if len(codes) else 0
+        if len(codes) and (codes.min() < 4 or ((codes >> (2 * self.k)) != 1).any()):
+            raise ValueError("k-mers are not encoded or differ in length")
+        mask = (1 << (2 * self.k)) - 1
+        bits = codes & mask
+        rows = np.tile(np.arange(self.size, dtype=np.int32), 2)
+        self.rotations = []
+        for offset in range(self.k):
+            rotated = (((bits << (2 * offset)) & mask) | (bits >> (2 * (self.k - offset)))).astype(np.uint32)
+            # stable sort of 32 bit integers is a radix sort
+            order = np.argsort(rotated, kind="stable")
+            self.rotations.append((rotated[order], rows[order]))
+        self.nbytes = sum(codes.nbytes + rows.nbytes for codes, rows in self.rotations)
+
+    def search(self, motif):
+        """
+        Find k-mers containing motif, on their strand or on the strand of their rev. complement.
+        :param motif: sequence of IUPAC nucleotide codes, at most K long
+        :return: sorted array of positions of matching k-mers
+        """
+        motif = motif.strip().upper().replace("U", "T")
+        if not motif:
+            return np.array([], dtype=np.int64)
+        unknown = sorted(set(motif) - set(IUPAC_NUCLEOTIDES))
+        if unknown:
+            raise ValueError("unknown nucleotide codes {}".format(", ".join(unknown)))
+        if len(motif) > self.k:
+            raise ValueError("motif {} is longer than K={}".format(motif, self.k))
+
+        allowed = [np.array(["ACGT".index(n) for n in IUPAC_NUCLEOTIDES[c]]) for c in motif]
+        prefixes, length = np.zeros(1, dtype=np.int64), 0
+        while length < len(motif) and len(prefixes) * len(allowed[length]) <= MAX_MOTIF_EXPANSIONS:
+            prefixes = ((prefixes[:, None] << 2) | allowed[length][None, :]).ravel()
+            length += 1
+        shift = 2 * (self.k - length)
+        # bounds of the dtype of the index, searching with other dtype would convert the whole index
+        lower, upper = (prefixes << shift).astype(np.uint32), ((prefixes + 1) << shift).astype(np.uint32)
+
+        matches = []
+        for codes, rows in self.rotations[:self.k - len(motif) + 1]:
+            found = _ranges(np.searchsorted(codes, lower), np.searchsorted(codes, upper))
+            if length < len(motif):
+                rotated = codes[found]
+                keep = np.ones(len(found), dtype=bool)
+                for i in range(length, len(motif)):
+                    keep &= np.isin((rotated >> (2 * (self.k - 1 - i))) & 3, allowed[i])
+                found = found[keep]
+            matches.append(rows[found])
+        return np.unique(np.concatenate(matches)).astype(np.int64)
+
+
+def _ranges(starts, stops):
+    # positions of all ranges [start, stop) concatenated
+    lengths = stops - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.array([], dtype=np.int64)
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+
+
 def select_more_frequent(row, seq=False):
     """
     Fuction to return count (sequence if seq=True) of sequence or its rev. complement based on which is more frequent.